@@ -0,0 +1,571 @@
+"""
+Benchmark suite for the desktop assistant's hot paths.
+
+pyttsx3, speech_recognition, pyautogui, webbrowser, psutil, pywhatkit and
+pyjokes are replaced with in-process fakes before main.py is imported, so the
+numbers measure our code rather than the desktop.
+
+Run:
+    python bench.py                          # everything, print results
+    python bench.py --quick                  # smaller music trees
+    python bench.py --out results.json       # write machine-readable results
+    python bench.py --baseline base.json     # exit 1 if any metric regressed
+    python bench.py --save-baseline base.json
+"""
+
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+# ------------------- FAKE BACKENDS -------------------
+
+def _module(name, **attrs):
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    return m
+
+
+class _FakeVoice:
+    id = 'fake-voice'
+
+
+class _FakeEngine:
+    def __init__(self):
+        self._props = {'voices': [_FakeVoice()], 'rate': 200}
+
+    def getProperty(self, name):
+        return self._props.get(name)
+
+    def setProperty(self, name, value):
+        self._props[name] = value
+
+    def connect(self, name, cb):
+        return cb
+
+    def say(self, text):
+        pass
+
+    def save_to_file(self, text, path):
+        pass
+
+    def runAndWait(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _FakeAudio:
+    def __init__(self, frame_data=b'', sample_rate=16000, sample_width=2):
+        self.frame_data = frame_data
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+
+    def get_raw_data(self, **kwargs):
+        return self.frame_data
+
+
+class _FakeRecognizer:
+    energy_threshold = 300
+    pause_threshold = 0.8
+    dynamic_energy_threshold = True
+
+    def adjust_for_ambient_noise(self, source, duration=1):
+        pass
+
+    def listen(self, source, timeout=None, phrase_time_limit=None):
+        return _FakeAudio(b'\0\0' * 1600)
+
+    def recognize_google(self, audio, language=None, show_all=False):
+        return {'alternative': [{'transcript': 'time', 'confidence': 0.9}]} if show_all else 'time'
+
+
+class _FakeMicrophone:
+    SAMPLE_RATE = 16000
+    SAMPLE_WIDTH = 2
+    CHUNK = 1024
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_VM = collections.namedtuple('svmem', 'total available percent used free')
+_DU = collections.namedtuple('sdiskusage', 'total used free percent')
+_NET = collections.namedtuple('snetio', 'bytes_sent bytes_recv')
+_DIO = collections.namedtuple('sdiskio', 'read_bytes write_bytes')
+
+
+class _FakeProcess:
+    def __init__(self, pid):
+        mem = types.SimpleNamespace(rss=(pid * 7919 % 500) << 20)
+        self.info = {'pid': pid, 'name': f'proc{pid}', 'memory_info': mem, 'cpu_percent': pid % 13}
+
+
+def install_fakes():
+    """Put fake desktop modules into sys.modules (before main.py is imported)."""
+    counter = {'io': 0}
+
+    def io_counters():
+        counter['io'] += 4096
+        return counter['io']
+
+    fakes = {
+        'pyttsx3': _module('pyttsx3', init=lambda *a, **k: _FakeEngine()),
+        'speech_recognition': _module(
+            'speech_recognition', Recognizer=_FakeRecognizer, Microphone=_FakeMicrophone, AudioData=_FakeAudio,
+            WaitTimeoutError=type('WaitTimeoutError', (Exception,), {}),
+            UnknownValueError=type('UnknownValueError', (Exception,), {}),
+            RequestError=type('RequestError', (Exception,), {})),
+        'pyautogui': _module('pyautogui', press=lambda *a, **k: None, screenshot=lambda *a, **k: None,
+                             size=lambda: (1920, 1080)),
+        'webbrowser': _module('webbrowser', open=lambda url, *a, **k: True),
+        'pywhatkit': _module('pywhatkit', playonyt=lambda q: None),
+        'pyjokes': _module('pyjokes', get_joke=lambda: 'A fake joke.'),
+        'psutil': _module(
+            'psutil',
+            cpu_percent=lambda interval=None, percpu=False: [12.0, 8.0, 20.0, 4.0] if percpu else 11.0,
+            cpu_count=lambda logical=True: 4,
+            virtual_memory=lambda: _VM(16 << 30, 8 << 30, 50.0, 8 << 30, 8 << 30),
+            sensors_battery=lambda: None,
+            disk_usage=lambda path: _DU(1 << 40, 1 << 39, 1 << 39, 50.0),
+            net_io_counters=lambda: _NET(io_counters(), io_counters()),
+            disk_io_counters=lambda: _DIO(io_counters(), io_counters()),
+            process_iter=lambda attrs=None: iter([_FakeProcess(pid) for pid in range(1, 300)])),
+    }
+    sys.modules.update(fakes)
+    return fakes
+
+
+install_fakes()
+import main  # noqa: E402  (must come after the fakes)
+
+main.tracer.path = None  # keep benchmark commands out of the user's trace file
+
+# ------------------- BENCHMARKS -------------------
+
+SAMPLE_QUERIES = (
+    'open youtube', 'play despacito on youtube', 'play music', 'time', 'what is the time',
+    'date', 'screenshot', 'system info', 'status', 'tell me a joke', 'open notepad',
+    'open file', 'search python threading', 'volume up', 'brightness 40',
+    'chat how are you', 'remind me in 10 seconds to stretch', 'how tall is everest',
+)
+# Commands cheap enough to run through the full engine thousands of times.
+ENGINE_QUERIES = (
+    'open youtube', 'play despacito on youtube', 'time', 'what is the time', 'date',
+    'tell me a joke', 'open notepad', 'search python threading', 'volume up',
+    'chat how are you', 'how tall is everest', 'list reminders',
+)
+
+
+def _timeit(fn, rounds, repeat=3):
+    """Best-of-`repeat` mean seconds per call."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(rounds):
+            fn(i)
+        secs = (time.perf_counter() - start) / rounds
+        best = secs if best is None else min(best, secs)
+    return best
+
+
+def _noop(q, **args):
+    pass
+
+
+def build_router(extra_intents: int, seed: int = 0):
+    """Builtin intents plus `extra_intents` synthetic user-defined ones."""
+    rng = random.Random(seed)
+    router = main.register_intents(main.IntentRouter(fallback=lambda q: None),
+                                   {name: _noop for name, _, _ in main.BUILTIN_INTENTS})
+    for i in range(extra_intents):
+        mode = rng.choice(('prefix', 'contains', 'exact'))
+        router.register(f'user_{i}', f'macro{i} step{rng.randrange(50)} {{arg}}', _noop, mode)
+    return router
+
+
+def bench_router(sizes=(0, 200, 2000, 20000), rounds=20000):
+    """Router match latency as user-defined intents grow; it should stay flat."""
+    results = {}
+    for n in sizes:
+        router = build_router(n)
+        queries = list(SAMPLE_QUERIES) + [f'macro{i} step1 go' for i in range(0, max(n, 1), max(n // 8, 1))]
+        secs = _timeit(lambda i: router.match(queries[i % len(queries)]), rounds)
+        results[f'router.match_us.{n}_extra'] = secs * 1e6
+    return results
+
+
+def bench_handle_query(rounds=20000):
+    """Full handle_query (route + handler + sinks) on a headless inline engine."""
+    main.install_sinks(main.NullSinks())
+    engine = main.AssistantEngine(log_fn=lambda s: None, inline=True, reminders_path=None, history_path=None,
+                                  macros_path=None, app_usage_path=None)
+    results = {}
+    for enabled, name in ((False, 'engine.handle_query_us'), (True, 'engine.handle_query_traced_us')):
+        main.tracer.enabled = enabled
+        secs = _timeit(lambda i: engine.handle_query(ENGINE_QUERIES[i % len(ENGINE_QUERIES)]), rounds)
+        results[name] = secs * 1e6
+    engine.shutdown()
+    return results
+
+
+def bench_log(lines=200_000, writers=4):
+    """AssistantGUI.log throughput: writers on worker threads, batches drained like the Tk tick."""
+    with tempfile.TemporaryDirectory() as tmp:
+        log = main.SessionLog(os.path.join(tmp, 'session.log'))
+        per_writer = lines // writers
+        start = time.perf_counter()
+        threads = [threading.Thread(target=lambda: [log.write(f'line {i}') for i in range(per_writer)])
+                   for _ in range(writers)]
+        for t in threads:
+            t.start()
+        drained = 0
+        while any(t.is_alive() for t in threads) or log.pending:
+            drained += len(log.drain())
+        elapsed = time.perf_counter() - start
+        log.close()
+        assert drained == per_writer * writers
+    return {'log.lines_per_sec': drained / elapsed, 'log.us_per_line': elapsed / drained * 1e6}
+
+
+def bench_run_background(burst=2000, repeat=3):
+    """Submit a burst of tiny tasks through run_background and wait for all of them."""
+    main.install_sinks(main.NullSinks())
+    engine = main.AssistantEngine(log_fn=lambda s: None, reminders_path=None, history_path=None, macros_path=None,
+                                  app_usage_path=None)
+    engine.executor.max_queued = burst
+    threads_before = threading.active_count()
+    submit = total = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        futures = [engine.run_background(lambda log: None) for _ in range(burst)]
+        submitted = time.perf_counter()
+        for f in futures:
+            f.result()
+        done = time.perf_counter()
+        submit = min(submit or 1e9, submitted - start)
+        total = min(total or 1e9, done - start)
+    extra_threads = threading.active_count() - threads_before
+    engine.shutdown()
+    return {
+        'run_background.submit_us': submit / burst * 1e6,
+        'run_background.burst_ms': total * 1000,
+        'run_background.extra_threads': extra_threads,
+    }
+
+
+def _make_music_tree(root, files, per_dir=500):
+    for i in range(files):
+        d = os.path.join(root, f'artist{i // per_dir}')
+        if i % per_dir == 0:
+            os.makedirs(d)
+        open(os.path.join(d, f'Artist{i // per_dir} - Song {i}.mp3'), 'w').close()
+
+
+def bench_music_scan(sizes=(10_000, 100_000)):
+    """Full scan, no-op re-scan and search on synthetic music trees."""
+    results = {}
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, 'music')
+            _make_music_tree(root, n)
+            lib = main.MusicLibrary(root, os.path.join(tmp, 'index.json'))
+            t0 = time.perf_counter()
+            lib.scan()
+            t1 = time.perf_counter()
+            lib.save()
+            t2 = time.perf_counter()
+            lib.scan()
+            t3 = time.perf_counter()
+            search = _timeit(lambda i: lib.search(f'artist{i % 20} song'), 200)
+            assert len(lib) == n
+            results[f'music.scan_s.{n}'] = t1 - t0
+            results[f'music.save_s.{n}'] = t2 - t1
+            results[f'music.rescan_ms.{n}'] = (t3 - t2) * 1000
+            results[f'music.search_us.{n}'] = search * 1e6
+    return results
+
+
+def bench_cold_start(runs=3):
+    """Wall time of a fresh interpreter importing main.py (with the fakes)."""
+    code = 'import bench'
+    here = os.path.dirname(os.path.abspath(__file__))
+    best_total = None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=here, check=True)
+        total = time.perf_counter() - t0
+        best_total = total if best_total is None else min(best_total, total)
+    baseline = None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        total = time.perf_counter() - t0
+        baseline = total if baseline is None else min(baseline, total)
+    return {'startup.import_ms': (best_total - baseline) * 1000}
+
+
+def bench_reminders(count=100_000):
+    """Schedule `count` reminders: thread count must stay flat and memory bounded."""
+    import tracemalloc
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fired = []
+        sched = main.ReminderScheduler(fired.append, path=f'{tmp}/reminders.json')
+        sched.start()
+        threads_before = threading.active_count()
+        tracemalloc.start()
+        now = time.time()
+        start = time.perf_counter()
+        for i in range(count):
+            sched.add(f'reminder {i}', now + 3600 + i)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        for i in range(1, count * 3 // 4):
+            sched.cancel(i)
+        sched.add('soon', time.time() + 0.05)
+        time.sleep(0.3)
+        heap_after_cancel = len(sched._heap)
+        tracemalloc.stop()
+        threads_after = threading.active_count()
+        sched.stop()
+        assert threads_after == threads_before, 'reminders must not start threads'
+        assert heap_after_cancel <= 2 * len(sched) + 64, 'stale heap entries must be compacted'
+        assert fired and fired[-1].message == 'soon'
+        return {'reminders.add_us': elapsed / count * 1e6, 'reminders.bytes_each': peak / count}
+
+
+def bench_knowledge(entries=50_000):
+    """Index a synthetic FAQ file, then time uncached and cached answers."""
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'faq.txt'), 'w', encoding='utf-8') as f:
+            for i in range(entries):
+                f.write(f'Q: how do I configure widget {i} on server {i % 97}?\nA: run setup {i}\n\n')
+        kb = main.KnowledgeBase(tmp)
+        t0 = time.perf_counter()
+        kb.refresh(force=True)
+        index = time.perf_counter() - t0
+        assert len(kb) == entries
+        assert kb.answer('configure widget 4242') == 'run setup 4242'
+        search = _timeit(lambda i: kb.search(f'configure widget {i * 13} server {i % 97}'), 200)
+        cached = _timeit(lambda i: kb.answer('configure widget 4242'), 2000)
+        return {'knowledge.index_s': index, 'knowledge.search_ms': search * 1000,
+                'knowledge.cached_us': cached * 1e6}
+
+
+def bench_apps(launchers=5000):
+    """Scan a synthetic applications directory and time exact, alias and fuzzy app lookups."""
+    with tempfile.TemporaryDirectory() as tmp:
+        appdir = os.path.join(tmp, 'applications')
+        bindir = os.path.join(tmp, 'bin')
+        os.makedirs(appdir)
+        os.makedirs(bindir)
+        for name in [f'tool{i}' for i in range(launchers)] + ['firefox', 'code', 'spotify']:
+            with open(os.path.join(appdir, f'{name}.desktop'), 'w') as f:
+                f.write(f'[Desktop Entry]\nType=Application\nName={name}\nExec={name} %U\n')
+        with open(os.path.join(appdir, 'editor.desktop'), 'w') as f:
+            f.write('[Desktop Entry]\nType=Application\nName=My Editor\nExec="/opt/Some Vendor/myedit" %F\n')
+        with open(os.path.join(appdir, 'htop.desktop'), 'w') as f:
+            f.write('[Desktop Entry]\nType=Application\nName=Htop\nExec=htop\nTerminal=true\n')
+        for name in ('xterm', 'htop', 'reboot'):
+            path = os.path.join(bindir, name)
+            open(path, 'w').close()
+            os.chmod(path, 0o755)
+        idx = main.AppIndex(os.path.join(tmp, 'apps.json'), os.path.join(tmp, 'usage.json'),
+                            sources=[(appdir, True)], search_path=bindir)
+        t0 = time.perf_counter()
+        idx.refresh()
+        scan = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        idx.scan()
+        rescan = time.perf_counter() - t1
+        assert idx.find('vs code')[0] == 'code'
+        assert idx.find('spotfy')[0] == 'spotify'
+        assert idx.find('myedit')[2] == "'/opt/Some Vendor/myedit'"
+        assert idx.find('xterm')[1] == 'exe'
+        assert idx.find('htop') is None and idx.find('reboot') is None and idx.find('xtrm') is None, \
+            'PATH programs: exact and allowed only'
+        exact = _timeit(lambda i: idx.find('firefox'), 2000)
+        fuzzy = _timeit(lambda i: idx.find(('spotfy', 'fire fax', 'tol 123')[i % 3]), 500)
+        return {'apps.scan_ms': scan * 1000, 'apps.rescan_ms': rescan * 1000,
+                'apps.find_exact_us': exact * 1e6, 'apps.find_fuzzy_us': fuzzy * 1e6}
+
+
+def bench_history(entries=200_000):
+    """Load a large history file, then time recording and as-you-type completion."""
+    rng = random.Random(0)
+    verbs = ('open', 'play', 'search', 'remind me in', 'what is', 'chat', 'volume', 'take')
+    now = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'history.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for i in range(entries):
+                text = f'{rng.choice(verbs)} item {rng.randrange(entries)} thing'
+                f.write(json.dumps([text, now - rng.randrange(10 ** 7)]) + '\n')
+        history = main.CommandHistory(path)
+        t0 = time.perf_counter()
+        history.load()
+        load = time.perf_counter() - t0
+        record = _timeit(lambda i: history.record(f'play item {i} thing'), 200)
+        typed = 'search item 1234 thing'
+        suggest = _timeit(lambda i: history.suggest(typed[:1 + i % len(typed)]), 2000)
+        assert history.suggest('search item 1')
+        return {'history.load_s': load, 'history.record_us': record * 1e6,
+                'history.suggest_us': suggest * 1e6}
+
+
+def bench_hands_free(seconds=60):
+    """Detector cost on quiet room noise with a few tone bursts, as a share of real time."""
+    import array
+    import math
+    import wave
+
+    rng = random.Random(0)
+    rate = main.HF_SAMPLE_RATE
+    samples = array.array('h', (int(rng.gauss(0, 60)) for _ in range(seconds * rate)))
+    for start in range(5, seconds, 10):  # a 0.5 s tone every 10 s keeps the VAD honest
+        for i in range(rate // 2):
+            samples[start * rate + i] = int(5000 * math.sin(2 * math.pi * 440 * i / rate))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'room.wav')
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(samples.tobytes())
+        listener = main.HandsFreeListener(lambda text: None, main.WakeWordMatcher(), log_fn=lambda s: None)
+        cpu0 = time.process_time()
+        listener.start(main.WavFileSource(path))
+        listener.join()
+        cpu = time.process_time() - cpu0
+    frames = listener.stats['frames']
+    assert listener.stats['segments'] == len(range(5, seconds, 10)), listener.stats
+    return {'hands_free.cpu_pct': cpu / seconds * 100, 'hands_free.frame_us': cpu / frames * 1e6}
+
+
+def bench_levels(burst=200):
+    """A burst of volume commands must reach the backend as one batch."""
+    backend = main.FakeLevelBackend(level=0)
+    controller = main.LevelController('volume', backend, debounce=0.05)
+    start = time.perf_counter()
+    for i in range(burst):
+        controller.change(1 if i % 4 else -1)
+    queued = time.perf_counter() - start
+    time.sleep(0.2)
+    controller.close()
+    assert backend.applied == [burst // 2], backend.applied
+    return {'levels.request_us': queued / burst * 1e6, 'levels.backend_calls': len(backend.applied)}
+
+
+def bench_compound(steps=4, delay=0.05):
+    """One stage of `steps` independent commands, then one more: should take ~2 delays, not 5."""
+    engine = main.AssistantEngine(log_fn=lambda s: None, reminders_path=None, history_path=None, macros_path=None,
+                                  app_usage_path=None)
+    engine.router.register('nap', 'nap {n}', lambda q, **a: engine.run_background(lambda log: time.sleep(delay)))
+    plan = main.CommandPlan('compound', 'bench', [[f'nap {i}' for i in range(steps)], ['nap last']])
+    start = time.perf_counter()
+    assert engine.run_plan(plan).wait(10)
+    wall = time.perf_counter() - start
+    engine.shutdown()
+    assert wall < delay * (steps + 1), f'steps did not overlap: {wall:.3f}s'
+    return {'compound.wall_ms': wall * 1000, 'compound.overhead_ms': (wall - 2 * delay) * 1000}
+
+
+# Metrics where bigger is better; everything else is a cost.
+HIGHER_IS_BETTER = {'log.lines_per_sec'}
+# Counters compared exactly rather than with a tolerance.
+EXACT = {'run_background.extra_threads', 'levels.backend_calls'}
+
+
+def run_all(quick=False):
+    metrics = {}
+    suites = [
+        ('router', bench_router),
+        ('handle_query', bench_handle_query),
+        ('log', bench_log),
+        ('run_background', bench_run_background),
+        ('music', lambda: bench_music_scan((10_000,) if quick else (10_000, 100_000))),
+        ('cold start', bench_cold_start),
+        ('reminders', lambda: bench_reminders(20_000 if quick else 100_000)),
+        ('apps', bench_apps),
+        ('hands-free', bench_hands_free),
+        ('history', lambda: bench_history(50_000 if quick else 200_000)),
+        ('knowledge', lambda: bench_knowledge(10_000 if quick else 50_000)),
+        ('levels', bench_levels),
+        ('compound', bench_compound),
+    ]
+    for name, fn in suites:
+        t0 = time.perf_counter()
+        result = fn()
+        metrics.update(result)
+        print(f'{name} ({time.perf_counter() - t0:.1f}s)', file=sys.stderr)
+        for k, v in result.items():
+            print(f'  {k:<36} {v:12.3f}', file=sys.stderr)
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    """Return regression messages for metrics worse than baseline by more than `tolerance`."""
+    failures = []
+    for name, base in baseline.items():
+        cur = metrics.get(name)
+        if cur is None:
+            continue
+        if name in EXACT:
+            worse = cur > base
+        elif name in HIGHER_IS_BETTER:
+            worse = cur < base * (1 - tolerance)
+        else:
+            worse = cur > base * (1 + tolerance)
+        if worse:
+            failures.append(f'{name}: {cur:.3f} vs baseline {base:.3f}')
+    return failures
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--quick', action='store_true', help='smaller music trees and reminder counts')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against this JSON file and exit 1 on regression')
+    parser.add_argument('--save-baseline', help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative slowdown before a metric counts as a regression')
+    args = parser.parse_args(argv)
+
+    metrics = run_all(args.quick)
+    report = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                 'quick': args.quick, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'metrics': metrics,
+    }
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['metrics']
+        failures = compare(metrics, baseline, args.tolerance)
+        if failures:
+            print('PERFORMANCE REGRESSION:', file=sys.stderr)
+            for line in failures:
+                print(f'  {line}', file=sys.stderr)
+            return 1
+        print(f'No regressions against {args.baseline}.', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -7,192 +7,5065 @@ Features:
 - Take screenshots, system info, jokes
 - Open apps, shutdown/restart
 - Chatbot (rule-based fallback)
-- System controls: volume (media keys), brightness (Windows via PowerShell)
+- System controls: volume (media keys), brightness (PowerShell on Windows, sysfs on Linux)
 - File/folder open, reminders, save logs, always-on-top toggle
+- Compound commands ("take a screenshot and tell time then play music") and named macros
 
 Requirements:
 - Python 3.8+
 - pip install pyttsx3 SpeechRecognition pywhatkit pyautogui psutil pyjokes Pillow
 - On Windows: pyaudio (install via pipwin if needed)
 
-Run: python desktop_assistant_gui_full.py
+Run: python main.py
+Headless: python main.py --batch commands.txt [--sinks null|print|real] [--quiet]
 """
 
-import threading
 import time
+_MODULE_START = time.perf_counter()
+import threading
+import queue
+import itertools
+import collections
+import json
+import hashlib
+import heapq
+import bisect
+import math
+import importlib
+import multiprocessing
 import os
 import random
+import re
 import datetime
 import webbrowser as wb
 from pathlib import Path
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import shlex
+import shutil
 import subprocess
+import sys
+import wave
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
+
+# ------------------- LAZY IMPORTS -------------------
+IMPORT_TIMES = {}   # module name -> seconds spent importing it
+
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    t0 = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    IMPORT_TIMES[self._name] = time.perf_counter() - t0
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+pyttsx3 = LazyModule('pyttsx3')
+sr = LazyModule('speech_recognition')
+pywhatkit = LazyModule('pywhatkit')
+pyautogui = LazyModule('pyautogui')
+psutil = LazyModule('psutil')
+pyjokes = LazyModule('pyjokes')
+
+# Warmed in this order once the window is up; pywhatkit is slowest, so it goes last.
+WARM_MODULES = (psutil, pyjokes, sr, pyautogui, pywhatkit)
+
+
+def warm_imports(modules=WARM_MODULES):
+    for module in modules:
+        try:
+            module.load()
+        except Exception as e:
+            print(f'Could not load {module._name}: {e}')
+
+# ------------------- CONFIG -------------------
+
+
+def _user_name():
+    # os.getlogin() fails without a controlling terminal (services, CI, cron)
+    try:
+        return os.getlogin()
+    except OSError:
+        return os.environ.get('USERNAME') or os.environ.get('USER') or 'user'
+
+
+USER_NAME = _user_name()
+APP_DIR = Path.home() / '.desktop_assistant'
+MUSIC_FOLDER = Path.home() / 'Music' / 'Playlists'
+MUSIC_INDEX_FILE = APP_DIR / 'music_index.json'
+MUSIC_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.aac', '.wma')
+STATUS_REFRESH_MS = 250
+DEFAULT_APPS = {
+    'notepad': 'notepad.exe',
+    'calculator': 'calc.exe',
+    'chrome': r'C:\Program Files\Google\Chrome\Application\chrome.exe',
+    'vscode': fr'C:\Users\{USER_NAME}\AppData\Local\Programs\Microsoft VS Code\Code.exe'
+}
+
+# ------------------- TRACING -------------------
+TRACE_FILE = APP_DIR / 'traces' / 'traces.jsonl'
+TRACE_FILE_MAX_BYTES = 4 * 1024 * 1024
+TRACE_FILES_KEPT = 3          # rotated files kept next to the live one
+
+
+class LatencyHistogram:
+    """HDR-style histogram of microsecond latencies.
+
+    Values below 256 us are counted exactly. Above that, each power of two is
+    split into 128 linear sub-buckets, so any reported percentile is within
+    about 1% of the true value, and memory stays bounded whatever the range.
+    """
+
+    __slots__ = ('counts', 'total', 'max_us', 'sum_us')
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max_us = 0
+        self.sum_us = 0
+
+    @staticmethod
+    def _index(v):
+        if v < 256:
+            return v
+        shift = v.bit_length() - 8
+        return 256 + (shift - 1) * 128 + ((v >> shift) - 128)
+
+    @staticmethod
+    def _value(i):
+        """Midpoint of bucket `i` in microseconds."""
+        if i < 256:
+            return i
+        shift, sub = divmod(i - 256, 128)
+        shift += 1
+        return ((128 + sub) << shift) + (1 << shift) // 2
+
+    def record(self, us):
+        v = max(0, int(us))
+        i = self._index(v)
+        self.counts[i] = self.counts.get(i, 0) + 1
+        self.total += 1
+        self.sum_us += v
+        if v > self.max_us:
+            self.max_us = v
+
+    def percentile(self, p):
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(self._value(i), self.max_us)
+        return self.max_us
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'trace', 'name', 'id', 'parent', 't0')
+
+    def __init__(self, tracer, trace, name):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.parent = stack[-1] if stack else 0
+        self.id = self.trace.new_id()
+        stack.append(self.id)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter()
+        self.tracer._stack().pop()
+        self.trace.add(self.name, self.t0, t1, self.parent, self.id)
+        return False
+
+
+class Trace:
+    """Spans recorded for one command, finished once every holder has released it.
+
+    The command itself holds the trace while it is routed; background tasks
+    and queued utterances started on its behalf hold it until they end.
+    """
+
+    def __init__(self, tracer, query):
+        self.tracer = tracer
+        self.query = query
+        self.intent = None
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        self.spans = []      # (name, t0, t1, parent id, id)
+        self._ids = itertools.count(1)
+        self._holds = 1
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        return next(self._ids)
+
+    def add(self, name, t0, t1, parent=0, span_id=None):
+        self.spans.append((name, t0, t1, parent, span_id or self.new_id()))
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+            done = self._holds == 0
+        if done:
+            self.tracer._finish(self)
+
+
+class _Activation:
+    __slots__ = ('tracer', 'trace', 'parent', 'saved')
+
+    def __init__(self, tracer, trace, parent):
+        self.tracer = tracer
+        self.trace = trace
+        self.parent = parent
+
+    def __enter__(self):
+        local = self.tracer._local
+        self.saved = (getattr(local, 'trace', None), getattr(local, 'stack', None))
+        local.trace = self.trace
+        local.stack = [self.parent] if self.parent else []
+        return self.trace
+
+    def __exit__(self, *exc):
+        self.tracer._local.trace, self.tracer._local.stack = self.saved
+        return False
+
+
+class Tracer:
+    """Per-command span trees, latency histograms and a rotating JSONL trace file.
+
+    The current trace is thread-local; work handed to another thread carries
+    it along via `activate`. With `enabled` false every entry point returns
+    None or a shared no-op span, so the cost is one attribute check.
+    """
+
+    def __init__(self, path=TRACE_FILE, enabled=True):
+        self.path = Path(path) if path else None
+        self.enabled = enabled
+        self.last = None          # (intent, total ms) of the latest finished command
+        self.histograms = {}      # intent or 'intent.stage' -> LatencyHistogram
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        if not self.enabled:
+            return None
+        return getattr(self._local, 'trace', None)
+
+    def current_span(self):
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else 0
+
+    def begin(self, query):
+        """Start a trace for a command; the caller holds it and must `release` it."""
+        if not self.enabled:
+            return None
+        return Trace(self, query)
+
+    def activate(self, trace, parent=0):
+        """Make `trace` current on this thread for a `with` block."""
+        return _Activation(self, trace, parent)
+
+    def span(self, name):
+        trace = self.current()
+        if trace is None:
+            return _NULL_SPAN
+        return _Span(self, trace, name)
+
+    # ---- results ----
+    def _finish(self, trace):
+        end = max([t1 for _, _, t1, _, _ in trace.spans] + [trace.start])
+        total_ms = (end - trace.start) * 1000
+        intent = trace.intent or 'unrouted'
+        with self._lock:
+            self.last = (intent, total_ms)
+            self._histogram(intent).record(total_ms * 1000)
+            for name, t0, t1, _, _ in trace.spans:
+                self._histogram(f'{intent}.{name.split(":")[0]}').record((t1 - t0) * 1e6)
+            if self.path is not None:
+                self._write({
+                    'ts': round(trace.wall, 3), 'query': trace.query, 'intent': intent,
+                    'total_ms': round(total_ms, 3),
+                    'spans': [{'id': sid, 'parent': parent, 'name': name,
+                               'start_ms': round((t0 - trace.start) * 1000, 3),
+                               'ms': round((t1 - t0) * 1000, 3)}
+                              for name, t0, t1, parent, sid in trace.spans],
+                })
+
+    def _histogram(self, key):
+        h = self.histograms.get(key)
+        if h is None:
+            h = self.histograms[key] = LatencyHistogram()
+        return h
+
+    def _write(self, record):
+        try:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            if self._file.tell() > TRACE_FILE_MAX_BYTES:
+                self._rotate()
+        except OSError:
+            pass
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(TRACE_FILES_KEPT - 1, 0, -1):
+            src = self.path.with_name(f'{self.path.stem}.{i}{self.path.suffix}')
+            if src.exists():
+                os.replace(src, self.path.with_name(f'{self.path.stem}.{i + 1}{self.path.suffix}'))
+        os.replace(self.path, self.path.with_name(f'{self.path.stem}.1{self.path.suffix}'))
+
+    def report(self):
+        """Rows of (name, count, p50, p95, p99, max) in ms, each intent followed by its stages."""
+        with self._lock:
+            items = sorted(self.histograms.items())
+        rows = []
+        for key, h in items:
+            if '.' in key:
+                continue
+            for name, hh in [(key, h)] + [(k, v) for k, v in items if k.startswith(key + '.')]:
+                rows.append((name, hh.total, hh.percentile(50) / 1000, hh.percentile(95) / 1000,
+                             hh.percentile(99) / 1000, hh.max_us / 1000))
+        return rows
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+tracer = Tracer()
+
+
+# ------------------- TTS SETUP -------------------
+TTS_RATE = 160
+TTS_VOICE_INDEX = 0
+
+# Lower numbers are spoken first; an utterance pre-empts anything less urgent.
+PRIORITY_ALERT = 0    # reminders, shutdown warnings
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9      # jokes and other chatter
+PRIORITY_RENDER = 10  # background pre-rendering into the audio cache
+
+TTS_CACHE_DIR = APP_DIR / 'tts_cache'
+TTS_CACHE_MAX_BYTES = 64 * 1024 * 1024
+TTS_CACHE_MAX_CHARS = 120   # longer one-off sentences are never rendered
+TTS_RENDER_AFTER_MISSES = 2  # a phrase outside common_phrases() is rendered once it has missed this often
+TTS_MISS_TRACKED = 1024      # distinct missed phrases remembered before the counts start over
+TTS_COMMON_PHRASES = (
+    'Hello! I am your desktop assistant. How can I help you?',
+    'Sorry, I did not get that.',
+    'System status shown in UI.',
+    'Music folder not found.',
+    'No music files found.',
+    'I am ready to chat. Say something.',
+)
+
+
+class Utterance:
+    """Handle returned by speak(). `wait()` blocks until it was spoken or cancelled."""
+
+    def __init__(self, worker, text, priority, coalesce=None):
+        self._worker = worker
+        self._done = threading.Event()
+        self.text = text
+        self.priority = priority
+        self.coalesce = coalesce
+        self.cancelled = False
+        self.render_only = False   # render into the audio cache, do not play
+        self.trace = None          # command trace this utterance was spoken for
+        self.trace_parent = 0
+        self.started = None
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def cancel(self):
+        if self._worker is not None:
+            self._worker.cancel(self)
+
+    def _finish(self):
+        trace, self.trace = self.trace, None
+        if trace is not None and self.started is not None:
+            trace.add('tts', self.started, time.perf_counter(), self.trace_parent)
+        self._done.set()
+        if trace is not None:
+            trace.release()
+
+    @classmethod
+    def finished(cls, text, priority=PRIORITY_NORMAL):
+        """An utterance that is already done (used where nothing is spoken)."""
+        u = cls(None, text, priority)
+        u._done.set()
+        return u
+
+
+class TtsCache:
+    """Size-bounded LRU of rendered speech on disk, keyed by (text, voice id, rate).
+
+    Each entry is a WAV file named by the key's hash. Recency survives
+    restarts through file mtimes, which are bumped on every hit.
+    """
+
+    def __init__(self, folder=None, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.folder = Path(folder or TTS_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._files = None    # key -> size, least recently used first
+        self._bytes = 0
+
+    @staticmethod
+    def key(text, voice, rate):
+        return hashlib.sha1(f'{voice}\0{rate}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _index(self):
+        if self._files is None:
+            entries = []
+            try:
+                with os.scandir(self.folder) as it:
+                    for e in it:
+                        if e.name.endswith('.wav'):
+                            st = e.stat()
+                            entries.append((st.st_mtime, e.name[:-4], st.st_size))
+            except OSError:
+                pass
+            entries.sort()
+            self._files = collections.OrderedDict((k, size) for _, k, size in entries)
+            self._bytes = sum(self._files.values())
+        return self._files
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index())
+
+    def get(self, key):
+        """Path of the cached audio for `key`, or None."""
+        with self._lock:
+            files = self._index()
+            if key not in files:
+                return None
+            files.move_to_end(key)
+        path = self.folder / f'{key}.wav'
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._bytes -= files.pop(key, 0)
+            return None
+        return path
+
+    def render_path(self, key):
+        """Where to render audio for `key` before handing it to `add`."""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        return self.folder / f'{key}.part'
+
+    def add(self, key, rendered):
+        path = self.folder / f'{key}.wav'
+        try:
+            size = os.path.getsize(rendered)
+            if not size:
+                raise OSError('empty render')
+            os.replace(rendered, path)
+        except OSError:
+            return None
+        with self._lock:
+            files = self._index()
+            self._bytes += size - files.pop(key, 0)
+            files[key] = size
+            while self._bytes > self.max_bytes and len(files) > 1:
+                old, old_size = files.popitem(last=False)
+                self._bytes -= old_size
+                try:
+                    os.remove(self.folder / f'{old}.wav')
+                except OSError:
+                    pass
+        return path
+
+    def stats(self):
+        with self._lock:
+            files = self._index()
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(files), 'bytes': self._bytes}
+
+
+def _time_fragments(m):
+    hour, minute, half = int(m.group(2)), int(m.group(3)), m.group(4)
+    minute = "o'clock" if minute == 0 else f'oh {minute}' if minute < 10 else str(minute)
+    return [m.group(1), str(hour), minute, half]
+
+
+def _date_fragments(m):
+    return [m.group(1), m.group(2), str(int(m.group(3))), m.group(4), m.group(5)]
+
+
+# Sentences spoken as a sequence of separately cached fragments.
+TTS_TEMPLATES = (
+    (re.compile(r'^(The current time is) (\d{1,2}):(\d{2}) ([AP]M)$'), _time_fragments),
+    (re.compile(r'^(Today is) (\w+), (\d{1,2}) (\w+) (\d{4})$'), _date_fragments),
+)
+
+
+def tts_fragments(text):
+    """The cacheable pieces `text` is spoken as: template fragments, or the text itself."""
+    for pattern, split in TTS_TEMPLATES:
+        m = pattern.match(text)
+        if m:
+            return split(m)
+    return [text]
+
+
+def common_phrases():
+    """Phrases and template fragments worth rendering before they are first needed."""
+    phrases = list(TTS_COMMON_PHRASES)
+    phrases += ['The current time is', 'AM', 'PM', "o'clock", 'Today is']
+    phrases += [str(h) for h in range(1, 13)]
+    phrases += [f'oh {m}' for m in range(1, 10)] + [str(m) for m in range(10, 60)]
+    phrases += [datetime.date(2024, 1, d).strftime('%A') for d in range(1, 8)]
+    phrases += [str(d) for d in range(1, 32)]
+    phrases += [datetime.date(2024, mo, 1).strftime('%B') for mo in range(1, 13)]
+    phrases.append(str(datetime.date.today().year))
+    return list(dict.fromkeys(phrases))
+
+
+def _audio_player():
+    """How cached WAV files are played here: 'winsound', a command list, or None."""
+    if os.name == 'nt':
+        return 'winsound'
+    for cmd in (['paplay'], ['aplay', '-q'], ['afplay']):
+        if shutil.which(cmd[0]):
+            return cmd
+    return None
+
+
+def _join_wavs(paths, out):
+    """Concatenate WAV files with identical formats into `out`."""
+    with wave.open(str(out), 'wb') as dst:
+        params = None
+        for p in paths:
+            with wave.open(str(p), 'rb') as src:
+                if params is None:
+                    params = src.getparams()
+                    dst.setparams(params)
+                elif src.getparams()[:3] != params[:3]:
+                    raise wave.Error('fragments differ in format')
+                dst.writeframes(src.readframes(src.getnframes()))
+    return out
+
+
+class SpeechWorker:
+    """Owns the pyttsx3 engine on a single thread and speaks from a priority queue.
+
+    - A more urgent utterance interrupts the current one, which is re-queued and
+      spoken again afterwards.
+    - Utterances sharing a `coalesce` key that are still waiting collapse into
+      one, and the latest text wins.
+    - Text whose audio (or every template fragment's audio) is in the TtsCache
+      is played from disk instead of being synthesized again; template
+      fragments that miss, and short phrases that keep missing, are rendered
+      in the background once nothing else is queued.
+    """
+
+    def __init__(self, voice_index=TTS_VOICE_INDEX, rate=TTS_RATE):
+        self.voice_index = voice_index
+        self.rate = rate
+        self.engine = None
+        self.init_ms = None
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._current = None
+        self._interrupt = False
+        self._thread = None
+        self.cache = TtsCache()
+        self._missed = collections.Counter()   # phrase -> cache misses, for the render policy
+        self._player = None
+        self._voice = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tts', daemon=True)
+                self._thread.start()
+
+    def say(self, text: str, priority=PRIORITY_NORMAL, coalesce=None) -> Utterance:
+        self.start()
+        with self._lock:
+            if coalesce is not None:
+                queued = self._pending.get(coalesce)
+                if queued is not None:
+                    queued.text = text
+                    return queued
+            u = Utterance(self, text, priority, coalesce)
+            u.trace = tracer.current()
+            if u.trace is not None:
+                u.trace.hold()
+                u.trace_parent = tracer.current_span()
+            if coalesce is not None:
+                self._pending[coalesce] = u
+            if self._current is not None and priority < self._current.priority:
+                self._interrupt = True
+        self._queue.put((priority, next(self._seq), u))
+        return u
+
+    def busy(self) -> bool:
+        """True while something is being spoken."""
+        return self._current is not None
+
+    def prerender(self, texts):
+        """Render `texts` into the audio cache in the background, after anything audible."""
+        self.start()
+        for text in texts:
+            u = Utterance(self, text, PRIORITY_RENDER)
+            u.render_only = True
+            self._queue.put((PRIORITY_RENDER, next(self._seq), u))
+
+    def cancel(self, u: Utterance = None):
+        """Cancel `u`, or whatever is being spoken right now."""
+        with self._lock:
+            u = u or self._current
+            if u is None or u.cancelled:
+                return
+            u.cancelled = True
+            if u is self._current:
+                self._interrupt = True
+            elif self._pending.get(u.coalesce) is u:
+                del self._pending[u.coalesce]
+        u._finish()
+
+    def stop(self):
+        with self._lock:
+            self._interrupt = True
+        self._queue.put((-1, next(self._seq), None))
+
+    def _init_engine(self):
+        try:
+            engine = pyttsx3.init('sapi5') if os.name == 'nt' else pyttsx3.init()
+            voices = engine.getProperty('voices')
+            if voices:
+                engine.setProperty('voice', voices[min(self.voice_index, len(voices) - 1)].id)
+            engine.setProperty('rate', self.rate)
+            engine.connect('started-word', self._on_word)
+            self._voice = engine.getProperty('voice')
+            self._player = _audio_player()
+            return engine
+        except Exception as e:
+            print(f'TTS init failed: {e}')
+            return None
+
+    def _on_word(self, name, location, length):
+        if self._interrupt:
+            self.engine.stop()
+
+    def _run(self):
+        t0 = time.perf_counter()
+        self.engine = self._init_engine()
+        self.init_ms = (time.perf_counter() - t0) * 1000
+        while True:
+            _, _, u = self._queue.get()
+            if u is None:
+                break
+            with self._lock:
+                if self._pending.get(u.coalesce) is u:
+                    del self._pending[u.coalesce]
+                if u.cancelled:
+                    continue
+                if not u.render_only:  # renders are never pre-empted mid-file
+                    self._current = u
+                    self._interrupt = False
+            if u.render_only:
+                self._render(u.text)
+                u._finish()
+                continue
+            if u.started is None:
+                u.started = time.perf_counter()
+            try:
+                if not self._play_cached(u.text):
+                    self.engine.say(u.text)
+                    self.engine.runAndWait()
+            except Exception:
+                print('TTS failed')
+            with self._lock:
+                self._current = None
+                preempted = self._interrupt and not u.cancelled
+                self._interrupt = False
+            if preempted:
+                self._queue.put((u.priority, next(self._seq), u))
+            else:
+                u._finish()
+        try:
+            self.engine.stop()
+        except Exception:
+            pass
+
+    # ---- audio cache ----
+    def _render(self, text):
+        """Synthesize `text` into the cache unless it is already there."""
+        if self.engine is None or self._player is None:
+            return None
+        key = self.cache.key(text, self._voice, self.rate)
+        path = self.cache.get(key)
+        if path is None:
+            tmp = self.cache.render_path(key)
+            try:
+                self.engine.save_to_file(text, str(tmp))
+                self.engine.runAndWait()
+            except Exception:
+                return None
+            path = self.cache.add(key, tmp)
+        return path
+
+    def _play_cached(self, text) -> bool:
+        """Play `text` from the cache if every fragment is there; queue renders if not."""
+        if self._player is None:
+            return False
+        fragments = tts_fragments(text)
+        keys = [self.cache.key(f, self._voice, self.rate) for f in fragments]
+        paths = [self.cache.get(k) for k in keys]
+        missing = [f for f, p in zip(fragments, paths) if p is None]
+        if missing:
+            self.cache.misses += 1
+            self.prerender(f for f in missing if self._worth_rendering(f, len(fragments) > 1))
+            return False
+        self.cache.hits += 1
+        path = paths[0]
+        if len(paths) > 1:
+            try:
+                path = _join_wavs(paths, self.cache.folder / 'joined.tmp')
+            except (OSError, EOFError, wave.Error):
+                return False
+        self._play(path)
+        return True
+
+    def _worth_rendering(self, text, fragment):
+        """Template fragments always; other phrases only once they have missed before."""
+        if fragment:
+            return True
+        if len(text) > TTS_CACHE_MAX_CHARS:
+            return False
+        if len(self._missed) >= TTS_MISS_TRACKED:
+            self._missed.clear()
+        self._missed[text] += 1
+        return self._missed[text] >= TTS_RENDER_AFTER_MISSES
+
+    def _play(self, path):
+        """Play a WAV file, stopping early if a more urgent utterance arrives."""
+        if self._player == 'winsound':
+            import winsound
+            with wave.open(str(path), 'rb') as w:
+                seconds = w.getnframes() / w.getframerate()
+            winsound.PlaySound(str(path), winsound.SND_FILENAME | winsound.SND_ASYNC)
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                if self._interrupt:
+                    winsound.PlaySound(None, winsound.SND_PURGE)
+                    return
+                time.sleep(0.02)
+            return
+        proc = subprocess.Popen(self._player + [str(path)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while proc.poll() is None:
+            if self._interrupt:
+                proc.terminate()
+                return
+            time.sleep(0.02)
+
+
+speech = SpeechWorker()
+
+# ------------------- SINKS -------------------
+
+class Sinks:
+    """Every side effect the feature functions have on the desktop.
+
+    The default implementation drives the real machine. Install another with
+    `install_sinks` to run commands headless (see NullSinks / RecordingSinks).
+    """
+
+    def speak(self, text, priority=PRIORITY_NORMAL, coalesce=None) -> Utterance:
+        return speech.say(text, priority, coalesce)
+
+    def open_url(self, url: str):
+        wb.open(url)
+
+    def play_youtube(self, query: str):
+        pywhatkit.playonyt(query)
+
+    def press_key(self, key: str, presses=1):
+        pyautogui.press(key, presses=presses)
+
+    def startfile(self, path):
+        os.startfile(path)
+
+    def launch(self, argv):
+        subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def system(self, command: str):
+        os.system(command)
+
+    def wait(self, seconds: float) -> bool:
+        """A pause meant for the user (countdowns, measuring windows); False if cancelled."""
+        return cancellable_sleep(seconds)
+
+    def screenshot(self, region=None):
+        return pyautogui.screenshot(region=region)
+
+    def active_window_region(self):
+        """(left, top, width, height) of the focused window, if the platform can tell."""
+        get_window = getattr(pyautogui, 'getActiveWindow', None)  # Windows only (pygetwindow)
+        win = get_window() if get_window else None
+        if win is None:
+            return None
+        return (win.left, win.top, win.width, win.height)
+
+    def ask_path(self, kind: str):
+        """Ask the user for a 'file' or 'folder'; None when there is no one to ask."""
+        return None
+
+    def level_backend(self, name: str):
+        """Backend for the 'volume' or 'brightness' controller; None if unsupported."""
+        return default_level_backend(name)
+
+
+class NullSinks(Sinks):
+    """Swallows every side effect."""
+
+    def speak(self, text, priority=PRIORITY_NORMAL, coalesce=None) -> Utterance:
+        return Utterance.finished(text, priority)
+
+    def open_url(self, url):
+        pass
+
+    def play_youtube(self, query):
+        pass
+
+    def press_key(self, key, presses=1):
+        pass
+
+    def startfile(self, path):
+        pass
+
+    def launch(self, argv):
+        pass
+
+    def system(self, command):
+        pass
+
+    def wait(self, seconds):
+        return not task_cancelled()
+
+    def screenshot(self, region=None):
+        return None
+
+    def active_window_region(self):
+        return None
+
+    def level_backend(self, name):
+        return FakeLevelBackend()
+
+
+class RecordingSinks(NullSinks):
+    """Records side effects as (action, argument) tuples, optionally echoing them."""
+
+    def __init__(self, echo=None):
+        self.events = []
+        self.echo = echo
+
+    def _record(self, action, arg):
+        self.events.append((action, arg))
+        if self.echo is not None:
+            self.echo(f'[{action}] {arg}')
+
+    def speak(self, text, priority=PRIORITY_NORMAL, coalesce=None) -> Utterance:
+        self._record('speak', text)
+        return super().speak(text, priority, coalesce)
+
+    def open_url(self, url):
+        self._record('open_url', url)
+
+    def play_youtube(self, query):
+        self._record('play_youtube', query)
+
+    def press_key(self, key, presses=1):
+        self._record('press_key', f'{key} x{presses}')
+
+    def startfile(self, path):
+        self._record('startfile', str(path))
+
+    def launch(self, argv):
+        self._record('launch', shlex.join(argv))
+
+    def system(self, command):
+        self._record('system', command)
+
+    def screenshot(self, region=None):
+        self._record('screenshot', region)
+        return None
+
+    def level_backend(self, name):
+        return FakeLevelBackend(on_apply=lambda level: self._record(name, level))
+
+
+sinks = Sinks()
+
+
+def install_sinks(new_sinks: Sinks) -> Sinks:
+    """Route all feature side effects through `new_sinks`; returns the previous sinks."""
+    global sinks
+    old, sinks = sinks, new_sinks
+    return old
+
+# ------------------- UTILS -------------------
+
+# Per-thread step of a running CommandPlan (see COMPOUND COMMANDS); its speech is held back.
+_capture = threading.local()
+
+
+def speak(text: str, priority=PRIORITY_NORMAL, coalesce=None) -> Utterance:
+    """Queue text on the speech thread and return immediately.
+
+    Call `.wait()` on the returned handle to block until it has been spoken.
+    Inside a compound command the text is held until earlier steps have spoken.
+    """
+    step = getattr(_capture, 'step', None)
+    if step is not None:
+        step.speech.append((text, priority, coalesce))
+        return Utterance.finished(text, priority)
+    return sinks.speak(text, priority, coalesce)
+
+
+# ------------------- SPEECH RECOGNITION -------------------
+RECOGNITION_LANGUAGE = 'en-in'
+CALIBRATION_INTERVAL = 300   # seconds before ambient noise is measured again
+HEDGE_CONFIDENCE = 0.75      # a hedged result at or above this wins immediately
+
+
+class RecognitionResult:
+    __slots__ = ('text', 'confidence', 'backend', 'capture_ms', 'recognize_ms')
+
+    def __init__(self, text, confidence, backend, capture_ms, recognize_ms):
+        self.text = text
+        self.confidence = confidence
+        self.backend = backend
+        self.capture_ms = capture_ms
+        self.recognize_ms = recognize_ms
+
+
+class GoogleBackend:
+    name = 'google'
+
+    def __init__(self, language=RECOGNITION_LANGUAGE):
+        self.language = language
+
+    def recognize(self, recognizer, audio):
+        res = recognizer.recognize_google(audio, language=self.language, show_all=True)
+        alternatives = res.get('alternative') if isinstance(res, dict) else None
+        if not alternatives:
+            return None, 0.0
+        best = alternatives[0]
+        # Google only reports confidence for some results.
+        return best.get('transcript'), best.get('confidence', 0.5)
+
+
+class SphinxBackend:
+    """Offline CMU Sphinx decoding (needs pocketsphinx)."""
+    name = 'sphinx'
+
+    def recognize(self, recognizer, audio):
+        text = recognizer.recognize_sphinx(audio)
+        return (text, 0.5) if text else (None, 0.0)
+
+
+class ScriptedBackend:
+    """Offline stand-in that answers with queued transcripts instead of decoding audio."""
+
+    def __init__(self, transcripts=(), confidence=1.0, delay=0.0, name='scripted'):
+        self.transcripts = collections.deque(transcripts)
+        self.confidence = confidence
+        self.delay = delay
+        self.name = name
+
+    def recognize(self, recognizer, audio):
+        if self.delay:
+            time.sleep(self.delay)
+        if not self.transcripts:
+            return None, 0.0
+        return self.transcripts.popleft(), self.confidence
+
+
+class RecognizerService:
+    """Long-lived recognizer that keeps the microphone open between commands.
+
+    Ambient-noise calibration is cached for CALIBRATION_INTERVAL seconds. With
+    `hedge` on, a captured phrase goes to the first two backends at once and
+    the first confident transcript is used.
+    """
+
+    def __init__(self, backends=None, hedge=False, pause_threshold=0.8):
+        self.backends = list(backends) if backends else [GoogleBackend()]
+        self.hedge = hedge
+        self.pause_threshold = pause_threshold
+        self.recognizer = None
+        self.last = None
+        self._mic = None
+        self._source = None
+        self._calibrated_at = 0.0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _ensure_recognizer(self):
+        if self.recognizer is None:
+            self.recognizer = sr.Recognizer()
+            self.recognizer.pause_threshold = self.pause_threshold
+
+    def open(self):
+        self._ensure_recognizer()
+        if self._source is None:
+            self._mic = sr.Microphone()
+            self._source = self._mic.__enter__()
+            self._calibrated_at = 0.0
+
+    def close(self):
+        with self._lock:
+            self._close_source()
+
+    def _close_source(self):
+        if self._mic is not None:
+            try:
+                self._mic.__exit__(None, None, None)
+            except Exception:
+                pass
+        self._mic = self._source = None
+
+    def calibrate(self, duration=0.5, force=False):
+        if force or time.monotonic() - self._calibrated_at > CALIBRATION_INTERVAL:
+            self.recognizer.adjust_for_ambient_noise(self._source, duration=duration)
+            self._calibrated_at = time.monotonic()
+
+    def capture(self, timeout=6, phrase_time_limit=6):
+        self.open()
+        self.calibrate()
+        return self.recognizer.listen(self._source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+
+    def _run_backend(self, backend, audio):
+        try:
+            text, confidence = backend.recognize(self.recognizer, audio)
+        except Exception:
+            return None, 0.0, backend.name
+        return text, confidence, backend.name
+
+    def recognize(self, audio):
+        """Return (text, confidence, backend name); text is None if nothing was understood."""
+        if not self.hedge or len(self.backends) < 2:
+            for backend in self.backends:
+                text, confidence, name = self._run_backend(backend, audio)
+                if text:
+                    return text, confidence, name
+            return None, 0.0, None
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='asr')
+        pending = {self._pool.submit(self._run_backend, b, audio) for b in self.backends[:2]}
+        best = (None, 0.0, None)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                text, confidence, name = f.result()
+                if text and confidence >= HEDGE_CONFIDENCE:
+                    return text, confidence, name
+                if text and (best[0] is None or confidence > best[1]):
+                    best = (text, confidence, name)
+        return best
+
+    def listen(self, timeout=6, phrase_time_limit=6, audio=None):
+        """Capture one phrase (unless `audio` is given) and recognize it."""
+        with self._lock:
+            t0 = time.perf_counter()
+            if audio is None:
+                try:
+                    with tracer.span('capture'):
+                        audio = self.capture(timeout, phrase_time_limit)
+                except sr.WaitTimeoutError:
+                    return None
+                except Exception:
+                    # Device went away; reopen it on the next call.
+                    self._close_source()
+                    return None
+            else:
+                self._ensure_recognizer()
+            t1 = time.perf_counter()
+        with tracer.span('recognition'):
+            text, confidence, name = self.recognize(audio)
+        t2 = time.perf_counter()
+        self.last = RecognitionResult(text, confidence, name, (t1 - t0) * 1000, (t2 - t1) * 1000)
+        return self.last
+
+
+recognizer_service = RecognizerService()
+
+
+def recognize_speech(timeout=6, phrase_time_limit=6):
+    res = recognizer_service.listen(timeout, phrase_time_limit)
+    return res.text if res else None
+
+
+# ------------------- HANDS-FREE LISTENING -------------------
+HF_SAMPLE_RATE = 16000
+HF_FRAME_MS = 20
+HF_RING_SECONDS = 10        # audio buffered between the reader and the detector
+HF_PREROLL_MS = 300         # kept before the detected start of speech
+HF_START_MS = 60            # voiced audio needed to open a segment
+HF_END_MS = 700             # silence that closes a segment
+HF_MAX_SEGMENT_S = 8
+HF_ARMED_S = 5              # after a bare wake word, how long the next phrase counts as a command
+HF_MIN_COMMAND_MS = 200     # voiced audio after the wake word that makes it a command
+VAD_ENERGY_RATIO = 3.0      # speech is this much louder than the running noise floor
+VAD_MIN_RMS = 150           # ... and at least this loud (16-bit samples)
+VAD_MAX_ZCR = 0.45          # zero-crossing rate above this is hiss, not voice
+WAKE_WORD_DIR = APP_DIR / 'wake_word'
+WAKE_THRESHOLD = 0.8        # mean per-frame DTW distance accepted as the wake word
+WAKE_MAX_S = 1.5
+WAKE_ENROLL_COUNT = 3
+
+
+def _frame_samples(frame: bytes):
+    a = array('h')
+    a.frombytes(frame)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+def frame_level(frame: bytes):
+    """(rms, zero-crossing rate) of one 16-bit mono frame."""
+    a = _frame_samples(frame)
+    n = len(a) or 1
+    rms = math.sqrt(sum(x * x for x in a) / n)
+    crossings = sum(1 for x, y in zip(a, a[1:]) if (x < 0) != (y < 0))
+    return rms, crossings / n
+
+
+def segment_features(frames):
+    """Per-frame [log energy, zero-crossing rate, spectral tilt] for template matching.
+
+    The energy is absolute here; `_relative_energy` makes it loudness-free once
+    the frames to compare have been picked. The other two track pitch and
+    brightness directly.
+    """
+    feats = []
+    for frame in frames:
+        a = _frame_samples(frame)
+        n = len(a) or 1
+        energy = sum(x * x for x in a) / n
+        diff = sum((y - x) * (y - x) for x, y in zip(a, a[1:])) / n
+        crossings = sum(1 for x, y in zip(a, a[1:]) if (x < 0) != (y < 0)) / n
+        feats.append([math.log(energy + 1.0), 10 * crossings, math.log((diff + 1.0) / (energy + 1.0))])
+    return feats
+
+
+def _relative_energy(feats, window=None):
+    """Copy of `feats` with log energy relative to the mean over its first `window` frames."""
+    ref = feats[:window] if window else feats
+    if not ref:
+        return []
+    mean = sum(f[0] for f in ref) / len(ref)
+    return [[f[0] - mean, f[1], f[2]] for f in feats]
+
+
+def _dtw_open_end(template, seq):
+    """Best (mean distance, end index) aligning all of `template` with a prefix of `seq`."""
+    inf = float('inf')
+    prev = [inf] * (len(seq) + 1)
+    prev[0] = 0.0
+    for t in template:
+        cur = [inf] * (len(seq) + 1)
+        for j, s in enumerate(seq, 1):
+            cost = math.sqrt((t[0] - s[0]) ** 2 + (t[1] - s[1]) ** 2 + (t[2] - s[2]) ** 2)
+            cur[j] = cost + min(prev[j], prev[j - 1], cur[j - 1])
+        prev = cur
+    best, end = inf, None
+    for j in range(max(1, len(template) // 2), len(seq) + 1):
+        score = prev[j] / (len(template) + j)
+        if score < best:
+            best, end = score, j - 1
+    return best, end
+
+
+def _voiced_span(feats, floor=4.0):
+    """(first, last) index of frames within `floor` (log energy) of the loudest one."""
+    top = max(f[0] for f in feats)
+    voiced = [i for i, f in enumerate(feats) if f[0] > top - floor]
+    return voiced[0], voiced[-1]
+
+
+class FrameRing:
+    """Bounded ring of audio frames between the reader thread and the detector.
+
+    A live source never blocks: when the detector falls behind, the oldest
+    frames are overwritten and counted in `dropped`. File sources block
+    instead, so a WAV file goes through exactly like a microphone would.
+    """
+
+    def __init__(self, capacity):
+        self._frames = collections.deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame, block=False):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                if block:
+                    while len(self._frames) == self._frames.maxlen and not self.closed:
+                        self._cond.wait()
+                else:
+                    self.dropped += 1
+            self._frames.append(frame)
+            self._cond.notify_all()
+
+    def get(self):
+        """Next frame, or None once the ring is closed and empty."""
+        with self._cond:
+            while not self._frames and not self.closed:
+                self._cond.wait()
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            self._cond.notify_all()
+            return frame
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class VoiceActivityDetector:
+    """Energy + zero-crossing VAD with an adaptive noise floor.
+
+    `feed` takes one frame at a time and returns the frames of a finished
+    speech segment (with HF_PREROLL_MS of lead-in) or None.
+    """
+
+    def __init__(self, frame_ms=HF_FRAME_MS):
+        self.start_frames = max(1, HF_START_MS // frame_ms)
+        self.end_frames = max(1, HF_END_MS // frame_ms)
+        self.max_frames = HF_MAX_SEGMENT_S * 1000 // frame_ms
+        self.noise = None
+        self._preroll = collections.deque(maxlen=HF_PREROLL_MS // frame_ms)
+        self._segment = None
+        self._voiced_run = 0
+        self._silent_run = 0
+
+    def is_voiced(self, rms, zcr):
+        return rms > max(VAD_MIN_RMS, self.noise * VAD_ENERGY_RATIO) and zcr < VAD_MAX_ZCR
+
+    def reset(self):
+        self._preroll.clear()
+        self._segment = None
+        self._voiced_run = self._silent_run = 0
+
+    def feed(self, frame):
+        rms, zcr = frame_level(frame)
+        if self.noise is None:
+            self.noise = rms
+        voiced = self.is_voiced(rms, zcr)
+        if not voiced:
+            # the floor follows quiet frames quickly and loud ones slowly
+            self.noise += (rms - self.noise) * (0.05 if rms < self.noise else 0.01)
+        if self._segment is None:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self._segment = list(self._preroll)
+                self._preroll.clear()
+                self._silent_run = 0
+            return None
+        self._segment.append(frame)
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.end_frames or len(self._segment) >= self.max_frames:
+            segment = self._segment[:len(self._segment) - self._silent_run] or self._segment
+            self._segment = None
+            self._voiced_run = 0
+            return segment
+        return None
+
+
+class WakeWordMatcher:
+    """Matches the start of a speech segment against recorded wake-word clips.
+
+    Each clip in WAKE_WORD_DIR becomes a feature template; a segment matches
+    when some template aligns (open-end DTW) with its beginning closely
+    enough. Nothing leaves the machine.
+    """
+
+    def __init__(self, templates=()):
+        # Templates are trimmed to their voiced part before the energy is made
+        # relative, so silence padding in a clip does not shift it.
+        self.templates = []
+        for t in templates:
+            if t:
+                first, last = _voiced_span(t)
+                self.templates.append(_relative_energy(t[first:last + 1]))
+
+    def __bool__(self):
+        return bool(self.templates)
+
+    @classmethod
+    def from_dir(cls, folder=None):
+        folder = Path(folder or WAKE_WORD_DIR)
+        templates = []
+        for path in sorted(folder.glob('*.wav')) if folder.exists() else ():
+            try:
+                src = WavFileSource(path)
+                templates.append(segment_features(list(src.frames())))
+            except (OSError, EOFError, wave.Error, ValueError):
+                continue
+        return cls(templates)
+
+    def match(self, feats, frame_ms=HF_FRAME_MS):
+        """Index of the segment's last wake-word frame, or None."""
+        if not feats:
+            return None
+        start = _voiced_span(feats)[0]
+        head = feats[start:start + int(WAKE_MAX_S * 1000) // frame_ms]
+        best, end = float('inf'), None
+        for template in self.templates:
+            # relative to the frames the wake word would cover, not the command after it
+            score, j = _dtw_open_end(template, _relative_energy(head, len(template)))
+            if score < best:
+                best, end = score, j
+        return start + end if best <= WAKE_THRESHOLD else None
+
+
+class WavFileSource:
+    """Frames from a 16-bit WAV file, for testing the pipeline without a microphone."""
+
+    realtime = False
+
+    def __init__(self, path, frame_ms=HF_FRAME_MS):
+        self.path = str(path)
+        with wave.open(self.path, 'rb') as w:
+            if w.getsampwidth() != 2:
+                raise ValueError('only 16-bit WAV files are supported')
+            self.sample_rate = w.getframerate()
+            self.channels = w.getnchannels()
+        self.frame_samples = self.sample_rate * frame_ms // 1000
+
+    def frames(self):
+        with wave.open(self.path, 'rb') as w:
+            while True:
+                data = w.readframes(self.frame_samples)
+                if len(data) < self.frame_samples * 2 * self.channels:
+                    return
+                if self.channels > 1:
+                    data = _frame_samples(data)[::self.channels].tobytes()
+                yield data
+
+    def close(self):
+        pass
+
+
+class MicrophoneSource:
+    """Frames read straight from the default microphone (blocking reads, no polling)."""
+
+    realtime = True
+
+    def __init__(self, sample_rate=HF_SAMPLE_RATE, frame_ms=HF_FRAME_MS):
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self._stop = threading.Event()
+
+    def frames(self):
+        with sr.Microphone(sample_rate=self.sample_rate, chunk_size=self.frame_samples) as source:
+            while not self._stop.is_set():
+                yield source.stream.read(self.frame_samples)
+
+    def close(self):
+        self._stop.set()
+
+
+class HandsFreeListener:
+    """Always-on listening: ring buffer -> VAD -> wake word -> recognition.
+
+    Only speech that follows the wake word, in the same phrase or within
+    HF_ARMED_S after it, is sent to `recognizer`. Everything else is dropped
+    after the local checks.
+    """
+
+    def __init__(self, on_command, matcher=None, recognizer=None, log_fn=lambda s: None, on_wake=None):
+        self.on_command = on_command
+        self.matcher = matcher if matcher is not None else WakeWordMatcher.from_dir()
+        self.recognizer = recognizer or recognizer_service
+        self.log = log_fn
+        self.on_wake = on_wake
+        self.stats = collections.Counter()
+        self.enrolling = 0
+        self._source = None
+        self._threads = []
+        self._ring = None
+        self._armed_until = -1.0
+        self._clock = 0.0    # seconds of audio seen, so WAV input behaves like live input
+
+    @property
+    def running(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self, source=None):
+        if self.running:
+            return
+        self._source = source or MicrophoneSource()
+        self._ring = FrameRing(HF_RING_SECONDS * 1000 // HF_FRAME_MS)
+        self._threads = [
+            threading.Thread(target=self._read, name='hf-reader', daemon=True),
+            threading.Thread(target=self._detect, name='hf-detector', daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        if self._source is not None:
+            self._source.close()
+        if self._ring is not None:
+            self._ring.close()
+
+    def join(self, timeout=None):
+        for t in self._threads:
+            t.join(timeout)
+
+    def enroll(self, count=WAKE_ENROLL_COUNT):
+        """Save the next `count` phrases as wake-word clips."""
+        self.enrolling = count
+
+    # ---- pipeline ----
+    def _read(self):
+        try:
+            for frame in self._source.frames():
+                self._ring.put(frame, block=not self._source.realtime)
+        except Exception as e:
+            self.log(f'Hands-free input stopped: {e}')
+        finally:
+            self._ring.close()
+
+    def _detect(self):
+        frame_s = HF_FRAME_MS / 1000
+        vad = VoiceActivityDetector()
+        while True:
+            frame = self._ring.get()
+            if frame is None:
+                break
+            self._clock += frame_s
+            self.stats['frames'] += 1
+            if speech.busy():
+                vad.reset()  # do not listen to ourselves
+                continue
+            segment = vad.feed(frame)
+            if segment:
+                self.stats['segments'] += 1
+                try:
+                    self._on_segment(segment)
+                except Exception as e:
+                    self.log(f'Hands-free error: {e}')
+        self.stats['dropped'] = self._ring.dropped
+
+    def _on_segment(self, segment):
+        if self.enrolling:
+            self._save_clip(segment)
+            return
+        if self._clock <= self._armed_until:
+            self._armed_until = -1.0
+            self._recognize(segment)
+            return
+        if not self.matcher:
+            return
+        end = self.matcher.match(segment_features(segment[:int(WAKE_MAX_S * 1000) // HF_FRAME_MS]))
+        if end is None:
+            return
+        self.stats['wakes'] += 1
+        rest = segment[end + 1:]
+        if len(rest) * HF_FRAME_MS >= HF_MIN_COMMAND_MS:
+            self._recognize(rest)
+        else:
+            self._armed_until = self._clock + HF_ARMED_S
+            self.log('Wake word heard. Listening...')
+            if self.on_wake:
+                self.on_wake()
+
+    def _recognize(self, frames):
+        rate = self._source.sample_rate
+        trace = tracer.begin('')
+        with tracer.activate(trace):
+            if trace is not None:
+                now = time.perf_counter()
+                trace.add('capture', now - len(frames) * HF_FRAME_MS / 1000, now)
+            res = self.recognizer.listen(audio=sr.AudioData(b''.join(frames), rate, 2))
+            if res and res.text:
+                self.stats['commands'] += 1
+                if trace is not None:
+                    trace.query = res.text
+                self.log(f'You said: {res.text}')
+                self.on_command(res.text)
+            else:
+                self.stats['unrecognized'] += 1
+                if trace is not None:
+                    trace.intent = 'unrecognized'
+                self.log('Voice not recognized.')
+        if trace is not None:
+            trace.release()
+
+    def _save_clip(self, segment):
+        WAKE_WORD_DIR.mkdir(parents=True, exist_ok=True)
+        path = WAKE_WORD_DIR / f'wake_{time.strftime("%Y%m%d_%H%M%S")}_{self.enrolling}.wav'
+        with wave.open(str(path), 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self._source.sample_rate)
+            w.writeframes(b''.join(segment))
+        self.enrolling -= 1
+        self.log(f'Saved wake-word clip {path.name}.')
+        if not self.enrolling:
+            self.matcher = WakeWordMatcher.from_dir()
+            self.log(f'Wake word trained from {len(self.matcher.templates)} clip(s).')
+
+
+# ------------------- MUSIC LIBRARY -------------------
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def _tokens(text: str):
+    return _WORD.findall(text.lower())
+
+
+def _atomic_write_json(path: Path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+_mutagen = None
+
+
+def _read_track_tags(path: str):
+    """Return (title, artist, duration seconds) from tags, or the file name."""
+    global _mutagen
+    stem = os.path.splitext(os.path.basename(path))[0]
+    artist, sep, title = stem.partition(' - ')
+    if not sep:
+        artist, title = '', stem
+    duration = None
+    if _mutagen is None:
+        try:
+            import mutagen  # optional, only used for tags and duration
+            _mutagen = mutagen
+        except ImportError:
+            _mutagen = False
+    if _mutagen:
+        try:
+            f = _mutagen.File(path, easy=True)
+            if f is not None:
+                title = (f.get('title') or [title])[0]
+                artist = (f.get('artist') or [artist])[0]
+                if getattr(f, 'info', None) is not None:
+                    duration = round(f.info.length, 1)
+        except Exception:
+            pass
+    return title, artist, duration
+
+
+class MusicLibrary:
+    """Recursive, persistent index of MUSIC_FOLDER.
+
+    Directories whose mtime has not changed since the last scan are not listed
+    again, so re-scans of a large library only touch what was added or removed.
+    Titles and artists feed an in-memory token index used by `search`.
+    """
+
+    RESCAN_AFTER = 60  # seconds
+
+    def __init__(self, root=None, index_file=None):
+        self.root = Path(root or MUSIC_FOLDER)
+        self.index_file = Path(index_file or MUSIC_INDEX_FILE)
+        self.ready = threading.Event()
+        self.last_scan = 0.0
+        self._lock = threading.RLock()
+        self._scan_lock = threading.Lock()
+        self._dirs = {}     # dir -> [mtime, [music file names], [subdir names]]
+        self._tracks = {}   # path -> [title, artist, duration, mtime]
+        self._postings = {}  # token -> set of paths
+        self._paths = None
+
+    def __len__(self):
+        return len(self._tracks)
+
+    # ---- persistence ----
+    def load(self):
+        try:
+            with open(self.index_file, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('root') != str(self.root):
+            return False
+        with self._lock:
+            self._dirs = data.get('dirs', {})
+            self._tracks = {}
+            self._postings = {}
+            for path, meta in data.get('tracks', {}).items():
+                self._add(path, meta)
+        self.ready.set()
+        return True
+
+    def save(self):
+        with self._lock:
+            data = {'root': str(self.root), 'dirs': self._dirs, 'tracks': self._tracks}
+            _atomic_write_json(self.index_file, data)
+
+    # ---- index maintenance ----
+    def _add(self, path, meta):
+        self._tracks[path] = meta
+        for tok in set(_tokens(f'{meta[0]} {meta[1]} {Path(path).stem}')):
+            self._postings.setdefault(tok, set()).add(path)
+        self._paths = None
+
+    def _remove(self, path):
+        meta = self._tracks.pop(path, None)
+        if meta is None:
+            return
+        for tok in set(_tokens(f'{meta[0]} {meta[1]} {Path(path).stem}')):
+            paths = self._postings.get(tok)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._postings[tok]
+        self._paths = None
+
+    def _drop_dir(self, d):
+        entry = self._dirs.pop(d, None)
+        if entry is None:
+            return
+        for name in entry[1]:
+            self._remove(os.path.join(d, name))
+        for sub in entry[2]:
+            self._drop_dir(os.path.join(d, sub))
+
+    def scan(self):
+        """Bring the index up to date. Returns the number of tracks added or removed."""
+        with self._scan_lock:
+            changes = 0
+            seen = set()
+            stack = [str(self.root)] if self.root.exists() else []
+            while stack:
+                d = stack.pop()
+                seen.add(d)
+                try:
+                    mtime = os.stat(d).st_mtime
+                except OSError:
+                    continue
+                cached = self._dirs.get(d)
+                if cached is not None and cached[0] == mtime:
+                    stack.extend(os.path.join(d, sub) for sub in cached[2])
+                    continue
+                files, subdirs = [], []
+                try:
+                    with os.scandir(d) as it:
+                        for e in it:
+                            try:
+                                if e.is_dir(follow_symlinks=False):
+                                    subdirs.append(e.name)
+                                elif e.name.lower().endswith(MUSIC_EXTENSIONS):
+                                    files.append((e.name, e.stat().st_mtime))
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+                names = {name for name, _ in files}
+                with self._lock:
+                    if cached is not None:
+                        for name in cached[1]:
+                            if name not in names:
+                                self._remove(os.path.join(d, name))
+                                changes += 1
+                    for name, fmtime in files:
+                        path = os.path.join(d, name)
+                        old = self._tracks.get(path)
+                        if old is not None and old[3] == fmtime:
+                            continue
+                        title, artist, duration = _read_track_tags(path)
+                        self._remove(path)
+                        self._add(path, [title, artist, duration, fmtime])
+                        changes += 1
+                    self._dirs[d] = [mtime, sorted(names), subdirs]
+                stack.extend(os.path.join(d, sub) for sub in subdirs)
+            with self._lock:
+                for d in [d for d in self._dirs if d not in seen]:
+                    before = len(self._tracks)
+                    self._drop_dir(d)
+                    changes += before - len(self._tracks)
+            self.last_scan = time.monotonic()
+            self.ready.set()
+            return changes
+
+    def refresh(self):
+        if not self.ready.is_set():
+            self.load()
+        if self.scan():
+            self.save()
+
+    def refresh_async(self, force=False):
+        """Load and re-scan on a background thread unless a scan ran recently."""
+        if not force and self.last_scan and time.monotonic() - self.last_scan < self.RESCAN_AFTER:
+            return
+        if self._scan_lock.locked():
+            return
+        threading.Thread(target=self.refresh, name='music-scan', daemon=True).start()
+
+    # ---- queries ----
+    def random_track(self):
+        with self._lock:
+            if self._paths is None:
+                self._paths = list(self._tracks)
+            return random.choice(self._paths) if self._paths else None
+
+    def search(self, query: str, limit=5):
+        """Tracks whose title/artist/file name contain the query words, best first."""
+        words = [w for w in _tokens(query) if w not in ('by', 'the', 'song', 'track')]
+        if not words:
+            return []
+        with self._lock:
+            sets = sorted((self._postings.get(w, ()) for w in words), key=len)
+            hits = set(sets[0]).intersection(*sets[1:]) if sets[0] else set()
+            if not hits:
+                # fall back to the tracks matching the most query words
+                counts = collections.Counter(p for s in sets for p in s)
+                if not counts:
+                    return []
+                top = max(counts.values())
+                if top * 2 < len(words):
+                    return []
+                hits = {p for p, c in counts.items() if c == top}
+            return heapq.nsmallest(limit, hits, key=lambda p: (len(self._tracks[p][0]), p))
+
+    def describe(self, path):
+        meta = self._tracks.get(path)
+        if not meta:
+            return Path(path).stem
+        return f'{meta[0]} by {meta[1]}' if meta[1] else meta[0]
+
+
+music_library = MusicLibrary()
+
+
+# ------------------- APP INDEX -------------------
+APP_INDEX_FILE = APP_DIR / 'apps.json'
+APP_USAGE_FILE = APP_DIR / 'app_usage.json'
+APP_INDEX_FORMAT = 2        # bump when _parse_desktop_entry changes what it accepts
+APP_MATCH_THRESHOLD = 0.6   # minimum similarity for a fuzzy app-name match
+QUICK_APPS_COUNT = 6
+# Spoken names that do not look like any launcher name.
+APP_ALIASES = {
+    'vscode': ('code', 'visualstudiocode'),
+    'chrome': ('googlechrome', 'googlechromestable', 'chromium', 'chromiumbrowser'),
+    'calculator': ('calc', 'gnomecalculator', 'kcalc'),
+    'notepad': ('texteditor', 'gedit', 'kate', 'mousepad'),
+    'terminal': ('windowsterminal', 'gnometerminal', 'konsole', 'xterm'),
+    'browser': ('firefox', 'googlechrome', 'msedge', 'chromium'),
+    'edge': ('msedge', 'microsoftedge'),
+}
+# Programs on PATH that "open <name>" may start without a launcher: GUI programs
+# that often ship without a .desktop file or Start Menu shortcut. Anything else
+# on PATH (a console tool started detached just spins or vanishes) is left alone.
+APP_PATH_PROGRAMS = frozenset({
+    'notepad', 'mspaint', 'calc', 'explorer', 'wordpad', 'write', 'charmap', 'magnify', 'osk',
+    'snippingtool', 'taskmgr', 'control',
+    'xterm', 'xcalc', 'xclock', 'xeyes', 'firefox', 'chromium', 'code', 'gimp', 'vlc', 'gedit',
+    'kate', 'mousepad', 'nautilus', 'thunar', 'dolphin', 'kcalc', 'evince', 'eog', 'libreoffice',
+})
+# Programs never started by "open <name>", even when asked for by exact name.
+APP_DENYLIST = frozenset({
+    'shutdown', 'reboot', 'poweroff', 'halt', 'systemctl', 'init', 'telinit', 'loginctl',
+    'mkfs', 'mke2fs', 'mkswap', 'swapoff', 'fdisk', 'sfdisk', 'cfdisk', 'gdisk', 'parted',
+    'wipefs', 'dd', 'shred', 'format', 'diskpart', 'bcdedit', 'rm', 'rmdir', 'del', 'kill',
+    'killall', 'pkill', 'logoff', 'rundll32',
+})
+# Preferred kind when several entries share a name: GUI launchers beat bare binaries.
+_KIND_RANK = {'desktop': 0, 'shortcut': 0, 'builtin': 1, 'exe': 2}
+_BARE_PROGRAM = re.compile(r'^[\w.+-]+$')
+_DESKTOP_FIELD_CODE = re.compile(r'^%[fFuUdDnNickvm]$')
+
+
+def _app_key(name: str) -> str:
+    return ''.join(_tokens(name))
+
+
+def _trigrams(key: str):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def _denied_program(path: str) -> bool:
+    """True for power/disk tools and anything under an sbin directory."""
+    p = Path(path)
+    stem = p.name.lower().split('.')[0]   # mkfs.ext4, shutdown.exe
+    return stem in APP_DENYLIST or any(part.lower() == 'sbin' for part in p.parts[:-1])
+
+
+def _app_sources():
+    """[(directory, recursive)] scanned for GUI launchers on this platform.
+
+    PATH is not indexed: a bare binary is only started on an exact name
+    match (see AppIndex.find), never reached through fuzzy matching.
+    """
+    sources = []
+    if os.name == 'nt':
+        for base in (os.environ.get('ProgramData'), os.environ.get('APPDATA')):
+            if base:
+                sources.append((os.path.join(base, 'Microsoft', 'Windows', 'Start Menu', 'Programs'), True))
+    else:
+        data_dirs = [os.environ.get('XDG_DATA_HOME') or str(Path.home() / '.local' / 'share')]
+        data_dirs += (os.environ.get('XDG_DATA_DIRS') or '/usr/local/share:/usr/share').split(os.pathsep)
+        data_dirs += ['/var/lib/flatpak/exports/share', '/var/lib/snapd/desktop']
+        sources += [(os.path.join(d, 'applications'), True) for d in data_dirs if d]
+    seen, out = set(), []
+    for d, recursive in sources:
+        d = os.path.abspath(d)
+        if d not in seen:
+            seen.add(d)
+            out.append((d, recursive))
+    return out
+
+
+def _parse_desktop_entry(path):
+    """[name, 'desktop', exec command] for a launchable .desktop file, else None."""
+    fields, in_entry = {}, False
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    if in_entry:
+                        break
+                    in_entry = line == '[Desktop Entry]'
+                elif in_entry and '=' in line:
+                    k, v = line.split('=', 1)
+                    fields.setdefault(k.strip(), v.strip())
+    except OSError:
+        return None
+    if fields.get('Type', 'Application') != 'Application' or not fields.get('Exec'):
+        return None
+    if fields.get('NoDisplay', '').lower() == 'true' or fields.get('Hidden', '').lower() == 'true':
+        return None
+    if fields.get('Terminal', '').lower() == 'true':
+        return None   # started detached it would have no terminal to run in
+    try:
+        argv = shlex.split(fields['Exec'])
+    except ValueError:
+        return None
+    argv = [a.replace('%%', '%') for a in argv if not _DESKTOP_FIELD_CODE.match(a)]
+    if not argv or _denied_program(argv[0]):
+        return None
+    return [fields.get('Name') or Path(path).stem, 'desktop', shlex.join(argv)]
+
+
+def _scan_app_dir(d):
+    """Launcher entries directly inside `d` and the names of its subdirectories."""
+    entries, subdirs = [], []
+    with os.scandir(d) as it:
+        for e in it:
+            try:
+                if e.is_dir():
+                    subdirs.append(e.name)
+                    continue
+                lower = e.name.lower()
+                if lower.endswith('.desktop'):
+                    entry = _parse_desktop_entry(e.path)
+                    if entry:
+                        entries.append(entry)
+                elif lower.endswith(('.lnk', '.url')) and 'uninstall' not in lower:
+                    entries.append([os.path.splitext(e.name)[0], 'shortcut', e.path])
+            except OSError:
+                continue
+    return entries, subdirs
+
+
+class AppIndex:
+    """GUI launchers found in .desktop directories and in the Start Menu, plus DEFAULT_APPS.
+
+    Like MusicLibrary, each directory is only listed again when its mtime
+    changes and the result is cached in APP_INDEX_FILE. Names are matched
+    exactly after normalisation ("VS Code" -> "vscode"), then through
+    APP_ALIASES, then as a bare program on PATH (exact name only, and only
+    one in APP_PATH_PROGRAMS), then fuzzily against the launchers via a
+    trigram index re-ranked by edit distance.
+    """
+
+    RESCAN_AFTER = 60  # seconds
+
+    def __init__(self, index_file=None, usage_file=APP_USAGE_FILE, sources=None, search_path=None):
+        self.index_file = Path(index_file or APP_INDEX_FILE)
+        self.usage_file = Path(usage_file) if usage_file else None   # None keeps launch counts in memory
+        self.sources = sources
+        self.search_path = search_path    # PATH for exact program names; None uses the environment
+        self.ready = threading.Event()
+        self.last_scan = 0.0
+        self.version = 0        # bumped when entries or usage change (for the GUI)
+        self._lock = threading.RLock()
+        self._scan_lock = threading.Lock()
+        self._dirs = {}         # dir -> [mtime, [[name, kind, target]], [subdir names]]
+        self._entries = []      # [name, kind, target]
+        self._by_key = {}       # normalised name -> [entry]
+        self._grams = {}        # trigram -> set of keys
+        self._usage = {}        # target -> launch count
+        self._load_usage()
+        self._add_builtins()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ---- persistence ----
+    def _load_usage(self):
+        if self.usage_file is None:
+            return
+        try:
+            with open(self.usage_file, encoding='utf-8') as f:
+                self._usage = {k: int(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            self._usage = {}
+
+    def load(self):
+        try:
+            with open(self.index_file, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get('format') != APP_INDEX_FORMAT:
+            return False   # rescan everything
+        with self._lock:
+            self._dirs = data.get('dirs', {})
+            self._rebuild()
+        self.ready.set()
+        return True
+
+    def save(self):
+        with self._lock:
+            _atomic_write_json(self.index_file, {'format': APP_INDEX_FORMAT, 'dirs': self._dirs})
+
+    # ---- index maintenance ----
+    def _add_builtins(self):
+        self._builtins = []
+        for name, path in DEFAULT_APPS.items():
+            if (os.path.isabs(path) and os.path.exists(path)) or shutil.which(path):
+                self._builtins.append([name, 'builtin', path])
+        self._rebuild()
+
+    def _rebuild(self):
+        entries = list(self._builtins)
+        for entry in self._dirs.values():
+            entries.extend(entry[1])
+        by_key = {}
+        for entry in entries:
+            name, kind, target = entry
+            program = shlex.split(target)[0] if kind == 'desktop' else target   # Exec may quote a path with spaces
+            keys = {_app_key(name), _app_key(Path(program).stem)}
+            for key in keys:
+                if key:
+                    by_key.setdefault(key, []).append(entry)
+        grams = {}
+        for key in itertools.chain(by_key, APP_ALIASES):
+            for g in _trigrams(key):
+                grams.setdefault(g, set()).add(key)
+        self._entries, self._by_key, self._grams = entries, by_key, grams
+        self.version += 1
+
+    def scan(self):
+        """Bring the index up to date. Returns True if any directory changed."""
+        with self._scan_lock:
+            changed = False
+            seen = set()
+            for root, recursive in (self.sources if self.sources is not None else _app_sources()):
+                stack = [root]
+                while stack:
+                    d = stack.pop()
+                    seen.add(d)
+                    try:
+                        mtime = os.stat(d).st_mtime
+                    except OSError:
+                        continue
+                    cached = self._dirs.get(d)
+                    if cached is None or cached[0] != mtime:
+                        try:
+                            entries, subdirs = _scan_app_dir(d)
+                        except OSError:
+                            continue
+                        cached = [mtime, entries, subdirs if recursive else []]
+                        with self._lock:
+                            self._dirs[d] = cached
+                        changed = True
+                    stack.extend(os.path.join(d, sub) for sub in cached[2])
+            with self._lock:
+                for d in [d for d in self._dirs if d not in seen]:
+                    del self._dirs[d]
+                    changed = True
+                if changed:
+                    self._rebuild()
+            self.last_scan = time.monotonic()
+            self.ready.set()
+            return changed
+
+    def refresh(self):
+        if not self.ready.is_set():
+            self.load()
+        if self.scan():
+            self.save()
+
+    def refresh_async(self, force=False):
+        """Load and re-scan on a background thread unless a scan ran recently."""
+        if not force and self.last_scan and time.monotonic() - self.last_scan < self.RESCAN_AFTER:
+            return
+        if self._scan_lock.locked():
+            return
+        threading.Thread(target=self.refresh, name='app-scan', daemon=True).start()
+
+    # ---- queries ----
+    def _best(self, key):
+        entries = self._by_key.get(key)
+        if not entries:
+            return None
+        return min(entries, key=lambda e: (_KIND_RANK[e[1]], -self._usage.get(e[2], 0), len(e[0])))
+
+    def _resolve(self, key):
+        entry = self._best(key)
+        if entry is None:
+            found = [self._best(alias) for alias in APP_ALIASES.get(key, ())]
+            found = [e for e in found if e is not None]
+            if found:
+                entry = max(found, key=lambda e: self._usage.get(e[2], 0))
+        return entry
+
+    def _program(self, name):
+        """[name, 'exe', path] for an APP_PATH_PROGRAMS program on PATH named exactly `name`."""
+        if name not in APP_PATH_PROGRAMS or not _BARE_PROGRAM.match(name):
+            return None
+        path = shutil.which(name, path=self.search_path)
+        if path is None or _denied_program(path):
+            return None
+        return [name, 'exe', path]
+
+    def find(self, name: str):
+        """The [name, kind, target] entry best matching a spoken or typed app name, or None."""
+        key = _app_key(name)
+        if not key:
+            return None
+        if not self.ready.is_set():
+            if self._scan_lock.locked():
+                self.ready.wait(5)
+            else:
+                self.refresh()
+        with self._lock:
+            entry = self._resolve(key) or self._program(name.strip().lower())
+            if entry is not None or len(key) < 3:
+                return entry
+            counts = collections.Counter()
+            # rare trigrams pick the candidates; common ones only add to them
+            for keys in sorted((self._grams.get(g, ()) for g in _trigrams(key)), key=len):
+                if counts and len(keys) > 256:
+                    for cand in list(counts):
+                        if cand in keys:
+                            counts[cand] += 1
+                else:
+                    counts.update(keys)
+            n = len(key) + 1
+            candidates = heapq.nlargest(20, counts.items(),
+                                        key=lambda kv: 2 * kv[1] / (n + len(kv[0]) + 1))
+            best, best_score = None, APP_MATCH_THRESHOLD
+            for cand, _ in candidates:
+                score = 1 - _edit_distance(key, cand) / max(len(key), len(cand))
+                if cand.startswith(key):
+                    score = max(score, 0.75)
+                if score > best_score or (score == best_score and best is not None and len(cand) < len(best)):
+                    entry = self._resolve(cand)
+                    if entry is not None:
+                        best, best_score = cand, score
+            return self._resolve(best) if best else None
+
+    def record_use(self, entry):
+        with self._lock:
+            self._usage[entry[2]] = self._usage.get(entry[2], 0) + 1
+            self.version += 1
+            usage = dict(self._usage)
+        if self.usage_file is None:
+            return
+        try:
+            _atomic_write_json(self.usage_file, usage)
+        except OSError:
+            pass
+
+    def most_used(self, n=QUICK_APPS_COUNT):
+        """Display names of the n most launched apps, padded with DEFAULT_APPS."""
+        with self._lock:
+            used = {e[2]: e for e in self._entries if self._usage.get(e[2])}
+            ranked = sorted(used.values(), key=lambda e: (-self._usage[e[2]], e[0].lower()))
+        names = []
+        for entry in ranked:
+            if entry[0] not in names:
+                names.append(entry[0])
+        for name in DEFAULT_APPS:
+            if len(names) >= n:
+                break
+            if name not in names:
+                names.append(name)
+        return names[:n]
+
+    def launch(self, entry):
+        name, kind, target = entry
+        if kind == 'desktop':
+            sinks.launch(shlex.split(target))
+        elif kind == 'exe':
+            sinks.launch([target])
+        else:
+            sinks.startfile(target)
+        self.record_use(entry)
+
+
+app_index = AppIndex()
+
+
+# ------------------- TELEMETRY -------------------
+TELEMETRY_INTERVAL = 1.0   # seconds between samples
+TELEMETRY_HISTORY = 900    # samples kept per series (15 minutes at 1 Hz)
+TELEMETRY_DISK = Path.home().anchor or '/'
+TOP_CPU_INTERVAL = 0.5     # seconds process CPU is measured over before ranking by it
+
+
+class RingBuffer:
+    """Fixed-size series of floats backed by an array('d')."""
+    __slots__ = ('_data', '_next', '_count')
+
+    def __init__(self, size: int):
+        self._data = array('d', bytes(8 * size))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value: float):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % len(self._data)
+        if self._count < len(self._data):
+            self._count += 1
+
+    def latest(self, default=None):
+        return self._data[self._next - 1] if self._count else default
+
+    def last(self, n: int):
+        """The newest `n` values, oldest first."""
+        n = min(n, self._count)
+        start = self._next - n
+        if start >= 0:
+            return self._data[start:self._next].tolist()
+        return self._data[start:].tolist() + self._data[:self._next].tolist()
+
+
+class TelemetrySampler:
+    """Samples CPU (total and per core), RAM, battery, disk and network I/O in the background.
+
+    Every series is a RingBuffer, so memory is fixed and reads never block on psutil.
+    I/O series hold bytes per second since the previous sample.
+    """
+
+    def __init__(self, interval=TELEMETRY_INTERVAL, history=TELEMETRY_HISTORY):
+        self.interval = interval
+        self.history = history
+        self.times = RingBuffer(history)
+        self.series = {}
+        self._lock = threading.Lock()
+        self._prev_io = None
+        self._primed = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.times)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f'Telemetry sample failed: {e}')
+            self._stop.wait(self.interval)
+
+    def _put(self, name, value):
+        buf = self.series.get(name)
+        if buf is None:
+            buf = self.series[name] = RingBuffer(self.history)
+        buf.append(value)
+
+    def sample(self):
+        if not self._primed:
+            # cpu_percent() compares against the previous call; give it a baseline
+            psutil.cpu_percent(percpu=True)
+            time.sleep(0.1)
+            self._primed = True
+        now = time.time()
+        cores = psutil.cpu_percent(percpu=True)
+        mem = psutil.virtual_memory()
+        battery = psutil.sensors_battery()
+        disk = psutil.disk_usage(TELEMETRY_DISK)
+        net = psutil.net_io_counters()
+        dio = psutil.disk_io_counters()
+        io = (now, net.bytes_sent, net.bytes_recv, dio.read_bytes if dio else 0, dio.write_bytes if dio else 0)
+        with self._lock:
+            self.times.append(now)
+            self._put('cpu', sum(cores) / len(cores) if cores else 0.0)
+            for i, pct in enumerate(cores):
+                self._put(f'cpu{i}', pct)
+            self._put('ram', mem.percent)
+            self._put('disk', disk.percent)
+            if battery is not None:
+                self._put('battery', battery.percent)
+            if self._prev_io is not None:
+                dt = max(now - self._prev_io[0], 1e-6)
+                for name, cur, prev in zip(('net_sent', 'net_recv', 'disk_read', 'disk_write'), io[1:], self._prev_io[1:]):
+                    self._put(name, max(cur - prev, 0) / dt)
+            self._prev_io = io
+
+    def latest(self, name, default=None):
+        buf = self.series.get(name)
+        return buf.latest(default) if buf is not None else default
+
+    def window(self, name, seconds):
+        """Values of `name` sampled within the last `seconds`, oldest first."""
+        with self._lock:
+            buf = self.series.get(name)
+            if buf is None:
+                return []
+            cutoff = time.time() - seconds
+            times = self.times.last(len(buf))
+            n = len(times) - bisect.bisect_left(times, cutoff)
+            return buf.last(n)
+
+    def cores(self):
+        return sum(1 for name in self.series if name[3:].isdigit())
+
+
+def top_processes(n=5, by='memory'):
+    """[(name, pid, memory MB, cpu %)] for the n heaviest processes."""
+    if by == 'cpu':
+        # a process's first cpu_percent() is always 0.0; measure over a short window instead
+        for p in psutil.process_iter(['cpu_percent']):
+            pass
+        sinks.wait(TOP_CPU_INTERVAL)
+    procs = []
+    for p in psutil.process_iter(['pid', 'name', 'memory_info', 'cpu_percent']):
+        info = p.info
+        mem = info.get('memory_info')
+        procs.append((info.get('name') or '?', info.get('pid'), (mem.rss if mem else 0) / 2**20, info.get('cpu_percent') or 0.0))
+    key = (lambda t: t[3]) if by == 'cpu' else (lambda t: t[2])
+    return heapq.nlargest(n, procs, key=key)
+
+
+telemetry = TelemetrySampler()
+
+
+# ------------------- SCREENSHOTS -------------------
+SCREENSHOT_FOLDER = Path.cwd()
+SCREENSHOT_DELAY = 3            # seconds before capturing; 0 captures immediately
+SCREENSHOT_FORMAT = 'png'       # png, jpeg or webp
+SCREENSHOT_QUALITY = 85         # jpeg/webp quality 1-95
+SCREENSHOT_PNG_LEVEL = 6        # png compression level 0-9
+SCREENSHOT_DEDUP_BITS = 3       # frames whose dHash differs by at most this many bits are skipped
+SCREENSHOT_WORKERS = 2
+_SHOT_FORMATS = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'webp': 'webp'}
+
+
+def dhash(img, size=8) -> int:
+    """64-bit difference hash: cheap, and stable across small changes like a clock ticking."""
+    small = img.convert('L').resize((size + 1, size))
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return bits
+
+
+def _encode_screenshot(mode, size, data, path, fmt, quality, png_level):
+    """Runs in a worker process: rebuild the frame and write it to disk."""
+    from PIL import Image
+    img = Image.frombytes(mode, size, data)
+    if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if fmt == 'png':
+        img.save(path, format='PNG', compress_level=png_level)
+    elif fmt == 'jpeg':
+        img.save(path, format='JPEG', quality=quality, optimize=True)
+    else:
+        img.save(path, format='WEBP', quality=quality, method=4)
+    return path
+
+
+def parse_screenshot_command(q: str) -> dict:
+    """Options for take_screenshot from phrases like "screenshot now as jpeg",
+    "screenshot of the active window", "screenshot region 0 0 800 600" or
+    "screenshot every 5 seconds for a minute"."""
+    opts = {}
+    m = re.search(r'every (\d+) (second|minute)s?(?: for (\d+|a|an|one) (second|minute|hour)s?)?', q)
+    if m:
+        opts['interval'] = int(m.group(1)) * _UNIT_SECONDS[m.group(2)]
+        count = m.group(3)
+        count = 1 if count in ('a', 'an', 'one') else int(count or 1)
+        opts['duration'] = count * _UNIT_SECONDS[m.group(4) or 'minute']
+        opts['delay'] = 0
+    m = re.search(r'\bin (\d+) seconds?', q)
+    if m:
+        opts['delay'] = int(m.group(1))
+    if re.search(r'\b(now|immediately|instantly)\b', q):
+        opts['delay'] = 0
+    m = re.search(r'\b(png|jpe?g|webp)\b', q)
+    if m:
+        opts['fmt'] = _SHOT_FORMATS[m.group(1)]
+    if 'window' in q:
+        opts['active_window'] = True
+    m = re.search(r'region (\d+) (\d+) (\d+) (\d+)', q)
+    if m:
+        opts['region'] = tuple(int(g) for g in m.groups())
+    return opts
+
+
+class ScreenshotPipeline:
+    """Captures on the calling thread and encodes in a process pool.
+
+    Capturing only grabs pixels; compression happens in SCREENSHOT_WORKERS
+    processes, so interval capture keeps its cadence. With `dedup`, frames
+    that look the same as the last saved frame (per dHash) are skipped.
+    """
+
+    def __init__(self, folder=None, fmt=SCREENSHOT_FORMAT, quality=SCREENSHOT_QUALITY,
+                 png_level=SCREENSHOT_PNG_LEVEL, workers=SCREENSHOT_WORKERS):
+        self.folder = Path(folder or SCREENSHOT_FOLDER)
+        self.fmt = fmt
+        self.quality = quality
+        self.png_level = png_level
+        self.workers = workers
+        self.saved = 0
+        self.skipped = 0
+        self._last_hash = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                try:
+                    # spawn, not fork: forking a threaded Tk process can copy a held lock into the child
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                except (OSError, NotImplementedError):
+                    # no multiprocessing here (e.g. some sandboxes); encode on threads instead
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='encode')
+            return self._pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)  # let in-flight frames finish writing
+                self._pool = None
+
+    def capture(self, region=None, active_window=False):
+        if active_window:
+            region = sinks.active_window_region() or region
+        return sinks.screenshot(region)
+
+    def submit(self, img, fmt=None, dedup=False, stem=None):
+        """Queue `img` for encoding; returns a Future of the saved path, or None if skipped."""
+        if dedup:
+            h = dhash(img)
+            if self._last_hash is not None and bin(h ^ self._last_hash).count('1') <= SCREENSHOT_DEDUP_BITS:
+                self.skipped += 1
+                return None
+            self._last_hash = h
+        fmt = fmt or self.fmt
+        ext = 'jpg' if fmt == 'jpeg' else fmt
+        self.folder.mkdir(parents=True, exist_ok=True)
+        stem = stem or f'screenshot_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]}'
+        path = str(self.folder / f'{stem}.{ext}')
+        self.saved += 1
+        return self._executor().submit(_encode_screenshot, img.mode, img.size, img.tobytes(), path,
+                                       fmt, self.quality, self.png_level)
+
+    def reset_dedup(self):
+        self._last_hash = None
+
+
+screenshots = ScreenshotPipeline()
+
+
+# ------------------- KNOWLEDGE BASE -------------------
+KNOWLEDGE_FOLDER = APP_DIR / 'knowledge'
+KNOWLEDGE_EXTENSIONS = ('.txt', '.md')
+KB_CACHE_SIZE = 512
+KB_REFRESH_SECONDS = 5     # how often answer() re-checks the folder for edits
+KB_MIN_MATCH = 0.5         # share of the query's idf weight the best entry must cover
+KB_COMMON_TERM = 0.1      # terms in more than this share of entries never start a candidate
+BM25_K1 = 1.2
+BM25_B = 0.75
+_STOPWORDS = frozenset(
+    'a an and are as at be by can do does for from how i in is it me my of on or please '
+    'tell that the this to was what when where which who why will with you your'.split())
+
+
+def _kb_terms(text: str):
+    out = []
+    for w in _tokens(text):
+        if w in _STOPWORDS:
+            continue
+        if len(w) > 3 and w.endswith('s') and not w.endswith('ss'):
+            w = w[:-1]
+        out.append(w)
+    return out
+
+
+def parse_knowledge(text: str):
+    """Split a knowledge file into (question, answer) entries.
+
+    "Q: ..." / "A: ..." pairs are FAQ entries. Any other paragraph is a note
+    that answers questions about its own words.
+    """
+    entries = []
+    for block in re.split(r'\n\s*\n', text):
+        block = block.strip()
+        if not block:
+            continue
+        m = re.match(r'(?is)^q:\s*(.+?)\s*\n\s*a:\s*(.+)$', block)
+        if m:
+            entries.append((m.group(1).strip(), ' '.join(m.group(2).split())))
+        else:
+            entries.append(('', ' '.join(block.lstrip('#').split())))
+    return entries
+
+
+class KnowledgeBase:
+    """Local BM25 search over the FAQ/notes files in KNOWLEDGE_FOLDER.
+
+    The inverted index maps each term to {entry id: term frequency} and is
+    updated per file when its mtime or size changes. Answers to repeated
+    questions come from an LRU cache that is cleared whenever the index changes.
+    """
+
+    def __init__(self, folder=None, cache_size=KB_CACHE_SIZE):
+        self.folder = Path(folder or KNOWLEDGE_FOLDER)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._answers = []    # entry id -> answer text, None once removed
+        self._lengths = []    # entry id -> length in terms
+        self._postings = {}   # term -> {entry id: tf}
+        self._files = {}      # path -> (mtime, size, [entry ids])
+        self._live = 0
+        self._total_len = 0
+        self._cache = collections.OrderedDict()
+        self._checked_at = 0.0
+
+    def __len__(self):
+        return self._live
+
+    # ---- indexing ----
+    def refresh(self, force=False):
+        """Re-index files that were added, changed or deleted. Returns True if anything changed."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < KB_REFRESH_SECONDS:
+            return False
+        self._checked_at = now
+        seen = {}
+        if self.folder.exists():
+            for dirpath, _, names in os.walk(self.folder):
+                for name in names:
+                    if name.lower().endswith(KNOWLEDGE_EXTENSIONS):
+                        path = os.path.join(dirpath, name)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        seen[path] = (st.st_mtime, st.st_size)
+        changed = False
+        with self._lock:
+            for path in [p for p in self._files if p not in seen]:
+                self._unindex(path)
+                changed = True
+            for path, sig in seen.items():
+                old = self._files.get(path)
+                if old is not None and old[:2] == sig:
+                    continue
+                self._unindex(path)
+                try:
+                    with open(path, encoding='utf-8', errors='replace') as f:
+                        entries = parse_knowledge(f.read())
+                except OSError:
+                    continue
+                self._files[path] = (sig[0], sig[1], [self._add(q, a) for q, a in entries])
+                changed = True
+            if changed:
+                self._cache.clear()
+                if len(self._answers) > 2 * self._live + 1024:
+                    self._rebuild()
+        return changed
+
+    def _add(self, question, answer):
+        doc = len(self._answers)
+        # the question counts twice: matching it matters more than the answer
+        terms = _kb_terms(question) * 2 + _kb_terms(answer)
+        for term, tf in collections.Counter(terms).items():
+            self._postings.setdefault(term, {})[doc] = tf
+        self._answers.append(answer)
+        self._lengths.append(len(terms))
+        self._live += 1
+        self._total_len += len(terms)
+        return doc
+
+    def _unindex(self, path):
+        entry = self._files.pop(path, None)
+        if entry is None:
+            return
+        for doc in entry[2]:
+            if self._answers[doc] is None:
+                continue
+            self._answers[doc] = None
+            self._live -= 1
+            self._total_len -= self._lengths[doc]
+        dead = set(entry[2])
+        for term in [t for t, p in self._postings.items() if not dead.isdisjoint(p)]:
+            p = self._postings[term]
+            for doc in dead.intersection(p):
+                del p[doc]
+            if not p:
+                del self._postings[term]
+
+    def _rebuild(self):
+        """Drop tombstoned entries by re-numbering everything from the files."""
+        files = list(self._files)
+        self._answers, self._lengths, self._postings = [], [], {}
+        self._files, self._live, self._total_len = {}, 0, 0
+        for path in files:
+            try:
+                st = os.stat(path)
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    entries = parse_knowledge(f.read())
+            except OSError:
+                continue
+            self._files[path] = (st.st_mtime, st.st_size, [self._add(q, a) for q, a in entries])
+
+    # ---- queries ----
+    def search(self, query: str, k=3):
+        """[(score, share of query weight matched, answer)] for the k best entries."""
+        terms = set(_kb_terms(query))
+        with self._lock:
+            n = self._live
+            if not terms or not n:
+                return []
+            avgdl = self._total_len / n
+            lengths = self._lengths
+            scores = collections.defaultdict(float)
+            matched = collections.defaultdict(float)
+            total_idf = 0.0
+            # rarest terms first; a term found in most entries only adds to
+            # entries that already matched something rarer
+            for term in sorted(terms, key=lambda w: len(self._postings.get(w, ()))):
+                postings = self._postings.get(term)
+                df = len(postings) if postings else 0
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                total_idf += idf
+                if not postings:
+                    continue
+                if scores and df > n * KB_COMMON_TERM:
+                    postings = {doc: postings[doc] for doc in scores if doc in postings}
+                for doc, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc] / avgdl)
+                    scores[doc] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched[doc] += idf
+            best = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+            return [(score, matched[doc] / total_idf, self._answers[doc]) for doc, score in best]
+
+    def answer(self, query: str):
+        """The best answer if it covers enough of the question, else None."""
+        self.refresh()
+        key = ' '.join(sorted(set(_kb_terms(query))))
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        self.misses += 1
+        results = self.search(query, k=1)
+        result = results[0][2] if results and results[0][1] >= KB_MIN_MATCH else None
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+
+knowledge = KnowledgeBase()
+
+
+# ------------------- LEVEL CONTROL -------------------
+LEVEL_DEBOUNCE_S = 0.15     # requests closer together than this are applied as one batch
+LEVEL_STEP = {'volume': 10, 'brightness': 10}   # "volume up" with no amount
+VOLUME_KEY_STEP = 2         # percent per volume media key press (Windows default)
+POWERSHELL_TIMEOUT = 10.0
+BACKLIGHT_ROOT = Path('/sys/class/backlight')
+
+
+def _clamp_level(value) -> int:
+    return max(0, min(100, int(round(value))))
+
+
+class LevelBackend:
+    """Where a level lives. Backends may hold state (a process, a file) across calls."""
+
+    def read(self):
+        """Current level 0-100, or None if the platform can't tell."""
+        return None
+
+    def apply(self, target: int, current=None) -> int:
+        """Move to `target` from `current` (None if unknown); returns the level reached."""
+        raise NotImplementedError
+
+    def step(self, delta: int) -> bool:
+        """Relative change without a tracked level; False if the level can't be found."""
+        current = self.read()
+        if current is None:
+            return False
+        self.apply(_clamp_level(current + delta), current)
+        return True
+
+    def toggle_mute(self):
+        raise NotImplementedError(f'{type(self).__name__} has no mute')
+
+    def close(self):
+        pass
+
+
+class FakeLevelBackend(LevelBackend):
+    """In-memory level; `applied` lists every batch the controller sent."""
+
+    def __init__(self, level=50, on_apply=None):
+        self.level = level
+        self.muted = False
+        self.applied = []
+        self.on_apply = on_apply
+
+    def read(self):
+        return self.level
+
+    def apply(self, target, current=None):
+        self.level = target
+        self.applied.append(target)
+        if self.on_apply is not None:
+            self.on_apply(target)
+        return target
+
+    def toggle_mute(self):
+        self.muted = not self.muted
+
+
+class MediaKeyVolume(LevelBackend):
+    """System volume through the volume media keys, one batched press per change.
+
+    The OS can't be asked for the level this way, so the first absolute set
+    walks the volume to zero and counts up from there.
+    """
+
+    def __init__(self, key_step=VOLUME_KEY_STEP):
+        self.key_step = key_step
+
+    def _press(self, delta):
+        presses = round(abs(delta) / self.key_step)
+        if presses:
+            sinks.press_key('volumeup' if delta > 0 else 'volumedown', presses=presses)
+        return presses * self.key_step * (1 if delta > 0 else -1)
+
+    def apply(self, target, current=None):
+        if current is None:
+            self._press(-100)
+            current = 0
+        return _clamp_level(current + self._press(target - current))
+
+    def step(self, delta):
+        self._press(delta)
+        return True
+
+    def toggle_mute(self):
+        sinks.press_key('volumemute')
+
+
+class PowerShellSession:
+    """One long-lived powershell.exe fed commands over stdin.
+
+    Starting PowerShell costs far more than running a WMI call, so the process
+    is started on first use and kept; a marker line ends each command's output.
+    """
+
+    MARKER = '__assistant_done__'
+
+    def __init__(self, timeout=POWERSHELL_TIMEOUT):
+        self.timeout = timeout
+        self._proc = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        if self._proc is not None and self._proc.poll() is None:
+            return self._proc
+        self._proc = subprocess.Popen(
+            ['powershell', '-NoLogo', '-NoProfile', '-NonInteractive', '-Command', '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1, creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+        self._lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self._proc, self._lines),
+                         name='powershell-out', daemon=True).start()
+        return self._proc
+
+    @staticmethod
+    def _pump(proc, lines):
+        for line in proc.stdout:
+            lines.put(line.rstrip('\r\n'))
+        lines.put(None)
+
+    def run(self, script: str):
+        """Run one line of PowerShell and return its output lines."""
+        with self._lock:
+            proc = self._ensure()
+            proc.stdin.write(f"{script}\nWrite-Output '{self.MARKER}'\n")
+            proc.stdin.flush()
+            out, deadline = [], time.monotonic() + self.timeout
+            while True:
+                try:
+                    line = self._lines.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    proc.kill()
+                    raise TimeoutError('PowerShell did not answer') from None
+                if line is None:
+                    raise RuntimeError('PowerShell exited')
+                if line == self.MARKER:
+                    return out
+                out.append(line)
+
+    def close(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                try:
+                    self._proc.stdin.close()
+                    self._proc.wait(timeout=2)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._proc.kill()
+            self._proc = None
+
+
+class PowerShellBrightness(LevelBackend):
+    """Laptop panel brightness through WMI in a persistent PowerShell session."""
+
+    def __init__(self, session=None):
+        self.session = session or PowerShellSession()
+
+    def read(self):
+        out = self.session.run('(Get-WmiObject -Namespace root/WMI -Class WmiMonitorBrightness).CurrentBrightness')
+        values = [int(v) for v in out if v.strip().isdigit()]
+        return values[0] if values else None
+
+    def apply(self, target, current=None):
+        out = self.session.run('try { (Get-WmiObject -Namespace root/WMI -Class WmiMonitorBrightnessMethods)'
+                               f".WmiSetBrightness(1,{target}) | Out-Null; 'ok' }} catch {{ 'failed' }}")
+        if 'ok' not in out:
+            raise RuntimeError('this display does not support WMI brightness (external monitor?)')
+        return target
+
+    def close(self):
+        self.session.close()
+
+
+class SysfsBacklight(LevelBackend):
+    """Linux backlight through /sys/class/backlight/<device>.
+
+    Writing `brightness` needs the udev rule most distributions ship for the
+    video group (or root).
+    """
+
+    def __init__(self, device: Path):
+        self.device = Path(device)
+        self.max = int((self.device / 'max_brightness').read_text())
+
+    def read(self):
+        raw = int((self.device / 'brightness').read_text())
+        return _clamp_level(raw * 100 / self.max)
+
+    def apply(self, target, current=None):
+        (self.device / 'brightness').write_text(str(round(target * self.max / 100)))
+        return target
+
+
+def default_level_backend(name: str):
+    """The real backend for 'volume' or 'brightness' on this platform, or None."""
+    if name == 'volume':
+        return MediaKeyVolume()
+    if os.name == 'nt':
+        return PowerShellBrightness()
+    try:
+        devices = sorted(BACKLIGHT_ROOT.iterdir())
+    except OSError:
+        devices = []
+    return SysfsBacklight(devices[0]) if devices else None
+
+
+class LevelController:
+    """Tracks one level (0-100) and applies changes to a backend in debounced batches.
+
+    Requests are merged until none has arrived for `debounce` seconds: relative
+    changes add up, an absolute value replaces everything queued before it, and
+    mute toggles cancel in pairs. The backend is then called once. With
+    `debounce=0` every request is applied on the calling thread.
+    """
+
+    def __init__(self, name, backend, debounce=LEVEL_DEBOUNCE_S, log_fn=lambda s: None):
+        self.name = name
+        self.backend = backend
+        self.debounce = debounce
+        self.log = log_fn
+        self.level = None           # last level applied or read; None until known
+        self.muted = False
+        self.requests = 0
+        self.batches = 0
+        self._cond = threading.Condition()
+        self._apply_lock = threading.Lock()
+        self._base = None
+        self._delta = 0
+        self._mute = False
+        self._pending = False
+        self._last = 0.0
+        self._worker = None
+        self._closed = False
+
+    def set(self, value):
+        with self._cond:
+            self._base, self._delta = _clamp_level(value), 0
+            self._queue()
+        self._maybe_flush()
+
+    def change(self, delta):
+        with self._cond:
+            self._delta += delta
+            self._queue()
+        self._maybe_flush()
+
+    def toggle_mute(self):
+        with self._cond:
+            self._mute = not self._mute
+            self._queue()
+        self._maybe_flush()
+
+    def target(self):
+        """The tracked level with queued changes applied; never asks the OS."""
+        with self._cond:
+            base = self._base if self._base is not None else self.level
+            return None if base is None else _clamp_level(base + self._delta)
+
+    def current(self):
+        """Tracked level, reading the backend only if it has never been known."""
+        level = self.target()
+        if level is None:
+            with self._apply_lock:
+                if self.level is None:
+                    self.level = self.backend.read()
+            level = self.target()
+        return level
+
+    def _queue(self):
+        self.requests += 1
+        self._pending = True
+        self._last = time.monotonic()
+        if self.debounce > 0:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f'level-{self.name}', daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def _maybe_flush(self):
+        if self.debounce <= 0:
+            self.flush()
+
+    def _take(self):
+        batch = (self._base, self._delta, self._mute) if self._pending else None
+        self._base, self._delta, self._mute, self._pending = None, 0, False, False
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                while not self._closed:
+                    quiet = self._last + self.debounce - time.monotonic()
+                    if quiet <= 0:
+                        break
+                    self._cond.wait(quiet)
+                if self._closed:
+                    return
+                batch = self._take()
+            self._apply(batch)
+
+    def flush(self):
+        """Apply anything queued now instead of waiting out the debounce."""
+        with self._cond:
+            batch = self._take()
+        self._apply(batch)
+
+    def _apply(self, batch):
+        if batch is None:
+            return
+        base, delta, mute = batch
+        label = self.name.capitalize()
+        with self._apply_lock:
+            try:
+                if base is not None or delta:
+                    current = self.level
+                    if current is None:
+                        current = self.backend.read()
+                    if base is None and current is None:
+                        if self.backend.step(delta):
+                            self.log(f'{label} {"up" if delta > 0 else "down"} {abs(delta)}%')
+                        else:
+                            self.log(f'{label} level is unknown; set it directly, e.g. "{self.name} 50".')
+                    else:
+                        target = _clamp_level((base if base is not None else current) + delta)
+                        self.level = self.backend.apply(target, current)
+                        self.log(f'{label} {self.level}%')
+                if mute:
+                    self.backend.toggle_mute()
+                    self.muted = not self.muted
+                    self.log('Muted' if self.muted else 'Unmuted')
+                self.batches += 1
+            except Exception as e:
+                self.log(f'{label} control failed: {str(e) or type(e).__name__}')
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            batch = self._take()
+            self._cond.notify()
+        self._apply(batch)
+        self.backend.close()
+
+
+# ------------------- FEATURE IMPLEMENTATIONS -------------------
+
+def open_app(app_name: str, log_fn=lambda s: None, apps=app_index):
+    entry = apps.find(app_name)
+    if entry is None:
+        apps.refresh_async()  # may have been installed since the last scan
+        log_fn(f'Unknown app: {app_name.strip()}')
+        return
+    log_fn(f'Opening {entry[0]}...')
+    try:
+        apps.launch(entry)
+    except Exception as e:
+        log_fn(f'Could not open {entry[0]}: {e}')
+
+
+def tell_time(log_fn=lambda s: None):
+    now = datetime.datetime.now().strftime('%I:%M %p')
+    log_fn(f'Time: {now}')
+    speak(f'The current time is {now}')
+
+
+def tell_date(log_fn=lambda s: None):
+    now = datetime.datetime.now().strftime('%A, %d %B %Y')
+    log_fn(f'Date: {now}')
+    speak(f'Today is {now}')
+
+
+def play_random_music(log_fn=lambda s: None):
+    try:
+        if not MUSIC_FOLDER.exists():
+            log_fn('Music folder not found. Please set your Music folder.')
+            speak('Music folder not found.')
+            return
+        music_library.refresh_async()
+        if music_library.ready.is_set():
+            path = music_library.random_track()
+        else:
+            # Index still loading: pick from the top-level folder only.
+            files = [f for f in os.listdir(MUSIC_FOLDER) if f.lower().endswith(MUSIC_EXTENSIONS)]
+            path = str(MUSIC_FOLDER / random.choice(files)) if files else None
+        if not path:
+            log_fn('No music files found in Playlists folder.')
+            speak('No music files found.')
+            return
+        log_fn(f'Playing: {Path(path).name}')
+        sinks.startfile(path)
+    except Exception as e:
+        log_fn(f'Error playing music: {e}')
+
+
+def play_track(query: str, log_fn=lambda s: None):
+    """Play the best local match for `query`, or fall back to YouTube."""
+    music_library.refresh_async()
+    hits = music_library.search(query) if music_library.ready.is_set() else []
+    if not hits:
+        play_on_youtube(query, log_fn)
+        return
+    log_fn(f'Playing: {music_library.describe(hits[0])}')
+    try:
+        sinks.startfile(hits[0])
+    except Exception as e:
+        log_fn(f'Error playing music: {e}')
+
+
+def take_screenshot(log_fn=lambda s: None, delay=SCREENSHOT_DELAY, fmt=None, region=None,
+                    active_window=False, interval=None, duration=None):
+    """Capture once, or every `interval` seconds for `duration` seconds.
+
+    Encoding happens in the screenshot pool; this returns once frames are captured.
+    """
+    try:
+        if active_window and sinks.active_window_region() is None:
+            log_fn(f"Can't find the active window here; capturing {'the region' if region else 'the full screen'} instead.")
+            active_window = False
+        if delay:
+            speak(f'Taking screenshot in {delay} seconds. Please hold still.')
+            log_fn(f'Screenshot in {delay}s...')
+            if not sinks.wait(delay):
+                log_fn('Screenshot cancelled.')
+                return
+
+        def saved(future):
+            try:
+                path = Path(future.result())
+            except Exception as e:
+                log_fn(f'Screenshot failed: {e}')
+                return
+            log_fn(f'Screenshot saved as {path}')
+            if not interval:
+                speak(f'Screenshot saved as {path.name}')
+
+        if not interval:
+            img = screenshots.capture(region, active_window)
+            if img is None:
+                log_fn('No screen to capture.')
+                return
+            screenshots.submit(img, fmt).add_done_callback(saved)
+            return
+
+        log_fn(f'Capturing every {interval}s for {_format_interval(duration)}; say "stop" to end early.')
+        screenshots.reset_dedup()
+        saved_before, skipped_before = screenshots.saved, screenshots.skipped
+        end = time.monotonic() + duration
+        while True:
+            img = screenshots.capture(region, active_window)
+            if img is None:
+                log_fn('No screen to capture.')
+                return
+            future = screenshots.submit(img, fmt, dedup=True)
+            if future is not None:
+                future.add_done_callback(saved)
+            if time.monotonic() + interval > end or not cancellable_sleep(interval):
+                break
+        n_saved = screenshots.saved - saved_before
+        n_skipped = screenshots.skipped - skipped_before
+        log_fn(f'Interval capture done: {n_saved} saved, {n_skipped} unchanged frames skipped.')
+        speak(f'Saved {n_saved} screenshots.')
+    except Exception as e:
+        log_fn(f'Screenshot failed: {e}')
+
+
+def system_info(log_fn=lambda s: None):
+    try:
+        telemetry.start()
+        if not len(telemetry):
+            telemetry.sample()
+        s = f"CPU: {telemetry.latest('cpu'):.0f}% | RAM: {telemetry.latest('ram'):.0f}%"
+        battery = telemetry.latest('battery')
+        if battery is not None:
+            s += f' | Battery: {battery:.0f}%'
+        s += f" | Disk: {telemetry.latest('disk'):.0f}%"
+        log_fn(s)
+        speak('System status shown in UI.', coalesce='status')
+    except Exception as e:
+        log_fn(f'Could not fetch system info: {e}')
+
+
+_METRIC_ALIASES = {'cpu': 'cpu', 'processor': 'cpu', 'ram': 'ram', 'memory': 'ram',
+                   'battery': 'battery', 'disk': 'disk', 'network': 'net_recv', 'download': 'net_recv',
+                   'upload': 'net_sent'}
+
+
+def metric_history(query: str, log_fn=lambda s: None):
+    """Answer "what was CPU over the last 5 minutes" style questions from the sampler."""
+    m = re.search(r'\b(' + '|'.join(_METRIC_ALIASES) + r')\b', query)
+    metric = _METRIC_ALIASES[m.group(1)] if m else 'cpu'
+    m = re.search(r'(\d+)?\s*(second|minute|hour)s?\b', query)
+    seconds = (int(m.group(1) or 1) * _UNIT_SECONDS[m.group(2)]) if m else 300
+    telemetry.start()
+    values = telemetry.window(metric, seconds)
+    if not values:
+        log_fn(f'No {metric} samples yet; history builds up while the assistant runs.')
+        return
+    unit = ' KB/s' if metric.startswith('net') else '%'
+    scale = 1 / 1024 if metric.startswith('net') else 1
+    lo, hi, avg = min(values) * scale, max(values) * scale, sum(values) / len(values) * scale
+    span = _format_interval(max(1, round(min(seconds, len(values) * telemetry.interval))))
+    log_fn(f'{metric} over the last {span}: avg {avg:.0f}{unit}, min {lo:.0f}{unit}, max {hi:.0f}{unit}')
+    speak(f'Average {metric} was {avg:.0f}{unit}.', coalesce='status')
+
+
+def show_top_processes(query: str, log_fn=lambda s: None):
+    by = 'cpu' if 'cpu' in query else 'memory'
+    log_fn(f'Top processes by {by}:')
+    for name, pid, mem_mb, cpu in top_processes(5, by):
+        log_fn(f'  {name} (pid {pid}): {mem_mb:.0f} MB, {cpu:.0f}% CPU')
+
+
+def search_web(query: str, log_fn=lambda s: None):
+    if not query:
+        log_fn('Empty search query')
+        return
+    log_fn(f'Searching: {query}')
+    sinks.open_url('https://www.google.com/search?q=' + query.replace(' ', '+'))
+
+
+def play_on_youtube(query: str, log_fn=lambda s: None):
+    if not query:
+        log_fn('Empty youtube query - opening YouTube home')
+        sinks.open_url('https://youtube.com')
+        return
+    log_fn(f'Playing on YouTube: {query}')
+    try:
+        sinks.play_youtube(query)
+    except Exception:
+        sinks.open_url('https://www.youtube.com/results?search_query=' + query.replace(' ', '+'))
+
+
+def tell_joke(log_fn=lambda s: None):
+    joke = pyjokes.get_joke()
+    log_fn(joke)
+    speak(joke, PRIORITY_LOW)
+
+
+def shutdown_system(log_fn=lambda s: None):
+    log_fn('Shutdown initiated (10 seconds)')
+    speak('Shutting down in ten seconds. Save your work.', PRIORITY_ALERT).wait(10)
+    if os.name == 'nt':
+        sinks.system('shutdown /s /t 10')
+    else:
+        sinks.system('shutdown -h +0')
+
+
+def restart_system(log_fn=lambda s: None):
+    log_fn('Restart initiated')
+    speak('Restarting now.', PRIORITY_ALERT).wait(10)
+    if os.name == 'nt':
+        sinks.system('shutdown /r /t 5')
+    else:
+        sinks.system('reboot')
+
+# ------------------- INTENT ROUTER -------------------
+
+# (intent name, match mode, phrase patterns). `{slot}` captures words into a
+# handler keyword argument; prefix patterns also pass any trailing text as `rest`.
+BUILTIN_INTENTS = (
+    ('youtube_home', 'contains', ('open youtube',)),
+    ('youtube_play', 'prefix', ('play {song} on youtube', 'play {song} youtube')),
+    ('music', 'contains', ('play music', 'play song', 'play songs')),
+    ('play_track', 'prefix', ('play',)),
+    ('time', 'exact', ('time',)),
+    ('time', 'contains', ('what is the time', 'tell time')),
+    ('date', 'exact', ('date',)),
+    ('date', 'contains', ('today date', 'what is the date')),
+    ('screenshot', 'contains', ('screenshot', 'screenshots')),
+    ('system_info', 'contains', ('system info', 'system information', 'system status')),
+    ('system_info', 'exact', ('status',)),
+    ('joke', 'contains', ('joke', 'jokes')),
+    ('metric_history', 'contains', ('cpu over', 'ram over', 'memory over', 'cpu usage over', 'battery over',
+                                    'network over', 'cpu history', 'memory history', 'ram history')),
+    ('top_processes', 'contains', ('top processes',)),
+    ('open_file', 'prefix', ('open file',)),
+    ('open_folder', 'prefix', ('open folder',)),
+    ('open_app', 'prefix', ('open',)),
+    ('search', 'prefix', ('search',)),
+    ('shutdown', 'prefix', ('shutdown',)),
+    ('restart', 'prefix', ('restart',)),
+    ('volume_up', 'prefix', ('volume up', 'increase volume')),
+    ('volume_down', 'prefix', ('volume down', 'decrease volume')),
+    ('volume', 'prefix', ('volume', 'set volume')),
+    ('volume_level', 'exact', ('volume level', 'current volume', 'what is the volume')),
+    ('mute', 'prefix', ('mute', 'unmute')),
+    ('brightness_up', 'prefix', ('brightness up', 'increase brightness')),
+    ('brightness_down', 'prefix', ('brightness down', 'decrease brightness')),
+    ('brightness', 'prefix', ('brightness', 'set brightness')),
+    ('brightness_level', 'exact', ('brightness level', 'current brightness', 'what is the brightness')),
+    ('chat', 'prefix', ('chat', 'ask', 'talk')),
+    ('remind', 'prefix', ('remind me',)),
+    ('list_reminders', 'contains', ('list reminders', 'show reminders', 'my reminders')),
+    ('cancel_reminder', 'prefix', ('cancel reminder', 'delete reminder')),
+    ('snooze', 'prefix', ('snooze',)),
+    ('cancel_tasks', 'exact', ('cancel', 'stop', 'cancel all', 'stop all')),
+    ('task_stats', 'contains', ('task stats', 'task status')),
+    ('repeat', 'exact', ('repeat', 'again', 'repeat that', 'repeat last command', 'do that again')),
+    ('latency_report', 'contains', ('latency report', 'latency stats')),
+    ('hands_free_on', 'exact', ('start listening', 'hands free', 'hands free on', 'wake word on')),
+    ('hands_free_off', 'exact', ('stop listening', 'hands free off', 'wake word off')),
+    ('train_wake_word', 'contains', ('train wake word', 'record wake word')),
+    ('save_macro', 'prefix', ('save macro {name} as', 'create macro {name} as')),
+    ('list_macros', 'contains', ('list macros', 'show macros', 'my macros')),
+    ('delete_macro', 'prefix', ('delete macro',)),
+    ('run_macro', 'prefix', ('run macro',)),
+)
+
+_MODE_WEIGHT = {'contains': 0, 'prefix': 1, 'exact': 2}
+_SLOT = re.compile(r'^\{(\w+)\}$')
+
+
+class Intent:
+    """One phrase pattern compiled for the router."""
+    __slots__ = ('name', 'pattern', 'mode', 'handler', 'rank', 'literals', 'regex')
+
+    def __init__(self, name, pattern, mode, handler, priority=0):
+        if mode not in _MODE_WEIGHT:
+            raise ValueError(f'Unknown intent mode: {mode}')
+        self.name = name
+        self.pattern = pattern
+        self.mode = mode
+        self.handler = handler
+        words = pattern.lower().split()
+        parts, literals = [], []
+        for w in words:
+            slot = _SLOT.match(w)
+            if slot:
+                parts.append(f'(?P<{slot.group(1)}>.+?)')
+            else:
+                parts.append(re.escape(w))
+                literals.append(w)
+        body = r'\s+'.join(parts)
+        if mode == 'exact':
+            self.regex = re.compile(f'^{body}$')
+        elif mode == 'prefix':
+            self.regex = re.compile(f'^{body}(?:\\s+(?P<rest>.*))?$')
+        else:
+            self.regex = re.compile(f'(?:^|\\s){body}(?=\\s|$)')
+        self.literals = literals
+        # Explicit priority first, then the most specific phrase, then anchoring.
+        self.rank = (priority, len(literals), _MODE_WEIGHT[mode])
+
+    def leading_literals(self):
+        out = []
+        for w in self.pattern.lower().split():
+            if _SLOT.match(w):
+                break
+            out.append(w)
+        return out
+
+
+class IntentMatch:
+    __slots__ = ('intent', 'args')
+
+    def __init__(self, intent, args):
+        self.intent = intent
+        self.args = args
+
+    @property
+    def name(self):
+        return self.intent.name
+
+
+class IntentRouter:
+    """Indexed command dispatch.
+
+    Anchored patterns (exact/prefix) live in a word trie keyed by their leading
+    literal words; `contains` patterns are indexed by their first literal word.
+    A query only runs the regexes of intents whose index words it contains, so
+    dispatch cost does not grow with the number of unrelated intents.
+    """
+
+    _END = None
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+        self._trie = {}
+        self._keywords = {}
+        self._unindexed = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def register(self, name, patterns, handler, mode='prefix', priority=0):
+        if isinstance(patterns, str):
+            patterns = (patterns,)
+        for pattern in patterns:
+            intent = Intent(name, pattern, mode, handler, priority)
+            if mode == 'contains':
+                if intent.literals:
+                    self._keywords.setdefault(intent.literals[0], []).append(intent)
+                else:
+                    self._unindexed.append(intent)
+            else:
+                lead = intent.leading_literals()
+                if not lead:
+                    self._unindexed.append(intent)
+                    continue
+                node = self._trie
+                for w in lead:
+                    node = node.setdefault(w, {})
+                node.setdefault(self._END, []).append(intent)
+            self._count += 1
+
+    def intent(self, name, patterns, mode='prefix', priority=0):
+        """Decorator form of `register`."""
+        def wrap(fn):
+            self.register(name, patterns, fn, mode, priority)
+            return fn
+        return wrap
+
+    def match(self, query: str):
+        words = query.lower().split()
+        if not words:
+            return None
+        q = ' '.join(words)
+        candidates = list(self._unindexed)
+        node = self._trie
+        for w in words:
+            node = node.get(w)
+            if node is None:
+                break
+            candidates.extend(node.get(self._END, ()))
+        for w in set(words):
+            candidates.extend(self._keywords.get(w, ()))
+
+        best, best_m = None, None
+        for intent in candidates:
+            if best is not None and intent.rank <= best.rank:
+                continue
+            m = intent.regex.search(q)
+            if m:
+                best, best_m = intent, m
+        if best is None:
+            return None
+        args = {k: (v or '').strip() for k, v in best_m.groupdict().items()}
+        return IntentMatch(best, args)
+
+    def dispatch(self, query: str):
+        """Run the best matching handler (or the fallback) and return the match."""
+        m = self.match(query)
+        if m is not None:
+            m.intent.handler(query, **m.args)
+        elif self.fallback is not None:
+            self.fallback(query)
+        return m
+
+
+def register_intents(router, handlers, table=BUILTIN_INTENTS):
+    """Register every row of `table` whose name has a handler."""
+    for name, mode, patterns in table:
+        if name in handlers:
+            router.register(name, patterns, handlers[name], mode)
+    return router
+
+# ------------------- TASK EXECUTOR -------------------
+MAX_WORKERS = 4
+MAX_QUEUED_TASKS = 64
+# Per-command concurrency caps, keyed by task key (the feature function name).
+COMMAND_LIMITS = {
+    'system_info': 1,
+    'take_screenshot': 1,
+    'play_random_music': 1,
+    'shutdown_system': 1,
+    'restart_system': 1,
+    'listen': 1,
+}
+# Commands where a repeat while one is still pending just joins the pending one.
+DEDUPE_COMMANDS = {'system_info', 'tell_time', 'tell_date', 'take_screenshot', 'shutdown_system', 'restart_system', 'listen'}
+# A key like "take_screenshot:delay=0" uses the settings of "take_screenshot" but is
+# counted and de-duplicated only against tasks with the same key.
+
+_task_local = threading.local()
+
+
+def _command_name(key):
+    return key.partition(':')[0] if key else key
+
+
+def task_cancelled() -> bool:
+    """True if the task running on this thread has been cancelled.
+
+    Long-running feature functions poll this to stop early.
+    """
+    event = getattr(_task_local, 'cancel_event', None)
+    return event is not None and event.is_set()
+
+
+def cancellable_sleep(seconds: float) -> bool:
+    """Sleep unless the current task is cancelled first. Returns False if cancelled."""
+    event = getattr(_task_local, 'cancel_event', None)
+    if event is None:
+        time.sleep(seconds)
+        return True
+    return not event.wait(seconds)
+
+
+class _Task:
+    __slots__ = ('fn', 'args', 'key', 'future', 'cancel_event', 'queued_at')
+
+    def __init__(self, fn, args, key):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.future = Future()
+        self.future.cancel_event = self.cancel_event = threading.Event()
+        self.queued_at = time.perf_counter()
+
+
+class TaskExecutor:
+    """Bounded worker pool with per-key concurrency limits and de-duplication.
+
+    Queued tasks can be cancelled outright; running tasks get their
+    `cancel_event` set and are expected to check `task_cancelled()`.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queued=MAX_QUEUED_TASKS, limits=None, dedupe=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.limits = dict(COMMAND_LIMITS if limits is None else limits)
+        self.dedupe = set(DEDUPE_COMMANDS if dedupe is None else dedupe)
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._running = collections.Counter()
+        self._inflight = {}  # key -> tasks queued or running
+        self._workers = []
+        self._idle = 0
+        self._shutdown = False
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.peak_queued = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    def submit(self, fn, *args, key=None) -> Future:
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('executor is shut down')
+            if key is not None and _command_name(key) in self.dedupe:
+                for task in self._inflight.get(key, ()):
+                    if not task.future.done() and not task.cancel_event.is_set():
+                        return task.future
+            task = _Task(fn, args, key)
+            if len(self._queue) >= self.max_queued:
+                self.rejected += 1
+                task.future.set_exception(RuntimeError('Too many tasks queued'))
+                return task.future
+            self._queue.append(task)
+            self._inflight.setdefault(key, []).append(task)
+            self.peak_queued = max(self.peak_queued, len(self._queue))
+            if self._idle == 0 and len(self._workers) < self.max_workers:
+                t = threading.Thread(target=self._work, name=f'task-{len(self._workers)}', daemon=True)
+                self._workers.append(t)
+                t.start()
+            else:
+                self._cond.notify()
+        return task.future
+
+    def _take(self):
+        """Pop the first queued task whose key is under its limit (caller holds the lock)."""
+        for i, task in enumerate(self._queue):
+            if task.future.cancelled():
+                continue
+            limit = self.limits.get(_command_name(task.key))
+            if limit is None or self._running[task.key] < limit:
+                del self._queue[i]
+                return task
+        return None
+
+    def _discard_cancelled(self):
+        queue = self._queue
+        # Futures can also be cancelled directly by their owner, not just via cancel().
+        while queue and queue[0].future.cancelled():
+            self._forget(queue.popleft())
+
+    def _forget(self, task):
+        tasks = self._inflight.get(task.key)
+        if tasks is not None:
+            tasks.remove(task)
+            if not tasks:
+                del self._inflight[task.key]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._discard_cancelled()
+                task = self._take()
+                while task is None:
+                    if self._shutdown:
+                        return
+                    self._idle += 1
+                    self._cond.wait()
+                    self._idle -= 1
+                    self._discard_cancelled()
+                    task = self._take()
+                self._running[task.key] += 1
+            started = time.perf_counter()
+            failed = False
+            if task.future.set_running_or_notify_cancel():
+                _task_local.cancel_event = task.cancel_event
+                try:
+                    task.future.set_result(task.fn(*task.args))
+                except BaseException as e:
+                    failed = True
+                    task.future.set_exception(e)
+                finally:
+                    _task_local.cancel_event = None
+            finished = time.perf_counter()
+            with self._cond:
+                self._running[task.key] -= 1
+                if not self._running[task.key]:
+                    del self._running[task.key]
+                self._forget(task)
+                self.failed += failed
+                self.completed += 1
+                self._wait_total += started - task.queued_at
+                self._run_total += finished - started
+                # a slot for this key may have opened up for a waiting task
+                self._cond.notify()
+
+    def cancel(self, key=None) -> int:
+        """Cancel queued and running tasks (all of them, or only those with `key`)."""
+        n = 0
+        with self._cond:
+            for k, tasks in list(self._inflight.items()):
+                if key is not None and k != key:
+                    continue
+                for task in tasks:
+                    task.cancel_event.set()
+                    task.future.cancel()
+                    n += 1
+            dropped = [t for t in self._queue if t.future.cancelled()]
+            if dropped:
+                self._queue = collections.deque(t for t in self._queue if not t.future.cancelled())
+                for task in dropped:
+                    self._forget(task)
+            self._cond.notify_all()
+        return n
+
+    def shutdown(self):
+        self.cancel()
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            done = self.completed or 1
+            return {
+                'running': sum(self._running.values()),
+                'queued': len(self._queue),
+                'workers': len(self._workers),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'peak_queued': self.peak_queued,
+                'mean_wait_ms': self._wait_total / done * 1000,
+                'mean_run_ms': self._run_total / done * 1000,
+            }
+
+
+# ------------------- REMINDERS -------------------
+REMINDERS_FILE = APP_DIR / 'reminders.json'
+REMINDER_SAVE_DELAY = 1.0   # seconds to batch changes before rewriting the file
+_UNIT_SECONDS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+
+
+class Reminder:
+    __slots__ = ('id', 'due', 'message', 'interval')
+
+    def __init__(self, rid, due, message, interval=None):
+        self.id = rid
+        self.due = due            # epoch seconds
+        self.message = message
+        self.interval = interval  # seconds between repeats, or None
+
+    def describe(self):
+        when = datetime.datetime.fromtimestamp(self.due).strftime('%a %d %b %I:%M %p')
+        every = f' (every {_format_interval(self.interval)})' if self.interval else ''
+        return f'#{self.id} {when}{every}: {self.message}'
+
+
+def _format_interval(seconds):
+    for unit in ('week', 'day', 'hour', 'minute', 'second'):
+        n, rem = divmod(seconds, _UNIT_SECONDS[unit])
+        if n and not rem:
+            return f'{int(n)} {unit}s' if n != 1 else unit
+    return f'{int(seconds)} seconds'
+
+
+def _parse_clock(text):
+    """'9am', '9:30 pm', '21:15' -> (hour, minute), or None."""
+    m = re.fullmatch(r'(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?', text.strip())
+    if not m:
+        return None
+    hour, minute = int(m.group(1)), int(m.group(2) or 0)
+    ampm = (m.group(3) or '').replace('.', '')
+    if ampm == 'pm' and hour < 12:
+        hour += 12
+    elif ampm == 'am' and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return hour, minute
+
+
+def parse_reminder(q: str, now=None):
+    """Parse a "remind me ..." command into (message, due epoch, interval) or None.
+
+    Understands "in 10 minutes to ...", "at 9am to ...", "tomorrow at 7:30 pm to ...",
+    "every day at 9am to ...", "every 2 hours to ..." and "every week to ...".
+    """
+    now = now or datetime.datetime.now()
+    m = re.search(r'remind me (.+?) to (.+)$', q)
+    if not m:
+        return None
+    when, msg = m.group(1).strip(), m.group(2).strip()
+
+    m = re.fullmatch(r'in (\d+) (second|minute|hour|day|week)s?', when)
+    if m:
+        return msg, now.timestamp() + int(m.group(1)) * _UNIT_SECONDS[m.group(2)], None
+
+    interval = None
+    m = re.fullmatch(r'every (?:(\d+) )?(second|minute|hour|day|week)s?(?: at (.+))?', when)
+    if m:
+        interval = int(m.group(1) or 1) * _UNIT_SECONDS[m.group(2)]
+        if not m.group(3):
+            return msg, now.timestamp() + interval, interval
+        when = f'at {m.group(3)}'
+
+    m = re.fullmatch(r'(today |tomorrow )?at (.+)', when)
+    if m:
+        clock = _parse_clock(m.group(2))
+        if clock is None:
+            return None
+        due = now.replace(hour=clock[0], minute=clock[1], second=0, microsecond=0)
+        if m.group(1) == 'tomorrow ':
+            due += datetime.timedelta(days=1)
+        elif due <= now:
+            due += datetime.timedelta(days=1)
+        return msg, due.timestamp(), interval
+    return None
+
+
+class ReminderScheduler:
+    """One thread firing reminders from a min-heap of due times.
+
+    Reminders are persisted to REMINDERS_FILE so they survive restarts.
+    Cancelling or snoozing leaves the old heap entry in place; it is skipped
+    when popped, and the heap is rebuilt once stale entries dominate.
+    """
+
+    def __init__(self, on_fire, path=REMINDERS_FILE):
+        self.on_fire = on_fire
+        self.path = Path(path) if path else None  # None keeps reminders in memory only
+        self.last_fired = None
+        self._heap = []         # (due, id); may hold stale entries
+        self._reminders = {}    # id -> Reminder
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._dirty_since = None
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._load()
+            self._thread = threading.Thread(target=self._run, name='reminders', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.save()
+
+    # ---- persistence ----
+    def _load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for rid, due, message, interval in data.get('reminders', ()):
+            self._reminders[rid] = Reminder(rid, due, message, interval)
+            self._heap.append((due, rid))
+        heapq.heapify(self._heap)
+        self._next_id = max(data.get('next_id', 1), max(self._reminders, default=0) + 1)
+
+    def save(self):
+        if self.path is None:
+            self._dirty_since = None
+            return
+        with self._cond:
+            data = {
+                'next_id': self._next_id,
+                'reminders': [[r.id, r.due, r.message, r.interval] for r in self._reminders.values()],
+            }
+            self._dirty_since = None
+        try:
+            _atomic_write_json(self.path, data)
+        except OSError as e:
+            print(f'Could not save reminders: {e}')
+
+    def _changed(self):
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        self._cond.notify()
+
+    # ---- commands ----
+    def add(self, message, due, interval=None) -> Reminder:
+        with self._cond:
+            r = Reminder(self._next_id, due, message, interval)
+            self._next_id += 1
+            self._reminders[r.id] = r
+            heapq.heappush(self._heap, (due, r.id))
+            self._changed()
+            return r
+
+    def cancel(self, rid) -> bool:
+        with self._cond:
+            if self._reminders.pop(rid, None) is None:
+                return False
+            self._compact()
+            self._changed()
+            return True
+
+    def snooze(self, seconds, rid=None):
+        """Push reminder `rid` (default: the one that fired last) back by `seconds`.
+
+        A recurring reminder keeps its schedule; the snooze is a separate one-off.
+        """
+        with self._cond:
+            if rid is None:
+                r = self.last_fired
+                if r is None:
+                    return None
+                if not r.interval:
+                    r = self._reminders.get(r.id)   # still pending if it was snoozed before
+            else:
+                r = self._reminders.get(rid)
+                if r is None:
+                    return None
+            if r is None or r.interval:
+                # a fired one-off is gone, and moving a series would shift every later occurrence
+                source = r or self.last_fired
+                r = Reminder(self._next_id, 0, source.message)
+                self._next_id += 1
+                self._reminders[r.id] = r
+            r.due = time.time() + seconds
+            heapq.heappush(self._heap, (r.due, r.id))
+            self._changed()
+            return r
+
+    def list(self):
+        with self._cond:
+            return sorted(self._reminders.values(), key=lambda r: r.due)
+
+    # ---- scheduler thread ----
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._reminders) + 64:
+            self._heap = [(r.due, r.id) for r in self._reminders.values()]
+            heapq.heapify(self._heap)
+
+    def _due(self, now):
+        """Pop every reminder due by `now`, rescheduling recurring ones."""
+        fired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            due, rid = heapq.heappop(heap)
+            r = self._reminders.get(rid)
+            if r is None or r.due != due:
+                continue  # cancelled or rescheduled
+            fired.append(r)
+            if r.interval:
+                # skip occurrences missed while the app was closed
+                r.due += max(1, -(-(now - r.due) // r.interval)) * r.interval
+                heapq.heappush(heap, (r.due, rid))
+            else:
+                del self._reminders[rid]
+            self._changed()
+        return fired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    self._compact()
+                    now = time.time()
+                    fired = self._due(now)
+                    if fired:
+                        break
+                    timeout = 60.0
+                    if self._heap:
+                        timeout = min(timeout, self._heap[0][0] - now)
+                    if self._dirty_since is not None:
+                        flush_in = self._dirty_since + REMINDER_SAVE_DELAY - time.monotonic()
+                        if flush_in <= 0:
+                            break
+                        timeout = min(timeout, flush_in)
+                    self._cond.wait(max(timeout, 0.01))
+            for r in fired:
+                self.last_fired = r
+                try:
+                    self.on_fire(r)
+                except Exception as e:
+                    print(f'Reminder callback failed: {e}')
+            if self._dirty_since is not None and time.monotonic() - self._dirty_since >= REMINDER_SAVE_DELAY:
+                self.save()
+
+
+# ------------------- SESSION LOG -------------------
+LOG_DIR = APP_DIR / 'logs'
+LOG_MAX_LINES = 1000     # lines kept in the visible log pane
+LOG_FLUSH_MS = 50
+LOG_BATCH = 500          # most lines moved to the pane per tick
+
+
+class SessionLog:
+    """Log sink safe to call from any thread.
+
+    `write` only appends to a deque. The Tk thread calls `drain` on a timer,
+    which appends the batch to an on-disk session file and returns it for
+    display, so the pane can stay small while the full history is kept.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or LOG_DIR / f'session_{time.strftime("%Y%m%d_%H%M%S")}.log')
+        self.count = 0
+        self._pending = collections.deque()
+        self._unshown = collections.deque()   # on disk already (copy_to flushed them), not yet displayed
+        self._file = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending) + len(self._unshown)
+
+    def write(self, text: str):
+        ts = datetime.datetime.now().strftime('%H:%M:%S')
+        self._pending.append(f'[{ts}] {text}')
+
+    def drain(self, limit=LOG_BATCH):
+        batch = []
+        unshown = self._unshown
+        while unshown and len(batch) < limit:
+            batch.append(unshown.popleft())
+        return batch + self._write(limit - len(batch))
+
+    def _write(self, limit):
+        """Move up to `limit` pending lines to the session file and return them."""
+        batch = []
+        pending = self._pending
+        while pending and len(batch) < limit:
+            batch.append(pending.popleft())
+        if batch:
+            self.count += len(batch)
+            f = self._open()
+            if f:
+                f.write('\n'.join(batch) + '\n')
+                f.flush()
+        return batch
+
+    def _open(self):
+        if self._file is None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            except OSError as e:
+                print(f'Session log disabled: {e}')
+                self._file = False
+        return self._file
+
+    def copy_to(self, dest):
+        """Stream the whole session history to `dest`."""
+        while self._pending:
+            self._unshown.extend(self._write(LOG_BATCH))
+        with open(self.path, 'rb') as src, open(dest, 'wb') as out:
+            shutil.copyfileobj(src, out)
+
+    def close(self):
+        """Write out pending lines; they stay available to `drain` for display."""
+        while self._pending:
+            self._unshown.extend(self._write(LOG_BATCH))
+        if self._file:
+            self._file.close()
+        self._file = None
+
+
+# ------------------- COMMAND HISTORY -------------------
+HISTORY_FILE = APP_DIR / 'history.jsonl'
+HISTORY_HALF_LIFE = 7 * 86400   # seconds for a use to count half as much
+HISTORY_TOP_K = 8               # completions kept per trie node
+HISTORY_BUCKET_SIZE = 64        # commands a trie leaf holds before it splits
+HISTORY_RECALL = 1000           # commands reachable with Up/Down
+HISTORY_SUGGESTIONS = 5
+HISTORY_POLL_MS = 15            # how often the GUI checks for a finished suggestion
+
+
+def _logaddexp2(a, b):
+    """log2(2**a + 2**b) without overflow."""
+    if a < b:
+        a, b = b, a
+    return a + math.log2(1 + 2 ** (b - a))
+
+
+class _HistoryNode:
+    __slots__ = ('children', 'top', 'bucket')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []         # [(-score, text)] best first, at most HISTORY_TOP_K
+        self.bucket = set()   # commands below a leaf; None once the node has split
+
+
+class CommandHistory:
+    """Every command run, ranked by frecency, with prefix completion.
+
+    A command's score is log2(sum of 2**(t/HISTORY_HALF_LIFE)) over its uses:
+    exponentially decayed frequency, stored so that it never has to be
+    re-computed as time passes and only ever grows. That lets each trie node
+    keep its top-K completions up to date as commands are recorded.
+
+    The trie is a burst trie: a leaf holds up to HISTORY_BUCKET_SIZE commands
+    and splits by the next character when it overflows, so memory grows with
+    the number of commands rather than their length. Uses are appended to a
+    JSON-lines file, which is compacted on load.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = Path(path) if path else None
+        self.loaded = threading.Event()
+        self._lock = threading.RLock()
+        self._scores = {}     # text -> [score, count, last used]
+        self._root = _HistoryNode()
+        self._recent = collections.deque(maxlen=HISTORY_RECALL)
+        self._unsaved = []    # uses recorded before load() finished; written once it has
+        if self.path is None:
+            self.loaded.set()
+
+    def __len__(self):
+        return len(self._scores)
+
+    # ---- persistence ----
+    def load(self):
+        """Read the history file, then rewrite it compacted if it has grown."""
+        if self.path is None or self.loaded.is_set():
+            return
+        scores, lines = {}, 0
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        text, last, *agg = json.loads(line)
+                    except ValueError:
+                        continue
+                    lines += 1
+                    count, score = agg if agg else (1, last / HISTORY_HALF_LIFE)
+                    entry = scores.get(text)
+                    if entry is None:
+                        scores[text] = [score, count, last]
+                    else:
+                        entry[0] = _logaddexp2(entry[0], score)
+                        entry[1] += count
+                        entry[2] = max(entry[2], last)
+        except OSError:
+            pass
+        with self._lock:
+            # merge with anything recorded while loading, then build the trie in one pass
+            for text, (score, count, last) in scores.items():
+                entry = self._scores.get(text)
+                if entry is None:
+                    self._scores[text] = [score, count, last]
+                else:
+                    entry[0] = _logaddexp2(entry[0], score)
+                    entry[1] += count
+                    entry[2] = max(entry[2], last)
+            self._root = self._build(sorted(self._scores, key=lambda t: -self._scores[t][0]), 0)
+            recent = sorted(self._scores, key=lambda t: self._scores[t][2])[-HISTORY_RECALL:]
+            self._recent.extendleft(reversed(recent))
+            self.loaded.set()
+            if lines > 2 * len(self._scores) + 1000:
+                self._compact()   # written from _scores, which already holds the unsaved uses
+            else:
+                self._append(self._unsaved)
+            self._unsaved = []
+
+    def _compact(self):
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for text, (score, count, last) in self._scores.items():
+                f.write(json.dumps([text, last, count, score]) + '\n')
+        os.replace(tmp, self.path)
+
+    def _append(self, uses):
+        if not uses:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(use) + '\n' for use in uses)
+        except OSError:
+            pass
+
+    # ---- updates ----
+    def _apply(self, text, score, count, last):
+        entry = self._scores.get(text)
+        if entry is None:
+            entry = self._scores[text] = [score, count, last]
+        else:
+            entry[0] = _logaddexp2(entry[0], score)
+            entry[1] += count
+            entry[2] = max(entry[2], last)
+        self._index(text, entry[0])
+
+    def _index(self, text, score):
+        node, depth = self._root, 0
+        while True:
+            self._offer(node, text, score)
+            if node.bucket is not None:
+                node.bucket.add(text)
+                if len(node.bucket) > HISTORY_BUCKET_SIZE:
+                    self._split(node, depth)
+                return
+            if depth == len(text):
+                return
+            child = node.children.get(text[depth])
+            if child is None:
+                child = node.children[text[depth]] = _HistoryNode()
+            node, depth = child, depth + 1
+
+    def _build(self, texts, depth):
+        """A subtree for `texts` (best first), which all share their first `depth` characters."""
+        node = _HistoryNode()
+        node.top = [(-self._scores[t][0], t) for t in texts[:HISTORY_TOP_K]]
+        if len(texts) <= HISTORY_BUCKET_SIZE:
+            node.bucket.update(texts)
+            return node
+        # characters every command here shares become a chain of one-child nodes
+        shared = len(os.path.commonprefix((min(texts), max(texts))))
+        tail = node
+        for ch in texts[0][depth:shared]:
+            child = _HistoryNode()
+            child.top = list(node.top)
+            tail.bucket = None
+            tail.children = {ch: child}
+            tail = child
+        depth = max(depth, shared)
+        # A command exactly `depth` long only needs to be in the top lists
+        # it already reached; every longer one moves down to a child.
+        groups = {}
+        for t in texts:
+            if len(t) > depth:
+                groups.setdefault(t[depth], []).append(t)
+        tail.bucket = None
+        tail.children = {ch: self._build(group, depth + 1) for ch, group in groups.items()}
+        return node
+
+    def _split(self, node, depth):
+        texts = sorted(node.bucket, key=lambda t: -self._scores[t][0])
+        split = self._build(texts, depth)
+        node.children, node.bucket = split.children, split.bucket
+
+    @staticmethod
+    def _offer(node, text, score):
+        top = node.top
+        if len(top) >= HISTORY_TOP_K and -score >= top[-1][0]:
+            return
+        for i, (_, t) in enumerate(top):
+            if t == text:
+                del top[i]
+                break
+        bisect.insort(top, (-score, text))
+        del top[HISTORY_TOP_K:]
+
+    def record(self, text: str, when=None):
+        text = ' '.join(text.lower().split())
+        if not text:
+            return
+        when = time.time() if when is None else when
+        with self._lock:
+            self._apply(text, when / HISTORY_HALF_LIFE, 1, when)
+            if not self._recent or self._recent[-1] != text:
+                self._recent.append(text)
+            if self.path is None:
+                return
+            if self.loaded.is_set():
+                self._append([[text, when]])
+            else:
+                # the loader is still reading the file; appending now could count this use twice
+                self._unsaved.append([text, when])
+
+    # ---- queries ----
+    def recall(self, back: int):
+        """The command `back` steps before the latest (0 = latest), or None."""
+        with self._lock:
+            if 0 <= back < len(self._recent):
+                return self._recent[-1 - back]
+            return None
+
+    def suggest(self, prefix: str, limit=HISTORY_SUGGESTIONS):
+        """Most frecent commands starting with `prefix`, excluding `prefix` itself."""
+        prefix = re.sub(r'\s+', ' ', prefix.lower().lstrip())
+        if not prefix:
+            return []
+        with self._lock:
+            node = self._root
+            for ch in prefix:
+                if node.bucket is not None:
+                    hits = [t for t in node.bucket if t.startswith(prefix) and t != prefix]
+                    return heapq.nlargest(limit, hits, key=lambda t: self._scores[t][0])
+                node = node.children.get(ch)
+                if node is None:
+                    return []
+            return [t for _, t in node.top if t != prefix][:limit]
+
+class Suggester:
+    """Computes completions on a worker thread for the command entry.
+
+    Only the newest request matters: a request that is superseded before it
+    starts is dropped, and a result that arrives after a newer request was
+    made is discarded, so the Tk thread never waits and never shows stale
+    suggestions.
+    """
+
+    def __init__(self, history: CommandHistory):
+        self.history = history
+        self.cancelled = 0
+        self._cond = threading.Condition()
+        self._gen = 0
+        self._pending = None
+        self._result = None
+        self._thread = None
+
+    def request(self, prefix: str) -> int:
+        with self._cond:
+            self._gen += 1
+            if self._pending is not None:
+                self.cancelled += 1
+            self._pending = (self._gen, prefix)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='suggest', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return self._gen
+
+    def result(self, gen: int):
+        """The suggestions for request `gen` if ready, else None."""
+        with self._cond:
+            if self._result is not None and self._result[0] == gen:
+                return self._result[1]
+            return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                gen, prefix = self._pending
+                self._pending = None
+            suggestions = self.history.suggest(prefix)
+            with self._cond:
+                if gen == self._gen:
+                    self._result = (gen, suggestions)
+                else:
+                    self.cancelled += 1
+
+
+# ------------------- COMPOUND COMMANDS -------------------
+MACROS_FILE = APP_DIR / 'macros.json'
+MACROS_REFRESH_SECONDS = 2   # how often the macro file is re-checked for hand edits
+COMPOUND_MAX_STEPS = 8
+PLAN_MAX_DEPTH = 3           # plans started from inside a plan step ("run macro", "repeat")
+# "and" joins steps that may run together; "then" (or ";") waits for everything before it.
+_COMPOUND_SPLIT = re.compile(r'\s*(;|(?:,\s*)?\b(?:and then|then|after that|and)\b)\s*')
+# Intents whose free text may itself contain "and"/"then": the rest of the command is theirs.
+COMPOUND_ATOMIC = frozenset({'chat', 'remind', 'save_macro', 'search', 'open_app', 'open_file', 'open_folder',
+                             'play_track', 'youtube_play'})
+
+
+def split_compound(q: str, match):
+    """Split "a and b then c" into stages [[a, b], [c]].
+
+    `match(text)` is the router's matcher. Returns None unless there are at
+    least two parts and every one of them is a command on its own. A part
+    matching a COMPOUND_ATOMIC intent takes the rest of `q` with it, so
+    "search black and white screenshot" stays one search.
+    """
+    if ' and ' not in q and ' then ' not in q and 'after that' not in q and ';' not in q:
+        return None
+    seps = list(_COMPOUND_SPLIT.finditer(q))
+    starts = [0] + [s.end() for s in seps]
+    ends = [s.start() for s in seps] + [len(q)]
+    stages, stage = [], []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        part = q[start:end].strip()
+        m = match(part) if part else None
+        if m is None:
+            return None
+        if m.name in COMPOUND_ATOMIC:
+            stage.append(q[start:].strip())
+            break
+        stage.append(part)
+        if i < len(seps) and seps[i].group(1).lstrip(', ') != 'and':
+            stages.append(stage)
+            stage = []
+    stages.append(stage)
+    if not 1 < sum(len(s) for s in stages) <= COMPOUND_MAX_STEPS:
+        return None
+    return stages
+
+
+class PlanStep:
+    __slots__ = ('plan', 'index', 'text', 'futures', 'speech', 'start', 'end')
+
+    def __init__(self, plan, index, text):
+        self.plan = plan
+        self.index = index
+        self.text = text
+        self.futures = []     # background tasks the step's handler queued
+        self.speech = []      # (text, priority, coalesce) held back until earlier steps finish
+        self.start = self.end = None
+
+    @property
+    def ms(self):
+        return (self.end - self.start) * 1000 if self.end is not None else None
+
+
+class CommandPlan:
+    """A compound command or macro: stages run in order, the steps of a stage together.
+
+    Each step is dispatched with the plan's capture active, so `run_background`
+    records the step's tasks and `speak` buffers its speech. Speech is released
+    in step order as steps complete; a later step never talks over an earlier one.
+    """
+
+    def __init__(self, name, label, stages):
+        self.name = name      # 'compound' or 'macro', reported like an intent name
+        self.label = label
+        self.stages = []
+        self.steps = []
+        for texts in stages:
+            stage = [PlanStep(self, len(self.steps) + i, t) for i, t in enumerate(texts)]
+            self.stages.append(stage)
+            self.steps.extend(stage)
+        self.start = self.end = None
+        self.depth = 0        # how many plans this one was started from inside
+        self.parent = None    # the PlanStep that started this plan, if any
+        self.future = None    # resolved when done, so that step waits for this plan
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+        self._spoken = 0
+
+    def step_done(self, step):
+        step.end = time.perf_counter()
+        with self._lock:
+            ready = []
+            while self._spoken < len(self.steps) and self.steps[self._spoken].end is not None:
+                ready.extend(self.steps[self._spoken].speech)
+                self._spoken += 1
+            # sinks.speak keeps queue order, so releasing under the lock keeps step order
+            for text, priority, coalesce in ready:
+                if self.parent is not None:
+                    self.parent.speech.append((text, priority, coalesce))
+                else:
+                    sinks.speak(text, priority, coalesce)
+
+    def timings(self) -> str:
+        return ', '.join(f'{s.text} {s.ms:.0f} ms' for s in self.steps if s.ms is not None)
+
+
+class _Capture:
+    """`with` block making `step` the target of run_background/speak on this thread."""
+    __slots__ = ('step', 'saved')
+
+    def __init__(self, step):
+        self.step = step
 
-import pyttsx3
-import speech_recognition as sr
-import pywhatkit
-import pyautogui
-import psutil
-import pyjokes
+    def __enter__(self):
+        self.saved = getattr(_capture, 'step', None)
+        _capture.step = self.step
+        return self.step
 
-# ------------------- CONFIG -------------------
-USER_NAME = os.getlogin() if hasattr(os, 'getlogin') else 'user'
-MUSIC_FOLDER = Path.home() / 'Music' / 'Playlists'
-DEFAULT_APPS = {
-    'notepad': 'notepad.exe',
-    'calculator': 'calc.exe',
-    'chrome': r'C:\Program Files\Google\Chrome\Application\chrome.exe',
-    'vscode': fr'C:\Users\{USER_NAME}\AppData\Local\Programs\Microsoft VS Code\Code.exe'
-}
+    def __exit__(self, *exc):
+        _capture.step = self.saved
 
-# ------------------- TTS SETUP -------------------
-engine = pyttsx3.init('sapi5') if os.name == 'nt' else pyttsx3.init()
-voices = engine.getProperty('voices')
-engine.setProperty('voice', voices[0].id if voices else '')
-engine.setProperty('rate', 160)
 
-# ------------------- UTILS -------------------
+def _when_all(futures, callback):
+    """Call `callback()` once every future is done (immediately if there are none)."""
+    if not futures:
+        callback()
+        return
+    left = [len(futures)]
+    lock = threading.Lock()
 
-def speak(text: str):
-    """Speak text and optionally print to console."""
-    try:
-        engine.say(text)
-        engine.runAndWait()
-    except Exception:
-        print('TTS failed')
+    def one_done(_):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            callback()
 
+    for f in futures:
+        f.add_done_callback(one_done)
 
-def recognize_speech(timeout=6, phrase_time_limit=6):
-    r = sr.Recognizer()
-    with sr.Microphone() as source:
-        r.pause_threshold = 0.8
-        audio = r.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
-    try:
-        return r.recognize_google(audio, language='en-in')
-    except Exception:
-        return None
 
+def _cancel_requested(future) -> bool:
+    event = getattr(future, 'cancel_event', None)   # only TaskExecutor futures have one
+    return event is not None and event.is_set()
 
-# ------------------- FEATURE IMPLEMENTATIONS -------------------
 
-def open_app(app_name: str, log_fn=lambda s: None):
-    app_name = app_name.lower().strip()
-    path = DEFAULT_APPS.get(app_name)
-    if path:
-        log_fn(f'Opening {app_name}...')
+class MacroBook:
+    """Named command sequences, kept in a JSON file as {name: [stage, ...]}.
+
+    A stage is a command string whose "and"-joined parts run together.
+    """
+
+    def __init__(self, path=MACROS_FILE):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._macros = None
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def _load(self):
+        # re-read when the file was edited by hand since the last look
+        now = time.monotonic()
+        if self._macros is not None and now - self._checked_at < MACROS_REFRESH_SECONDS:
+            return self._macros
+        self._checked_at = now
         try:
-            os.startfile(path)
-        except Exception as e:
-            log_fn(f'Could not open {app_name}: {e}')
-    else:
-        log_fn(f'Unknown app: {app_name}')
+            mtime = self.path.stat().st_mtime if self.path else None
+        except OSError:
+            mtime = None
+        if self._macros is not None and mtime == self._mtime:
+            return self._macros
+        data = {}
+        if mtime is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                data = {' '.join(str(k).lower().split()): [str(s) for s in v]
+                        for k, v in raw.items() if isinstance(v, list)}
+            except (OSError, ValueError, AttributeError) as e:
+                print(f'Could not load macros: {e}')
+        self._macros, self._mtime = data, mtime
+        return data
 
+    def names(self):
+        with self._lock:
+            return sorted(self._load())
 
-def tell_time(log_fn=lambda s: None):
-    now = datetime.datetime.now().strftime('%I:%M %p')
-    log_fn(f'Time: {now}')
-    speak(f'The current time is {now}')
+    def get(self, name: str):
+        with self._lock:
+            return self._load().get(' '.join(name.lower().split()))
 
+    def _save(self):
+        if self.path is not None:
+            _atomic_write_json(self.path, self._macros)
+            self._mtime = self.path.stat().st_mtime
 
-def tell_date(log_fn=lambda s: None):
-    now = datetime.datetime.now().strftime('%A, %d %B %Y')
-    log_fn(f'Date: {now}')
-    speak(f'Today is {now}')
+    def put(self, name: str, stages):
+        with self._lock:
+            self._load()[' '.join(name.lower().split())] = list(stages)
+            self._save()
 
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            found = self._load().pop(' '.join(name.lower().split()), None) is not None
+            if found:
+                self._save()
+            return found
 
-def play_random_music(log_fn=lambda s: None):
-    try:
-        if not MUSIC_FOLDER.exists():
-            log_fn('Music folder not found. Please set your Music folder.')
-            speak('Music folder not found.')
+
+# ------------------- ENGINE -------------------
+
+class AssistantEngine:
+    """Command routing and assistant state, with no GUI.
+
+    `log_fn` receives every log line and may be called from any thread.
+    With `inline=True` feature functions run on the calling thread instead
+    of the task executor, which is what batch mode wants.
+    """
+
+    def __init__(self, log_fn=print, inline=False, reminders_path=REMINDERS_FILE, history_path=HISTORY_FILE,
+                 macros_path=MACROS_FILE, app_usage_path=APP_USAGE_FILE):
+        self.log = log_fn
+        self.inline = inline
+        self.status = 'Ready'
+        self.executor = TaskExecutor()
+        self.reminders = ReminderScheduler(self._reminder_fired, reminders_path)
+        self.history = CommandHistory(history_path)
+        self.macros = MacroBook(macros_path)
+        # the GUI's Quick Apps follow the shared index; any other usage file gets its own
+        self.apps = app_index if app_usage_path == APP_USAGE_FILE else AppIndex(usage_file=app_usage_path)
+        self.hands_free = None
+        self._levels = {}
+        self.router = self._build_router()
+
+    def start(self):
+        """Start reminders, then build the indexes one at a time on a background thread."""
+        self.reminders.start()
+        threading.Thread(target=self._load_indexes, name='engine-load', daemon=True).start()
+
+    def _load_indexes(self):
+        # In sequence rather than all at once, so start-up I/O doesn't pile up;
+        # history first because the command box suggests from it.
+        jobs = (self.history.load, self.apps.refresh, music_library.refresh,
+                lambda: knowledge.refresh(True), lambda: speech.prerender(common_phrases()))
+        for job in jobs:
+            try:
+                job()
+            except Exception as e:
+                print(f'Start-up task failed: {e}')
+
+    def shutdown(self):
+        self.stop_hands_free(quiet=True)
+        self.executor.shutdown()
+        for controller in self._levels.values():
+            controller.close()
+        tracer.close()
+        telemetry.stop()
+        screenshots.shutdown()
+        self.reminders.stop()
+
+    def set_status(self, text: str):
+        self.status = text
+
+    def run_background(self, fn, key=None):
+        """Queue a feature function on the task executor so the caller doesn't block.
+
+        Named feature functions are keyed by name for the per-command limits
+        and de-duplication in COMMAND_LIMITS / DEDUPE_COMMANDS.
+        """
+        if key is None and getattr(fn, '__name__', '<lambda>') != '<lambda>':
+            key = fn.__name__
+        trace = tracer.current()
+        parent = tracer.current_span()
+        step = getattr(_capture, 'step', None)
+
+        def target():
+            with tracer.activate(trace, parent), _Capture(step), tracer.span(f'execute:{key or "task"}'):
+                try:
+                    fn(lambda s: self.log(s))
+                except Exception as e:
+                    self.log(f'Error: {e}')
+
+        if self.inline:
+            target()
+            future = Future()
+            future.set_result(None)
+            return future
+        if trace is not None:
+            trace.hold()
+        future = self.executor.submit(target, key=key)
+        if step is not None:
+            step.futures.append(future)
+        if trace is not None:
+            future.add_done_callback(lambda f: trace.release())
+        if future.done() and not future.cancelled() and future.exception():
+            self.log(f'Busy: {future.exception()}')
+        return future
+
+    def cancel_tasks(self):
+        n = self.executor.cancel()
+        speech.cancel()
+        self.log(f'Cancelled {n} task(s).')
+
+    def show_task_stats(self):
+        st = self.executor.stats()
+        self.log('Tasks: {running} running, {queued} queued (peak {peak_queued}), {completed} done, '
+                 '{failed} failed, {rejected} rejected | wait {mean_wait_ms:.1f} ms, run {mean_run_ms:.1f} ms'.format(**st))
+        tts = speech.cache.stats()
+        self.log('Speech cache: {hits} hits, {misses} misses, {entries} phrases ({bytes} bytes)'.format(**tts))
+
+    def handle_query(self, query: str):
+        """Process a typed or spoken query."""
+        q = (query or '').lower().strip()
+        if not q:
+            self.log('Empty command received.')
             return
-        files = [f for f in os.listdir(MUSIC_FOLDER) if f.lower().endswith(('.mp3', '.wav', '.m4a', '.flac', '.aac', '.wma'))]
-        if not files:
-            log_fn('No music files found in Playlists folder.')
-            speak('No music files found.')
+        trace = tracer.current()
+        if trace is None and tracer.enabled:
+            # a typed command: its trace starts here (spoken ones start at capture)
+            trace = tracer.begin(q)
+            with tracer.activate(trace):
+                try:
+                    return self._route(q, trace)
+                finally:
+                    trace.release()
+        return self._route(q, trace)
+
+    def _route(self, q, trace):
+        self.log(f'Processing: {q}')
+        with tracer.span('routing'):
+            plan = self.plan(q)
+            m = self.router.dispatch(q) if plan is None else plan
+        if trace is not None and trace.intent is None:
+            trace.intent = m.name if m else 'fallback'
+        if plan is not None:
+            self.run_plan(plan, trace)
+        if m is None or m.name != 'repeat':
+            self.history.record(q)
+        return m
+
+    def plan(self, q: str):
+        """A CommandPlan if `q` names a macro or chains several commands, else None."""
+        steps = self.macros.get(q)
+        if steps is not None:
+            stages = []
+            for s in steps:
+                stages.extend(split_compound(s, self.router.match) or [[s]])
+            return CommandPlan('macro', q, stages)
+        stages = split_compound(q, self.router.match)
+        return CommandPlan('compound', q, stages) if stages else None
+
+    def run_plan(self, plan, trace=None):
+        """Start a plan's first stage; returns an Event set when the last step is done."""
+        parent = getattr(_capture, 'step', None)
+        plan.depth = parent.plan.depth + 1 if parent is not None else 0
+        if plan.depth > PLAN_MAX_DEPTH:
+            self.log(f'Not running "{plan.label}": macros nested too deeply.')
+            plan.finished.set()
+            return plan.finished
+        if parent is not None:
+            plan.parent, plan.future = parent, Future()
+            parent.futures.append(plan.future)
+        plan.start = time.perf_counter()
+        if trace is not None:
+            trace.hold()
+        self._run_stage(plan, 0, trace)
+        return plan.finished
+
+    def _finish_plan(self, plan, trace, stopped=False):
+        plan.end = time.perf_counter()
+        state = 'Stopped' if stopped else 'Done'
+        self.log(f'{state}: {plan.label} in {(plan.end - plan.start) * 1000:.0f} ms ({plan.timings()})')
+        plan.finished.set()
+        if plan.future is not None:
+            plan.future.set_result(None)
+        if trace is not None:
+            trace.release()
+
+    def _run_stage(self, plan, k, trace):
+        if k == len(plan.stages):
+            self._finish_plan(plan, trace)
             return
-        choice = random.choice(files)
-        path = MUSIC_FOLDER / choice
-        log_fn(f'Playing: {choice}')
-        os.startfile(path)
-    except Exception as e:
-        log_fn(f'Error playing music: {e}')
+        stage = plan.stages[k]
+        with tracer.activate(trace):
+            for step in stage:
+                self.log(f'[{step.index + 1}/{len(plan.steps)}] {step.text}')
+                step.start = time.perf_counter()
+                with _Capture(step), tracer.span(f'step:{step.text}'):
+                    try:
+                        self.router.dispatch(step.text)
+                    except Exception as e:
+                        self.log(f'Error: {e}')
+                _when_all(step.futures, lambda s=step: plan.step_done(s))
+        futures = [f for s in stage for f in s.futures]
 
+        def next_stage():
+            # "cancel" stops the rest of the plan; a task that had started is
+            # never cancelled(), but TaskExecutor.cancel sets its cancel_event
+            if any(f.cancelled() or _cancel_requested(f) for f in futures):
+                self._finish_plan(plan, trace, stopped=True)
+            else:
+                self._run_stage(plan, k + 1, trace)
 
-def take_screenshot(log_fn=lambda s: None):
-    try:
-        speak('Taking screenshot in 3 seconds. Please hold still.')
-        log_fn('Screenshot in 3s...')
-        time.sleep(3)
-        img = pyautogui.screenshot()
-        filename = Path.cwd() / f'screenshot_{int(time.time())}.png'
-        img.save(filename)
-        log_fn(f'Screenshot saved as {filename}')
-        speak(f'Screenshot saved as {filename.name}')
-    except Exception as e:
-        log_fn(f'Screenshot failed: {e}')
+        _when_all(futures, next_stage)
 
+    def save_macro(self, name: str, commands: str):
+        # "save macro morning routine as tell time and system info then play music"
+        stages = split_compound(commands, self.router.match)
+        if stages is None:
+            parts = [p.strip() for p in _COMPOUND_SPLIT.split(commands)[::2] if p and p.strip()]
+            first = self.router.match(parts[0]) if parts else None
+            unknown = [] if first is not None and first.name in COMPOUND_ATOMIC else \
+                [p for p in parts if self.router.match(p) is None]
+            if unknown:
+                self.log(f'Not a command: "{unknown[0]}"')
+                return
+            stages = [[commands]] if commands else None
+        if not name or stages is None:
+            self.log('Could not save macro. Try: "save macro morning routine as tell time then play music"')
+            return
+        if self.router.match(name) is not None:
+            # macros are looked up before routing, so this name would hide the command
+            self.log(f'"{name}" is already a command; pick another macro name.')
+            return
+        steps = [' and '.join(s) for s in stages]
+        if self._macro_reaches(steps, ' '.join(name.split())):
+            self.log(f'Macro "{name}" would end up running itself.')
+            return
+        self.macros.put(name, steps)
+        self.log(f'Saved macro "{name}" ({sum(len(s) for s in stages)} steps). Say "{name}" to run it.')
 
-def system_info(log_fn=lambda s: None):
-    try:
-        cpu = psutil.cpu_percent(interval=1)
-        mem = psutil.virtual_memory()
-        battery = psutil.sensors_battery()
-        s = f'CPU: {cpu}% | RAM: {int(mem.percent)}%'
-        if battery:
-            s += f' | Battery: {int(battery.percent)}%'
-        log_fn(s)
-        speak('System status shown in UI.')
-    except Exception as e:
-        log_fn(f'Could not fetch system info: {e}')
+    def _macro_calls(self, steps):
+        """Names of the macros `steps` start through "run macro <name>"."""
+        calls = []
+        for s in steps:
+            for stage in split_compound(s, self.router.match) or [[s]]:
+                for part in stage:
+                    m = self.router.match(part)
+                    if m is not None and m.name == 'run_macro':
+                        calls.append(' '.join(m.args.get('rest', '').split()))
+        return calls
 
+    def _macro_reaches(self, steps, name):
+        """True if running `steps` would start macro `name`, directly or through other macros."""
+        stack, seen = self._macro_calls(steps), set()
+        while stack:
+            called = stack.pop()
+            if called == name:
+                return True
+            if called not in seen:
+                seen.add(called)
+                stack.extend(self._macro_calls(self.macros.get(called) or ()))
+        return False
 
-def search_web(query: str, log_fn=lambda s: None):
-    if not query:
-        log_fn('Empty search query')
-        return
-    log_fn(f'Searching: {query}')
-    wb.open('https://www.google.com/search?q=' + query.replace(' ', '+'))
+    def list_macros(self):
+        names = self.macros.names()
+        if not names:
+            self.log('No macros saved.')
+            return
+        self.log(f'{len(names)} macro(s):')
+        for name in names:
+            self.log(f'  {name}: {" then ".join(self.macros.get(name))}')
 
+    def delete_macro(self, name: str):
+        if self.macros.delete(name):
+            self.log(f'Macro "{name}" deleted.')
+        else:
+            self.log(f'No macro "{name}".')
 
-def play_on_youtube(query: str, log_fn=lambda s: None):
-    if not query:
-        log_fn('Empty youtube query - opening YouTube home')
-        wb.open('https://youtube.com')
-        return
-    log_fn(f'Playing on YouTube: {query}')
-    try:
-        pywhatkit.playonyt(query)
-    except Exception:
-        wb.open('https://www.youtube.com/results?search_query=' + query.replace(' ', '+'))
+    def run_macro(self, name: str):
+        plan = self.plan(name) if self.macros.get(name) is not None else None
+        if plan is None:
+            self.log(f'No macro "{name}".')
+            return
+        self.run_plan(plan, tracer.current())
 
+    def _build_router(self):
+        handlers = {
+            'youtube_home': lambda q, **a: self.run_background(lambda log: play_on_youtube('', log)),
+            'youtube_play': lambda q, song, **a: self.run_background(lambda log: play_on_youtube(song, log)),
+            'music': lambda q, **a: self.run_background(play_random_music),
+            'play_track': lambda q, rest, **a: self.run_background(lambda log: play_track(rest, log) if rest else play_random_music(log)),
+            'time': lambda q, **a: self.run_background(tell_time),
+            'date': lambda q, **a: self.run_background(tell_date),
+            'screenshot': lambda q, **a: self.screenshot_command(q),
+            'system_info': lambda q, **a: self.run_background(system_info),
+            'joke': lambda q, **a: self.run_background(tell_joke),
+            'metric_history': lambda q, **a: self.run_background(lambda log: metric_history(q, log)),
+            'top_processes': lambda q, **a: self.run_background(lambda log: show_top_processes(q, log), 'top_processes'),
+            'open_file': lambda q, **a: self.open_path_dialog('file'),
+            'open_folder': lambda q, **a: self.open_path_dialog('folder'),
+            'open_app': lambda q, rest, **a: self.run_background(lambda log: open_app(rest, log, self.apps)),
+            'search': lambda q, rest, **a: self.run_background(lambda log: search_web(rest, log)),
+            'shutdown': lambda q, **a: self.run_background(shutdown_system),
+            'restart': lambda q, **a: self.run_background(restart_system),
+            'volume_up': lambda q, rest, **a: self.level_command('volume', rest, 1),
+            'volume_down': lambda q, rest, **a: self.level_command('volume', rest, -1),
+            'volume': lambda q, rest, **a: self.level_command('volume', rest),
+            'volume_level': lambda q, **a: self.report_level('volume'),
+            'mute': lambda q, **a: self.change_volume('mute'),
+            'brightness_up': lambda q, rest, **a: self.level_command('brightness', rest, 1),
+            'brightness_down': lambda q, rest, **a: self.level_command('brightness', rest, -1),
+            'brightness': lambda q, rest, **a: self.level_command('brightness', rest),
+            'brightness_level': lambda q, **a: self.report_level('brightness'),
+            'chat': lambda q, rest, **a: self.chat_command(rest),
+            'remind': lambda q, **a: self.reminder_command(q),
+            'list_reminders': lambda q, **a: self.list_reminders(),
+            'cancel_reminder': lambda q, rest, **a: self.cancel_reminder(rest),
+            'snooze': lambda q, rest, **a: self.snooze_reminder(rest),
+            'cancel_tasks': lambda q, **a: self.cancel_tasks(),
+            'task_stats': lambda q, **a: self.show_task_stats(),
+            'repeat': lambda q, **a: self.repeat_last(),
+            'latency_report': lambda q, **a: self.latency_report(),
+            'hands_free_on': lambda q, **a: self.start_hands_free(),
+            'hands_free_off': lambda q, **a: self.stop_hands_free(),
+            'train_wake_word': lambda q, **a: self.train_wake_word(),
+            'save_macro': lambda q, name, rest, **a: self.save_macro(name, rest),
+            'list_macros': lambda q, **a: self.list_macros(),
+            'delete_macro': lambda q, rest, **a: self.delete_macro(rest),
+            'run_macro': lambda q, rest, **a: self.run_macro(rest),
+        }
+        return register_intents(IntentRouter(fallback=self.web_fallback), handlers)
 
-def tell_joke(log_fn=lambda s: None):
-    joke = pyjokes.get_joke()
-    log_fn(joke)
-    speak(joke)
+    # ---- hands-free listening ----
+    def _listener(self):
+        if self.hands_free is None:
+            self.hands_free = HandsFreeListener(self.handle_query, log_fn=self.log,
+                                                on_wake=lambda: speak('Yes?', coalesce='wake'))
+        return self.hands_free
 
+    def start_hands_free(self, source=None):
+        listener = self._listener()
+        if not listener.matcher and not listener.enrolling:
+            self.log('No wake word recorded yet. Say or type "train wake word" first.')
+            return
+        listener.start(source)
+        self.log('Hands-free listening on. Say the wake word, then your command.')
 
-def shutdown_system(log_fn=lambda s: None):
-    log_fn('Shutdown initiated (10 seconds)')
-    speak('Shutting down in ten seconds. Save your work.')
-    if os.name == 'nt':
-        os.system('shutdown /s /t 10')
-    else:
-        os.system('shutdown -h +0')
+    def stop_hands_free(self, quiet=False):
+        if self.hands_free is not None and self.hands_free.running:
+            self.hands_free.stop()
+            if not quiet:
+                self.log('Hands-free listening off.')
+
+    def toggle_hands_free(self):
+        if self.hands_free is not None and self.hands_free.running:
+            self.stop_hands_free()
+        else:
+            self.start_hands_free()
 
+    def train_wake_word(self, source=None):
+        listener = self._listener()
+        listener.enroll()
+        listener.start(source)
+        self.log(f'Say your wake word {WAKE_ENROLL_COUNT} times, pausing after each.')
+        speak(f'Say your wake word {WAKE_ENROLL_COUNT} times, pausing after each.')
+
+    def latency_report(self):
+        rows = tracer.report()
+        if not rows:
+            self.log('No commands traced yet.' if tracer.enabled else 'Tracing is off (--no-trace).')
+            return
+        self.log(f'{"latency (ms)":<26}{"n":>6}{"p50":>9}{"p95":>9}{"p99":>9}{"max":>9}')
+        for name, n, p50, p95, p99, top in rows:
+            label = f'  {name.split(".", 1)[1]}' if '.' in name else name
+            self.log(f'{label:<26}{n:>6}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{top:>9.1f}')
+
+    def repeat_last(self):
+        last = self.history.recall(0)
+        if last is None:
+            self.log('Nothing to repeat yet.')
+            return
+        self.log(f'Repeating: {last}')
+        self.handle_query(last)
+
+    def web_fallback(self, q: str):
+        answer = knowledge.answer(q)
+        if answer:
+            self.log(f'Assistant: {answer}')
+            speak(answer)
+            return
+        self.log('Command not recognized locally. Opening web search for query.')
+        self.run_background(lambda log: search_web(q, log))
+
+    def level(self, name: str):
+        """The LevelController for 'volume' or 'brightness', created on first use."""
+        controller = self._levels.get(name)
+        if controller is None:
+            backend = sinks.level_backend(name)
+            if backend is None:
+                return None
+            debounce = 0 if self.inline else LEVEL_DEBOUNCE_S
+            controller = self._levels.setdefault(name, LevelController(name, backend, debounce, self.log))
+        return controller
+
+    def level_command(self, name: str, rest: str, direction=0):
+        # "volume 40", "set brightness to 70", "volume up", "brightness down 20"
+        controller = self.level(name)
+        if controller is None:
+            self.log(f'{name.capitalize()} control is not available on this system.')
+            return
+        num = re.search(r'(\d{1,3})', rest)
+        amount = int(num.group(1)) if num else None
+        if direction:
+            controller.change(direction * (amount if amount is not None else LEVEL_STEP[name]))
+        elif amount is None:
+            self.report_level(name)
+        elif amount > 100:
+            self.log(f'Please say a {name} value between 0 and 100.')
+        else:
+            controller.set(amount)
+
+    def report_level(self, name: str):
+        controller = self.level(name)
+        if controller is None:
+            self.log(f'{name.capitalize()} control is not available on this system.')
+            return
+        try:
+            level = controller.current()
+        except Exception as e:
+            self.log(f'Could not read {name}: {e}')
+            return
+        if level is None:
+            self.log(f'{name.capitalize()} level is not known yet.')
+            return
+        self.log(f'{name.capitalize()}: {level}%')
+        speak(f'{name.capitalize()} is at {level} percent')
+
+    def chat_command(self, txt: str):
+        # simple chatbot mode: answer small talk or open web for unknown
+        if not txt:
+            self.log('You entered chat mode: say something like "chat how are you"')
+            speak('I am ready to chat. Say something.')
+        else:
+            response = self.simple_chat_response(txt)
+            self.log(f'Assistant: {response}')
+            speak(response)
+
+    def screenshot_command(self, q: str):
+        # keyed by its options, so "screenshot now" never joins a running interval capture
+        opts = parse_screenshot_command(q)
+        key = ':'.join(['take_screenshot'] + [f'{k}={v}' for k, v in sorted(opts.items())])
+        self.run_background(lambda log: take_screenshot(log, **opts), key)
+
+    def open_path_dialog(self, kind: str):
+        path = sinks.ask_path(kind)
+        if path:
+            try:
+                sinks.startfile(path)
+                self.log(f'Opened: {path}')
+            except Exception as e:
+                self.log(f'Could not open {path}: {e}')
+
+    def reminder_command(self, q: str):
+        # e.g. "remind me in 10 seconds to take a break", "remind me every day at 9am to stretch"
+        parsed = parse_reminder(q)
+        if parsed is None:
+            self.log('Could not parse reminder. Try: "remind me in 10 seconds to check oven" or "remind me at 9am to call mom"')
+            return
+        msg, due, interval = parsed
+        r = self.reminders.add(msg, due, interval)
+        self.log(f'Reminder set {r.describe()}')
+
+    def _reminder_fired(self, r):
+        speak(f'Reminder: {r.message}', PRIORITY_ALERT)
+        self.log(f'Reminder fired: {r.message}')
+
+    def list_reminders(self):
+        items = self.reminders.list()
+        if not items:
+            self.log('No reminders set.')
+            return
+        self.log(f'{len(items)} reminder(s):')
+        for r in items[:20]:
+            self.log(f'  {r.describe()}')
+        if len(items) > 20:
+            self.log(f'  ... and {len(items) - 20} more')
+
+    def cancel_reminder(self, rest: str):
+        m = re.search(r'(\d+)', rest)
+        if not m:
+            self.log('Say which reminder to cancel, e.g. "cancel reminder 3".')
+        elif self.reminders.cancel(int(m.group(1))):
+            self.log(f'Reminder #{m.group(1)} cancelled.')
+        else:
+            self.log(f'No reminder #{m.group(1)}.')
+
+    def snooze_reminder(self, rest: str):
+        # "snooze", "snooze 10 minutes", "snooze reminder 3 for 1 hour"
+        m = re.search(r'(?:reminder (\d+)\s*)?(?:for )?(?:(\d+) (second|minute|hour)s?)?', rest)
+        rid = int(m.group(1)) if m.group(1) else None
+        secs = int(m.group(2)) * _UNIT_SECONDS[m.group(3)] if m.group(2) else 300
+        r = self.reminders.snooze(secs, rid)
+        self.log(f'Snoozed {r.describe()}' if r else 'Nothing to snooze.')
+
+    def change_volume(self, mode: str):
+        if mode == 'mute':
+            controller = self.level('volume')
+            if controller is not None:
+                controller.toggle_mute()
+        else:
+            self.level_command('volume', '', 1 if mode == 'up' else -1)
+
+    def set_brightness(self, value: int):
+        self.level_command('brightness', str(max(0, min(100, int(value)))))
+
+    def simple_chat_response(self, text: str) -> str:
+        # small talk first, then the local knowledge base
+        t = text.lower()
+        words = set(_tokens(t))
+        if words & {'hi', 'hello', 'hey'}:
+            return 'Hello! How are you today?'
+        if 'how are you' in t:
+            return 'I am just code — but I am functioning perfectly. How can I help you?'
+        if any(w in t for w in ('your name', 'who are you')):
+            return 'I am your Desktop Assistant built with Python. You can ask me to open apps, play music, or take screenshots.'
+        if 'joke' in words:
+            return pyjokes.get_joke()
+        answer = knowledge.answer(t)
+        if answer:
+            return answer
+        # fallback small reply then offer search
+        return 'I am not sure about that. Shall I search the web for you? Say "search <your question>".'
 
-def restart_system(log_fn=lambda s: None):
-    log_fn('Restart initiated')
-    speak('Restarting now.')
-    if os.name == 'nt':
-        os.system('shutdown /r /t 5')
-    else:
-        os.system('reboot')
 
 # ------------------- GUI APP -------------------
 
+class GuiSinks(Sinks):
+    """Default sinks plus Tk dialogs for questions the engine asks the user."""
+
+    def ask_path(self, kind: str):
+        return filedialog.askopenfilename() if kind == 'file' else filedialog.askdirectory()
+
+
+class StatsPanel(tk.Toplevel):
+    """Live sparklines fed from the telemetry sampler.
+
+    Each new sample shifts the existing segments left and adds one segment per
+    series; nothing is redrawn from scratch.
+    """
+
+    WIDTH, HEIGHT, STEP = 360, 50, 4
+    # (series, label, value -> 0..1 height, value -> text)
+    SERIES = (
+        ('cpu', 'CPU', lambda v: v / 100, lambda v: f'{v:.0f}%'),
+        ('ram', 'RAM', lambda v: v / 100, lambda v: f'{v:.0f}%'),
+        ('net_recv', 'Net in', lambda v: math.log10(1 + v) / 8, lambda v: f'{v / 1024:.0f} KB/s'),
+        ('net_sent', 'Net out', lambda v: math.log10(1 + v) / 8, lambda v: f'{v / 1024:.0f} KB/s'),
+    )
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.title('Live Stats')
+        self.resizable(False, False)
+        self._last_sample = None
+        self._after_id = None
+        self.rows = []
+        for i, (name, label, height, fmt) in enumerate(self.SERIES):
+            var = tk.StringVar(value=label)
+            ttk.Label(self, textvariable=var, width=16).grid(row=i, column=0, sticky='w', padx=6)
+            canvas = tk.Canvas(self, width=self.WIDTH, height=self.HEIGHT, bg='white', highlightthickness=0)
+            canvas.grid(row=i, column=1, padx=6, pady=4)
+            self.rows.append({'name': name, 'label': label, 'height': height, 'fmt': fmt,
+                              'var': var, 'canvas': canvas, 'items': collections.deque(), 'y': None})
+        self._tick()
+
+    def _tick(self):
+        t = telemetry.times.latest()
+        if t is not None and t != self._last_sample:
+            self._last_sample = t
+            for row in self.rows:
+                v = telemetry.latest(row['name'])
+                if v is not None:
+                    self._push(row, v)
+        self._after_id = self.after(max(100, int(telemetry.interval * 500)), self._tick)
+
+    def destroy(self):
+        # a pending tick would otherwise fire into a deleted Tcl command
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        super().destroy()
+
+    def _push(self, row, value):
+        c, w, h = row['canvas'], self.WIDTH, self.HEIGHT
+        y = h - 2 - (h - 4) * min(max(row['height'](value), 0.0), 1.0)
+        c.move('seg', -self.STEP, 0)
+        if row['y'] is not None:
+            row['items'].append(c.create_line(w - self.STEP, row['y'], w, y, fill='#1f77b4', width=2, tags='seg'))
+        row['y'] = y
+        while len(row['items']) > w // self.STEP:
+            c.delete(row['items'].popleft())
+        row['var'].set(f"{row['label']}: {row['fmt'](value)}")
+
+
 class AssistantGUI(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -211,7 +5084,19 @@ class AssistantGUI(tk.Tk):
         self.command_var = tk.StringVar()
         entry = ttk.Entry(top, textvariable=self.command_var, width=70)
         entry.grid(row=0, column=0, padx=(0, 8))
-        entry.bind('<Return>', lambda e: self.apply_text_command())
+        entry.bind('<Return>', self._on_return)
+        entry.bind('<KeyRelease>', self._on_entry_key)
+        entry.bind('<Up>', lambda e: self._history_step(1))
+        entry.bind('<Down>', lambda e: self._history_step(-1))
+        entry.bind('<Tab>', self._accept_suggestion)
+        entry.bind('<Escape>', lambda e: self._hide_suggestions())
+        self.entry = entry
+        # completion dropdown, placed under the entry while there are suggestions
+        self.suggest_box = tk.Listbox(self, activestyle='none', exportselection=False)
+        self.suggest_box.bind('<ButtonRelease-1>', self._accept_suggestion)
+        self._typed = ''
+        self._recall_pos = -1
+        self._suggest_gen = 0
 
         btn_speak = ttk.Button(top, text='🎙️ Speak', command=self.on_speak_click)
         btn_speak.grid(row=0, column=1, padx=4)
@@ -232,6 +5117,9 @@ class AssistantGUI(tk.Tk):
         ttk.Button(mid, text='Screenshot', command=lambda: self.run_background(take_screenshot)).grid(row=0, column=3, padx=6, pady=6)
         ttk.Button(mid, text='System Info', command=lambda: self.run_background(system_info)).grid(row=0, column=4, padx=6, pady=6)
         ttk.Button(mid, text='Tell Joke', command=lambda: self.run_background(tell_joke)).grid(row=0, column=5, padx=6, pady=6)
+        ttk.Button(mid, text='Live Stats', command=self.toggle_stats_panel).grid(row=0, column=6, padx=6, pady=6)
+        ttk.Button(mid, text='Hands-free', command=lambda: self.engine.toggle_hands_free()).grid(row=0, column=7, padx=6, pady=6)
+        self.stats_panel = None
 
         # Lower frame: log and quick app open
         lower = ttk.Frame(self, padding=8)
@@ -243,13 +5131,17 @@ class AssistantGUI(tk.Tk):
         ttk.Label(left, text='Assistant Log').pack(anchor='w')
         self.logbox = tk.Text(left, height=22, state='disabled', wrap='word')
         self.logbox.pack(fill='both', expand=True, pady=(4, 0))
+        self.session_log = SessionLog()
+        self._log_lines = 0
+        self.after(LOG_FLUSH_MS, self._drain_log)
 
         right = ttk.Frame(lower, width=260)
         right.pack(side='right', fill='y')
 
         ttk.Label(right, text='Quick Apps').pack(anchor='w')
-        for app in DEFAULT_APPS.keys():
-            ttk.Button(right, text=app.title(), width=28, command=lambda a=app: self.run_background(lambda log: open_app(a, log))).pack(pady=4)
+        self.quick_apps = ttk.Frame(right)
+        self.quick_apps.pack(fill='x')
+        self._build_quick_apps()
 
         ttk.Separator(right).pack(fill='x', pady=6)
         ttk.Button(right, text='Volume Up', width=28, command=lambda: self.change_volume('up')).pack(pady=4)
@@ -266,40 +5158,86 @@ class AssistantGUI(tk.Tk):
         ttk.Button(right, text='Always on Top', width=28, command=lambda: self.toggle_always_on_top()).pack(pady=4)
         ttk.Button(right, text='Exit', width=28, command=self.on_close).pack(pady=4)
 
+        install_sinks(GuiSinks())
+        self.engine = AssistantEngine(log_fn=self.log)
+        self.suggester = Suggester(self.engine.history)
+
         # Status bar
         self.status_var = tk.StringVar(value='Ready')
         status = ttk.Label(self, textvariable=self.status_var, relief='sunken', anchor='w')
         status.pack(side='bottom', fill='x')
+        self.after(STATUS_REFRESH_MS, self._refresh_status)
 
-        # Greet
+        # Greet once the window is drawn, then load the heavy modules and indexes in the background.
         self.log('Welcome! Say "open youtube", "play music", "time", "date", "screenshot", "system info", "joke", "open notepad", or type a command and press Run.')
+        self.warmed = threading.Event()
+        self.after_idle(self._warm_up)
+
+    def _warm_up(self):
         speak('Hello! I am your desktop assistant. How can I help you?')
+        self.engine.start()
+
+        def warm():
+            warm_imports()
+            telemetry.start()
+            self.warmed.set()
+        threading.Thread(target=warm, name='warm-up', daemon=True).start()
 
     # ---------------- UI helpers ----------------
     def log(self, text: str):
-        ts = datetime.datetime.now().strftime('%H:%M:%S')
-        self.logbox.configure(state='normal')
-        self.logbox.insert('end', f'[{ts}] {text}\n')
-        self.logbox.see('end')
-        self.logbox.configure(state='disabled')
+        # Safe from any thread; _drain_log moves lines into the widget.
+        self.session_log.write(text)
+
+    def _drain_log(self):
+        batch = self.session_log.drain()
+        if batch:
+            box = self.logbox
+            box.configure(state='normal')
+            box.insert('end', '\n'.join(batch) + '\n')
+            self._log_lines += len(batch)
+            excess = self._log_lines - LOG_MAX_LINES
+            if excess > 0:
+                box.delete('1.0', f'{excess + 1}.0')
+                self._log_lines = LOG_MAX_LINES
+            box.see('end')
+            box.configure(state='disabled')
+        self.after(LOG_FLUSH_MS, self._drain_log)
 
     def set_status(self, text: str):
-        self.status_var.set(text)
+        # Rendered by _refresh_status on the Tk thread, so workers may call this.
+        self.engine.set_status(text)
 
-    def run_background(self, fn):
-        """Run a feature function in background thread so UI doesn't block."""
-        def target():
-            self.set_status('Working...')
-            try:
-                fn(lambda s: self.log(s))
-            except Exception as e:
-                self.log(f'Error: {e}')
-            self.set_status('Ready')
+    def _refresh_status(self):
+        st = self.engine.executor.stats()
+        text = self.engine.status
+        if st['running'] or st['queued']:
+            text = f"{text} | {st['running']} running, {st['queued']} queued"
+        if tracer.last:
+            text = f'{text} | last: {tracer.last[0]} {tracer.last[1]:.0f} ms'
+        if self.status_var.get() != text:
+            self.status_var.set(text)
+        if app_index.version != self._quick_apps_version:
+            self._build_quick_apps()
+        self.after(STATUS_REFRESH_MS, self._refresh_status)
 
-        t = threading.Thread(target=target, daemon=True)
-        t.start()
+    def _build_quick_apps(self):
+        self._quick_apps_version = app_index.version
+        for child in self.quick_apps.winfo_children():
+            child.destroy()
+        for app in app_index.most_used():
+            ttk.Button(self.quick_apps, text=app.title(), width=28, command=lambda a=app: self.run_background(lambda log: open_app(a, log))).pack(pady=4)
 
     # ---------------- Commands -----------------
+    def run_background(self, fn, key=None):
+        return self.engine.run_background(fn, key)
+
+    def _on_return(self, event=None):
+        if self.suggest_box.curselection():
+            self._accept_suggestion()
+        self._hide_suggestions()
+        self._recall_pos = -1
+        self.apply_text_command()
+
     def apply_text_command(self):
         query = self.command_var.get().lower().strip()
         if not query:
@@ -310,159 +5248,115 @@ class AssistantGUI(tk.Tk):
 
     def handle_query(self, query: str = None):
         """Process a typed or spoken query."""
-        q = query if query is not None else self.command_var.get().lower().strip()
-        q = (q or '').lower()
-        if not q:
-            self.log('Empty command received.')
-            return
-        self.log(f'Processing: {q}')
-
-        # Basic command routing
-        if 'open youtube' in q:
-            self.run_background(lambda log: play_on_youtube(''))
-        elif q.startswith('play ') and 'youtube' in q:
-            # format: play <song> on youtube
-            song = q.replace('play', '').replace('on youtube', '').strip()
-            self.run_background(lambda log: play_on_youtube(song, log))
-        elif 'play music' in q or 'play song' in q:
-            self.run_background(play_random_music)
-        elif 'time' == q or 'what is the time' in q or 'tell time' in q:
-            self.run_background(tell_time)
-        elif 'date' == q or 'today date' in q or 'what is the date' in q:
-            self.run_background(tell_date)
-        elif 'screenshot' in q:
-            self.run_background(take_screenshot)
-        elif 'system info' in q or 'status' in q:
-            self.run_background(system_info)
-        elif 'joke' in q:
-            self.run_background(tell_joke)
-        elif q.startswith('open '):
-            app = q.replace('open', '').strip()
-            self.run_background(lambda log: open_app(app, log))
-        elif q.startswith('search '):
-            term = q.replace('search', '').strip()
-            self.run_background(lambda log: search_web(term, log))
-        elif q.startswith('shutdown'):
-            self.run_background(shutdown_system)
-        elif q.startswith('restart'):
-            self.run_background(restart_system)
-        elif q.startswith('volume up'):
-            self.change_volume('up')
-        elif q.startswith('volume down'):
-            self.change_volume('down')
-        elif q.startswith('mute') or q.startswith('unmute'):
-            self.change_volume('mute')
-        elif q.startswith('brightness'):
-            # example: "brightness 50" or "set brightness to 70"
-            try:
-                import re
-                num = re.search(r"(\d{1,3})", q)
-                if num:
-                    val = int(num.group(1))
-                    self.set_brightness(val)
-                else:
-                    self.log('Please say brightness value between 0 and 100.')
-            except Exception as e:
-                self.log(f'Brightness command failed: {e}')
-        elif q.startswith('chat') or q.startswith('ask') or q.startswith('talk'):
-            # simple chatbot mode: answer small talk or open web for unknown
-            txt = q.replace('chat', '').replace('ask', '').replace('talk', '').strip()
-            if not txt:
-                self.log('You entered chat mode: say something like "chat how are you"')
-                speak('I am ready to chat. Say something.')
-            else:
-                response = self.simple_chat_response(txt)
-                self.log(f'Assistant: {response}')
-                speak(response)
-        elif q.startswith('open file') or q.startswith('open folder'):
-            # open file/folder dialog
-            path = filedialog.askopenfilename() if 'file' in q else filedialog.askdirectory()
-            if path:
-                try:
-                    os.startfile(path)
-                    self.log(f'Opened: {path}')
-                except Exception as e:
-                    self.log(f'Could not open {path}: {e}')
-        elif q.startswith('remind me'):
-            # format: remind me in 10 seconds to take a break
-            try:
-                import re
-                m = re.search(r'in (\d+) (second|seconds|minute|minutes|hour|hours) to (.+)', q)
-                if m:
-                    num = int(m.group(1))
-                    unit = m.group(2)
-                    msg = m.group(3)
-                    secs = num * (60 if 'minute' in unit else 3600 if 'hour' in unit else 1)
-                    threading.Timer(secs, lambda: (speak(f'Reminder: {msg}'), self.log(f'Reminder fired: {msg}'))).start()
-                    self.log(f'Reminder set for {num} {unit}: {msg}')
-                else:
-                    self.log('Could not parse reminder. Try: "remind me in 10 seconds to check oven"')
-            except Exception as e:
-                self.log(f'Reminder error: {e}')
-        else:
-            # fallback: try quick web search
-            self.log('Command not recognized locally. Opening web search for query.')
-            self.run_background(lambda log: search_web(q, log))
+        self.engine.handle_query(query if query is not None else self.command_var.get())
 
     def change_volume(self, mode: str):
-        try:
-            if mode == 'up':
-                pyautogui.press('volumeup')
-                self.log('Volume up (media key)')
-            elif mode == 'down':
-                pyautogui.press('volumedown')
-                self.log('Volume down (media key)')
-            else:
-                pyautogui.press('volumemute')
-                self.log('Toggled mute')
-        except Exception as e:
-            self.log(f'Volume control failed: {e}')
+        self.engine.change_volume(mode)
 
     def set_brightness(self, value: int):
-        try:
-            val = max(0, min(100, int(value)))
-            # Try Windows WMI via powershell
-            if os.name == 'nt':
-                cmd = [
-                    'powershell',
-                    f"(Get-WmiObject -Namespace root/WMI -Class WmiMonitorBrightnessMethods).WmiSetBrightness(1,{val})"
-                ]
-                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                self.log(f'Set brightness to {val}% (requested)')
+        self.engine.set_brightness(value)
+
+    # ---------------- History and completion ----------------
+    def _set_entry(self, text):
+        self._typed = text
+        self.command_var.set(text)
+        self.entry.icursor('end')
+
+    def _history_step(self, step):
+        """Up/Down: move through the suggestions if shown, else through past commands."""
+        box = self.suggest_box
+        if box.winfo_ismapped():
+            sel = box.curselection()
+            if sel:
+                i = sel[0] - step
             else:
-                self.log('Brightness control not implemented on this OS.')
-        except Exception as e:
-            self.log(f'Brightness set failed: {e}')
+                i = box.size() - 1 if step > 0 else 0
+            box.selection_clear(0, 'end')
+            if 0 <= i < box.size():
+                box.selection_set(i)
+                box.see(i)
+            return 'break'
+        pos = self._recall_pos + step
+        if pos < 0:
+            self._recall_pos = -1
+            self._set_entry('')
+        else:
+            text = self.engine.history.recall(pos)
+            if text is not None:
+                self._recall_pos = pos
+                self._set_entry(text)
+        return 'break'
 
-    def simple_chat_response(self, text: str) -> str:
-        # lightweight rule-based responses
-        t = text.lower()
-        if any(w in t for w in ('hi', 'hello', 'hey')):
-            return 'Hello! How are you today?'
-        if 'how are you' in t:
-            return 'I am just code — but I am functioning perfectly. How can I help you?'
-        if any(w in t for w in ('your name', 'who are you')):
-            return 'I am your Desktop Assistant built with Python. You can ask me to open apps, play music, or take screenshots.'
-        if 'joke' in t:
-            return pyjokes.get_joke()
-        # fallback small reply then offer search
-        return 'I am not sure about that. Shall I search the web for you? Say "search <your question>".'
+    def _on_entry_key(self, event):
+        text = self.command_var.get()
+        if text == self._typed:
+            return
+        self._typed = text
+        self._recall_pos = -1
+        if not text.strip():
+            self._hide_suggestions()
+            return
+        self._suggest_gen = self.suggester.request(text)
+        self.after(HISTORY_POLL_MS, self._poll_suggestions, self._suggest_gen)
+
+    def _poll_suggestions(self, gen):
+        if gen != self._suggest_gen:
+            return  # superseded by a newer keystroke
+        result = self.suggester.result(gen)
+        if result is None:
+            self.after(HISTORY_POLL_MS, self._poll_suggestions, gen)
+        elif result:
+            box = self.suggest_box
+            box.delete(0, 'end')
+            for text in result:
+                box.insert('end', text)
+            box.configure(height=len(result))
+            box.place(in_=self.entry, relx=0, rely=1.0, relwidth=1.0)
+            box.lift()
+        else:
+            self._hide_suggestions()
+
+    def _accept_suggestion(self, event=None):
+        box = self.suggest_box
+        if not box.winfo_ismapped():
+            return None
+        sel = box.curselection()
+        self._set_entry(box.get(sel[0] if sel else 0))
+        self._hide_suggestions()
+        self.entry.focus_set()
+        return 'break'
+
+    def _hide_suggestions(self):
+        self._suggest_gen += 1
+        self.suggest_box.selection_clear(0, 'end')
+        self.suggest_box.place_forget()
 
     # ---------------- UI callbacks ----------------
     def on_speak_click(self):
         self.set_status('Listening...')
         self.log('Listening for voice command...')
         def listen_and_handle():
-            txt = recognize_speech()
-            if txt:
-                self.log(f'You said: {txt}')
-                self.command_var.set(txt)
-                self.handle_query(txt)
-            else:
-                self.log('Voice not recognized.')
-                speak('Sorry, I did not get that.')
+            trace = tracer.begin('')
+            with tracer.activate(trace):
+                res = recognizer_service.listen()
+                txt = res.text if res else None
+                if res:
+                    self.log(f'Capture {res.capture_ms:.0f} ms, recognition {res.recognize_ms:.0f} ms ({res.backend or "no match"})')
+                if txt:
+                    if trace is not None:
+                        trace.query = txt
+                    self.log(f'You said: {txt}')
+                    self.command_var.set(txt)
+                    self.handle_query(txt)
+                else:
+                    if trace is not None:
+                        trace.intent = 'unrecognized'
+                    self.log('Voice not recognized.')
+                    speak('Sorry, I did not get that.')
+            if trace is not None:
+                trace.release()
             self.set_status('Ready')
-        threading.Thread(target=listen_and_handle, daemon=True).start()
+        self.engine.executor.submit(listen_and_handle, key='listen')
 
     def on_run_click(self):
         txt = self.command_var.get().strip()
@@ -475,12 +5369,16 @@ class AssistantGUI(tk.Tk):
         help_text = (
             'Try commands:\n'
             '- open youtube\n- play <song> on youtube\n- play music\n- time\n- date\n- screenshot\n- system info\n'
-            '- open notepad\n- search <term>\n- chat <something>\n- volume up / volume down / mute\n- brightness <0-100>\n- remind me in 10 seconds to take a break\n'
+            '- open notepad\n- search <term>\n- chat <something>\n- volume up / volume down / volume 40 / mute\n- brightness <0-100> / brightness up 20\n- remind me in 10 seconds to take a break\n- tell time and system info then play music\n- save macro morning routine as tell time then play music\n'
+            '- remind me every day at 9am to stretch\n- list reminders / cancel reminder <n> / snooze 10 minutes\n'
+            '- repeat (runs the last command again)\n- latency report\n'
+            '- train wake word / hands free on / stop listening\n\n'
+            'Up/Down recalls earlier commands; Tab accepts a suggestion.\n'
         )
         messagebox.showinfo('Help', help_text)
 
     def prompt_brightness(self):
-        val = tk.simpledialog.askinteger('Brightness', 'Enter brightness (0-100):', minvalue=0, maxvalue=100)
+        val = simpledialog.askinteger('Brightness', 'Enter brightness (0-100):', minvalue=0, maxvalue=100)
         if val is not None:
             self.set_brightness(val)
 
@@ -489,31 +5387,166 @@ class AssistantGUI(tk.Tk):
         self.attributes('-topmost', not current)
         self.log(f'Always on top set to {not current}')
 
+    def toggle_stats_panel(self):
+        if self.stats_panel is not None and self.stats_panel.winfo_exists():
+            self.stats_panel.destroy()
+            self.stats_panel = None
+        else:
+            telemetry.start()
+            self.stats_panel = StatsPanel(self)
+
     def save_log(self):
-        txt = self.logbox.get('1.0', 'end').strip()
-        if not txt:
+        if not self.session_log.count and not self.session_log.pending:
             self.log('Nothing to save in log.')
             return
         p = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('Text', '*.txt')])
         if p:
-            with open(p, 'w', encoding='utf-8') as f:
-                f.write(txt)
-            self.log(f'Log saved to {p}')
+            try:
+                self.session_log.copy_to(p)
+                self.log(f'Log saved to {p}')
+            except OSError as e:
+                self.log(f'Could not save log: {e}')
 
     def on_close(self):
         if messagebox.askokcancel('Quit', 'Do you really want to quit?'):
-            try:
-                engine.stop()
-            except Exception:
-                pass
+            self.engine.shutdown()
+            speech.stop()
+            recognizer_service.close()
+            self.session_log.close()
             self.destroy()
 
 
 # ----------------- MAIN -----------------
 
-def main():
+def startup_report(app, t_built, t_painted):
+    """Print cold-start timings once the background warm-up has finished."""
+    lines = [
+        'Startup profile (ms):',
+        f'  module import        {(_MODULE_READY - _MODULE_START) * 1000:8.1f}',
+        f'  build window         {(t_built - _MODULE_READY) * 1000:8.1f}',
+        f'  time to first paint  {(t_painted - _MODULE_START) * 1000:8.1f}',
+        f'  warm-up done         {(time.perf_counter() - _MODULE_START) * 1000:8.1f}',
+        '  lazy imports:',
+    ]
+    for name, secs in sorted(IMPORT_TIMES.items(), key=lambda kv: -kv[1]):
+        lines.append(f'    {name:<20} {secs * 1000:8.1f}')
+    if speech.init_ms is not None:
+        lines.append(f'    {"tts engine init":<20} {speech.init_ms:8.1f}')
+    print('\n'.join(lines))
+
+
+BATCH_SINKS = {
+    'null': NullSinks,
+    'print': lambda: RecordingSinks(echo=print),
+    'real': Sinks,
+}
+
+
+def run_batch(lines, sink_mode='null', quiet=False):
+    """Run commands (one per line) through a headless engine; returns intent counts.
+
+    Blank lines and lines starting with '#' are skipped.
+    """
+    install_sinks(BATCH_SINKS[sink_mode]())
+    tracer.path = None  # keep replayed commands out of the user's trace file
+    engine = AssistantEngine(log_fn=(lambda s: None) if quiet else print, inline=True,
+                             reminders_path=None, history_path=None, macros_path=None, app_usage_path=None)
+    engine.reminders.start()
+    counts = collections.Counter()
+    t0 = time.perf_counter()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        m = engine.handle_query(line)
+        counts[m.name if m else 'fallback'] += 1
+    elapsed = time.perf_counter() - t0
+    engine.shutdown()
+    n = sum(counts.values())
+    print(f'{n} commands in {elapsed:.3f}s ({n / max(elapsed, 1e-9):.0f}/s)', file=sys.stderr)
+    for name, c in counts.most_common():
+        print(f'  {name:<16} {c}', file=sys.stderr)
+    return counts
+
+
+def run_listen_wav(path, templates=(), transcripts=(), sink_mode='null', quiet=False):
+    """Feed a WAV file through VAD, wake word and recognition into a headless engine."""
+    install_sinks(BATCH_SINKS[sink_mode]())
+    tracer.path = None
+    log = (lambda s: None) if quiet else print
+    engine = AssistantEngine(log_fn=log, inline=True, reminders_path=None, history_path=None,
+                             macros_path=None, app_usage_path=None)
+    if templates:
+        matcher = WakeWordMatcher([segment_features(list(WavFileSource(t).frames())) for t in templates])
+    else:
+        matcher = WakeWordMatcher.from_dir()
+    recognizer = RecognizerService([ScriptedBackend(transcripts)]) if transcripts else recognizer_service
+    listener = HandsFreeListener(engine.handle_query, matcher, recognizer, log_fn=log)
+    source = WavFileSource(path)
+    t0 = time.perf_counter()
+    cpu0 = time.process_time()
+    listener.start(source)
+    listener.join()
+    elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+    engine.shutdown()
+    audio_s = listener.stats['frames'] * HF_FRAME_MS / 1000
+    print(f'{audio_s:.1f}s of audio in {elapsed:.2f}s; detector CPU {cpu / max(audio_s, 1e-9) * 100:.1f}% of real time',
+          file=sys.stderr)
+    for name in ('segments', 'wakes', 'commands', 'unrecognized', 'dropped'):
+        print(f'  {name:<14} {listener.stats[name]}', file=sys.stderr)
+    return listener.stats
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Desktop Voice Assistant')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='report time-to-first-paint and per-import costs, then exit')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run commands from FILE ('-' for stdin) without the GUI")
+    parser.add_argument('--sinks', choices=sorted(BATCH_SINKS), default='null',
+                        help='where batch side effects go: null (drop), print (echo), real (desktop)')
+    parser.add_argument('--quiet', action='store_true', help='batch mode: do not print log lines')
+    parser.add_argument('--no-trace', action='store_true', help='do not record per-command latency traces')
+    parser.add_argument('--listen-wav', metavar='WAV',
+                        help='run the hands-free pipeline over a 16-bit WAV file instead of the microphone')
+    parser.add_argument('--wake-template', metavar='WAV', action='append', default=[],
+                        help='--listen-wav: wake-word clip to match (default: the trained clips)')
+    parser.add_argument('--transcript', metavar='TEXT', action='append', default=[],
+                        help='--listen-wav: answer recognition with these texts instead of a real recognizer')
+    args = parser.parse_args(argv)
+    tracer.enabled = not args.no_trace
+
+    if args.listen_wav:
+        run_listen_wav(args.listen_wav, args.wake_template, args.transcript, args.sinks, args.quiet)
+        return
+
+    if args.batch:
+        if args.batch == '-':
+            run_batch(sys.stdin, args.sinks, args.quiet)
+        else:
+            with open(args.batch, encoding='utf-8') as f:
+                run_batch(f, args.sinks, args.quiet)
+        return
+
     app = AssistantGUI()
+    if args.startup_profile:
+        t_built = time.perf_counter()
+
+        def painted():
+            t_painted = time.perf_counter()
+
+            def report():
+                if not app.warmed.is_set() or speech.init_ms is None:
+                    app.after(20, report)
+                    return
+                startup_report(app, t_built, t_painted)
+                app.destroy()
+            report()
+        app.after_idle(painted)
     app.mainloop()
 
+_MODULE_READY = time.perf_counter()
+
 if __name__ == '__main__':
     main()